@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+"""Provides the AlertQueue class for non-blocking route change email alerts.
+
+Route change alerts are placed onto a bounded queue and sent by a background thread so that
+a large routing event can not stall the analysis run. Alerts of the same source/destination
+pair received within the digest window are coalesced, the alerts of every pair are sent as
+a single digest email through one reused SMTP session, and the amount of emails sent within
+the rate period is limited so the SMTP relay is not flooded. Alerts which could not be sent, e.g. as the
+SMTP server is unreachable, remain pending and are retried once the digest window has passed again.
+"""
+
+import collections
+import queue
+import smtplib
+import threading
+import time
+from classes.base import Jinja2Template
+from lib import email
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+# Queue markers used to request a flush of the pending digest and, for _CLOSE, the SMTP session to be closed.
+# Each marker is queued along with a threading.Event which is set once the marker has been processed and
+# a list the worker appends True to if no alerts remained pending.
+_FLUSH = object()
+_CLOSE = object()
+
+
+class AlertQueue(Jinja2Template):
+    """
+    Bounded queue of route change alerts, i.e. RouteComparison.changed_routes entries, which are
+    coalesced per pair and sent as digest emails by a background thread.
+    """
+    def __init__(self, jinja_template_file_path, email_to, email_from, subject, smtp_server="localhost",
+                 digest_window=300, max_emails=10, rate_period=3600, queue_size=1000, smtp_timeout=30):
+        """
+        :param jinja_template_file_path: file path of the email Jinja2 template
+        :param email_to: list of recipient email addresses
+        :param email_from: email address of the sender
+        :param subject: subject of the digest emails
+        :param smtp_server: IP address or FQDN of the SMTP server
+        :param digest_window: seconds alerts are collected for, starting from the first pending alert,
+                              before the digest is sent
+        :param max_emails: maximum amount of digest emails sent within rate_period
+        :param rate_period: period in seconds of the max_emails rate limit
+        :param queue_size: maximum amount of alerts waiting on the queue; further alerts are dropped
+        :param smtp_timeout: seconds to wait for the SMTP server before giving up on a digest
+        """
+        Jinja2Template.__init__(self, jinja_template_file_path)
+        self.email_to = email_to
+        self.email_from = email_from
+        self.subject = subject
+        self.smtp_server = smtp_server
+        self.digest_window = digest_window
+        self.max_emails = max_emails
+        self.rate_period = rate_period
+        self.smtp_timeout = smtp_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Latest alert of each pair waiting to be sent, keyed by (source_ip, destination_ip)
+        self._pending = collections.OrderedDict()
+        self._digest_start = None
+        self._sent_times = collections.deque()
+        self._smtp = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def put(self, alert):
+        """
+        Queues an alert without blocking
+        :param alert: RouteComparison.changed_routes entry
+        :return: True if queued, False if the queue is full and the alert was dropped
+        """
+        self._start_worker()
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            print("Error: Alert queue full, dropped %s to %s alert" % (alert['source_ip'], alert['destination_ip']))
+            return False
+        return True
+
+    def flush(self, close_session=False, timeout=None):
+        """
+        Sends the pending digest, ignoring the digest window, and blocks until every queued alert is processed
+        :param close_session: closes the SMTP session once the digest has been sent
+        :param timeout: seconds to wait for the queued alerts and digest to be processed; None waits indefinitely
+        :return: True if every alert has been sent within the timeout, False if the timeout passed or alerts remain
+                 pending as the rate limit was reached or the digest could not be sent
+        """
+        self._start_worker()
+        deadline = None if timeout is None else time.time() + timeout
+        processed, sent = threading.Event(), []
+        try:
+            self._queue.put((_CLOSE if close_session else _FLUSH, processed, sent), timeout=timeout)
+        except queue.Full:
+            return False
+        if not processed.wait(None if deadline is None else max(0.0, deadline - time.time())):
+            return False
+        return sent[0]
+
+    def close(self, timeout=60):
+        """
+        Sends the pending digest and closes the SMTP session
+        :param timeout: seconds to wait for the digest to be sent
+        :return: True if every alert has been sent, False otherwise
+        """
+        if self.flush(close_session=True, timeout=timeout):
+            return True
+        print("Error: %d route alert(s) not sent, %d alert(s) still queued after %g seconds"
+              % (len(self._pending), self._queue.qsize(), timeout))
+        return False
+
+    def _start_worker(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+
+    def _send_time(self):
+        """
+        :return: epoch time the pending digest is due to be sent, taking the rate limit into account
+        """
+        send_time = self._digest_start + self.digest_window
+        if len(self._sent_times) >= self.max_emails:
+            send_time = max(send_time, self._sent_times[0] + self.rate_period)
+        return send_time
+
+    def _coalesce(self, alert):
+        """
+        Replaces any pending alert of the pair with the latest alert, counting the coalesced route changes
+        :param alert: RouteComparison.changed_routes entry
+        :return: None
+        """
+        pair = (alert['source_ip'], alert['destination_ip'])
+        previous_alert = self._pending.pop(pair, None)
+        alert = dict(alert, changes=alert.get('changes', 1))
+        if previous_alert is not None:
+            alert['changes'] += previous_alert['changes']
+            alert['status'] = previous_alert['status'] if alert['status'] == previous_alert['status'] else 'FLAP'
+        self._pending[pair] = alert
+        if self._digest_start is None:
+            self._digest_start = time.time()
+
+    def _worker(self):
+        while True:
+            timeout = None
+            if self._pending:
+                timeout = max(0.0, self._send_time() - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            marker, processed, sent = item if isinstance(item, tuple) else (None, None, None)
+            try:
+                if item is not None and marker is None:
+                    self._coalesce(item)
+                if self._pending and (marker is not None or time.time() >= self._send_time()):
+                    self._send_digest()
+                if marker is _CLOSE:
+                    self._close_session()
+            except Exception as error:
+                # Keeps the worker running; the pending alerts are retried once the digest window has passed
+                print("Error: Unable to send the route alert digest - %s" % error)
+                self._retry_later()
+            finally:
+                if processed is not None:
+                    sent.append(not self._pending)
+                    processed.set()
+                if item is not None:
+                    self._queue.task_done()
+
+    def _retry_later(self):
+        """
+        Restarts the digest window of the pending alerts so a failed digest is not retried immediately
+        :return: None
+        """
+        if self._pending:
+            self._digest_start = time.time()
+
+    def _send_digest(self):
+        """
+        Sends the pending alerts as one email unless the rate limit has been reached. The alerts remain pending
+        until the email has been sent.
+        :return: None
+        """
+        now = time.time()
+        while self._sent_times and self._sent_times[0] <= now - self.rate_period:
+            self._sent_times.popleft()
+        if len(self._sent_times) >= self.max_emails:
+            print("Rate limit reached (%d emails per %d seconds), holding back %d route alert(s)"
+                  % (self.max_emails, self.rate_period, len(self._pending)))
+            return
+
+        changed_routes = list(self._pending.values())
+        email_message = self.render_template_output(changed_routes=changed_routes)
+        if email_message is None:
+            self._retry_later()
+            return
+        try:
+            self._send_mail(email_message)
+        except (smtplib.SMTPException, OSError) as error:
+            print("Error: Unable to send notification email via %s - %s" % (self.smtp_server, error))
+            self._close_session()
+            self._retry_later()
+            return
+        self._pending.clear()
+        self._digest_start = None
+        self._sent_times.append(now)
+        print("Notification email for %d route(s) sent to %s" % (len(changed_routes), ", ".join(self.email_to)))
+
+    def _send_mail(self, email_message):
+        """
+        Sends the email through the open SMTP session, reconnecting once if the server closed the session
+        :param email_message: HTML email body
+        :return: None
+        """
+        for attempt in range(2):
+            if self._smtp is None:
+                self._smtp = smtplib.SMTP(self.smtp_server, timeout=self.smtp_timeout)
+            try:
+                email.send_mail(self.email_to, self.email_from, self.subject, email_message, smtp=self._smtp)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt:
+                    raise
+
+    def _close_session(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
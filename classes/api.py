@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""Provides the QueryAPI class and a read-only HTTP/JSON server for psTrace analysis results.
+
+The results of the latest analysis run (matrix cells, per pair route statistics, route comparison
+state, reverse DNS, force graph and hop index) are held within in-memory indexes and served as JSON.
+Responses carry an ETag so that polling clients receive a 304 response if nothing has changed.
+The most recently used responses are cached until the next update; unknown query parameters are ignored.
+
+Endpoints:
+    /matrix, /route_stats, /route_changes, /rdns, /force_graph, /hops
+Filters (query string): source, destination, as, status
+When several meshes are analysed the endpoints of each mesh are served under /<mesh name>/ e.g. /core/matrix
+"""
+
+import collections
+import hashlib
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+class QueryAPI:
+    """
+    In-memory indexes of the latest analysis results along with the query logic of the HTTP server.
+    update() swaps in a new set of results atomically and clears the cached responses. The QueryAPI of
+    each mesh, see mesh(), answers the requests under /<mesh name>/.
+    """
+    ENDPOINTS = ('/matrix', '/route_stats', '/route_changes', '/rdns', '/force_graph', '/hops')
+    FILTERS = ('source', 'destination', 'as', 'status')
+
+    def __init__(self, cache_size=256):
+        """
+        :param cache_size: maximum amount of responses cached; the least recently used response is evicted
+        """
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._responses = collections.OrderedDict()
+        self.pairs = {}
+        self.matrix = []
+        self.route_changes = []
+        self.rdns = {}
+        self.force_graph = []
+        self.hops = {}
+        self.pairs_by_as = {}
+        self.pairs_by_status = {}
+        # {mesh name: QueryAPI of the mesh}
+        self.meshes = {}
+
+    def mesh(self, name):
+        """
+        :param name: name of the mesh
+        :return: QueryAPI serving the results of the mesh under /<name>/, created on first use
+        """
+        with self._lock:
+            if name not in self.meshes:
+                self.meshes[name] = QueryAPI(self.cache_size)
+                self._responses = collections.OrderedDict()
+            return self.meshes[name]
+
+    def update(self, ps_trace, matrix, rdns):
+        """
+        Replaces the served results with those of a completed analysis run
+        :param ps_trace: PsTrace object used for the analysis run
+        :param matrix: matrix dictionary created by main i.e. {source_ip: {destination_ip: {'rtt':, 'fp_html':}}}
+        :param rdns: ReverseDNS object
+        :return: None
+        """
+        pairs, pairs_by_as, pairs_by_status = {}, {}, {}
+        for (source_ip, destination_ip), information in ps_trace.latest_routes.items():
+            route_stats = [dict(hop) for hop in information['route_stats']]
+            pairs[source_ip, destination_ip] = {'source': source_ip,
+                                                'destination': destination_ip,
+                                                'source_domain': information['source_domain'],
+                                                'destination_domain': information['destination_domain'],
+                                                'test_time': information['test_time'],
+                                                'route_stats': route_stats}
+            for hop in route_stats:
+                pairs_by_as.setdefault(str(hop['as']), set()).add((source_ip, destination_ip))
+                pairs_by_status.setdefault(hop['status'], set()).add((source_ip, destination_ip))
+
+        matrix_cells = []
+        for source_ip, destinations in sorted(matrix.items()):
+            for destination_ip, cell in sorted(destinations.items()):
+                statuses = [hop['status'] for hop in pairs.get((source_ip, destination_ip), {}).get('route_stats', [])]
+                matrix_cells.append({'source': source_ip,
+                                     'destination': destination_ip,
+                                     'rtt': cell['rtt'],
+                                     'fp_html': cell['fp_html'],
+                                     'status': 'warn' if 'warn' in statuses else 'okay' if statuses else 'unknown'})
+
+        changed_routes = {(route['source_ip'], route['destination_ip']): route['status']
+                          for route in ps_trace.route_comparison.changed_routes}
+        route_changes = []
+        for source_ip, destinations in sorted(ps_trace.route_comparison.get_data().items()):
+            for destination_ip, comparison in sorted(destinations.items()):
+                status = 'FLAPPING' if comparison.get('flapping') else 'STABLE'
+                route_changes.append({'source': source_ip,
+                                      'destination': destination_ip,
+                                      'status': changed_routes.get((source_ip, destination_ip), status),
+                                      'first_test_time': comparison.get('first_result', {}).get('test_time'),
+                                      'second_test_time': comparison.get('second_result', {}).get('test_time')})
+
+        with self._lock:
+            self.pairs, self.pairs_by_as, self.pairs_by_status = pairs, pairs_by_as, pairs_by_status
+            self.matrix = matrix_cells
+            self.route_changes = route_changes
+            self.rdns = dict(rdns.get_data())
+            self.force_graph = list(ps_trace.force_graph.get_data())
+            self.hops = dict(ps_trace.network_index.get_data())
+            self._responses = collections.OrderedDict()
+
+    def _matches_pair(self, source_ip, destination_ip, filters, route_filters=True):
+        """
+        :param route_filters: whether the as and status filters are matched against the pair's latest route
+        :return: True if the pair satisfies the source, destination, as and status filters
+        """
+        def matches_node(ip, value):
+            return value is None or value in (ip, self.rdns.get(ip))
+
+        if not (matches_node(source_ip, filters.get('source')) and
+                matches_node(destination_ip, filters.get('destination'))):
+            return False
+        if not route_filters:
+            return True
+        if 'as' in filters and (source_ip, destination_ip) not in self.pairs_by_as.get(filters['as'], ()):
+            return False
+        if 'status' in filters and (source_ip, destination_ip) not in self.pairs_by_status.get(filters['status'], ()):
+            return False
+        return True
+
+    def query(self, path, filters):
+        """
+        Performs a query against the in-memory indexes
+        :param path: endpoint e.g. /matrix
+        :param filters: dictionary of query filters (source, destination, as, status)
+        :return: JSON serialisable result or None if the endpoint does not exist
+        """
+        if path == '/':
+            return {'endpoints': self.ENDPOINTS, 'filters': list(self.FILTERS), 'meshes': sorted(self.meshes)}
+        if path == '/matrix':
+            return [cell for cell in self.matrix
+                    if self._matches_pair(cell['source'], cell['destination'], filters)]
+        if path == '/route_stats':
+            return [pair for key, pair in sorted(self.pairs.items()) if self._matches_pair(*key, filters)]
+        if path == '/route_changes':
+            return [change for change in self.route_changes
+                    if self._matches_pair(change['source'], change['destination'], filters, route_filters=False)
+                    and filters.get('status', change['status']).upper() == change['status']]
+        if path == '/rdns':
+            return {ip: domain for ip, domain in self.rdns.items()
+                    if all(filters.get(key, ip) in (ip, domain) for key in ('source', 'destination'))}
+        if path == '/force_graph':
+            return [node for node in self.force_graph if filters.get('status', node['type']) == node['type']]
+        if path == '/hops':
+            return {ip: hop for ip, hop in self.hops.items()
+                    if filters.get('as', str(hop['as'])) == str(hop['as']) and
+                    filters.get('status', hop['status']) == hop['status']}
+        return
+
+    def response(self, path, query_string):
+        """
+        Returns the serialised JSON response of a request, caching it until the next update or until it is
+        the least recently used of cache_size cached responses
+        :param path: endpoint e.g. /matrix, or /<mesh name>/<endpoint> e.g. /core/matrix
+        :param query_string: URL query string e.g. source=192.168.0.1&status=warn
+        :return: (HTTP status code, body, ETag)
+        """
+        mesh_name, _, mesh_path = path[1:].partition('/')
+        if '/' + mesh_name not in self.ENDPOINTS and mesh_name in self.meshes:
+            return self.meshes[mesh_name].response('/' + mesh_path, query_string)
+        filters = {key: values[-1] for key, values in urllib.parse.parse_qs(query_string).items()
+                   if key in self.FILTERS}
+        cache_key = (path, tuple(sorted(filters.items())))
+        with self._lock:
+            try:
+                self._responses.move_to_end(cache_key)
+                return self._responses[cache_key]
+            except KeyError:
+                pass
+            result = self.query(path, filters)
+            if result is None:
+                return 404, b'{"error": "Unknown endpoint"}', None
+            body = json.dumps(result, separators=(',', ':')).encode('utf-8')
+            self._responses[cache_key] = (200, body, '"%s"' % hashlib.sha1(body).hexdigest())
+            if len(self._responses) > self.cache_size:
+                self._responses.popitem(last=False)
+            return self._responses[cache_key]
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET requests from the QueryAPI set on the HTTP server, answering a matching
+    If-None-Match header with a 304 Not Modified response.
+    """
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        status, body, etag = self.server.query_api.response(url.path.rstrip('/') or '/', url.query)
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def serve(query_api, host='127.0.0.1', port=8080):
+    """
+    Starts the read-only query API server within a background thread
+    :param query_api: QueryAPI to serve
+    :param host: address to listen on
+    :param port: port to listen on
+    :return: ThreadingHTTPServer; call shutdown() to stop the server
+    """
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.query_api = query_api
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Query API listening on http://%s:%d" % (host, server.server_address[1]))
+    return server
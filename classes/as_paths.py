@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""Provides the ASPaths class for AS level aggregation of the latest routes of every pair.
+
+All routes of a run are aggregated in one pass into per pair AS paths, per AS hop counts and
+latency deltas (the RTT added while crossing the AS) and an AS level graph. The AS segments of a
+pair are cached between runs and only recomputed when the pair's IP route has changed.
+"""
+
+import statistics
+import zlib
+from classes.base import DataStore
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+def _hop_rtt(hop):
+    """
+    :param hop: Hop object or hop dictionary
+    :return: median RTT of the hop, falling back to its latest RTT, or None if neither is a number
+    """
+    for key in ('median', 'rtt'):
+        value = hop.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+    return
+
+
+class ASPaths(DataStore):
+    """
+    AS level aggregation of the latest route of each pair.
+    Data store example:
+        {
+            "pairs": {
+                "192.168.0.1": {
+                    "192.168.1.1": {
+                        "path_id": 3652167209,
+                        "as_path": [7610, 7473],
+                        "segments": [[7610, 0, 2, 3], [7473, 3, 6, 4]],
+                        "deltas": [1.2, 38.5]
+                    }
+                }
+            },
+            "ases": {"7610": {"hops": 5, "pairs": 3, "min_delta": 0.8, "median_delta": 1.2, "max_delta": 4.1}},
+            "edges": [[7610, 7473, 3]]
+        }
+    segments are [AS number, first hop index, last hop index, amount of hops within the AS] and deltas
+    the RTT increase (ms) from the last hop before the AS, or the source, to the last hop within the AS.
+    """
+    def __init__(self):
+        DataStore.__init__(self)
+        self.data_store = {'pairs': {}, 'ases': {}, 'edges': []}
+
+    @staticmethod
+    def path_id(route):
+        """
+        :param route: list of Hop objects or hop dictionaries
+        :return: 32 bit ID of the IP route
+        """
+        return zlib.crc32('|'.join(str(hop.get('ip')) for hop in route).encode('utf-8'))
+
+    @staticmethod
+    def as_segments(route):
+        """
+        Splits a route into consecutive AS segments. Hops with an unknown AS, e.g. timeouts, do not start a
+        new segment and only count towards a segment if surrounded by hops of the same AS.
+        :param route: list of Hop objects or hop dictionaries
+        :return: list of [AS number, first hop index, last hop index, amount of hops within the AS]
+        """
+        segments = []
+        for index, hop in enumerate(route):
+            asn = hop.get('as')
+            if not isinstance(asn, int) or asn < 0:
+                continue
+            if segments and segments[-1][0] == asn:
+                segments[-1][2] = index
+                segments[-1][3] += 1
+            else:
+                segments.append([asn, index, index, 1])
+        return segments
+
+    @staticmethod
+    def latency_deltas(route, segments):
+        """
+        :param route: list of Hop objects or hop dictionaries
+        :param segments: AS segments of the route, see as_segments
+        :return: list of the RTT increase within each segment, None where the RTTs are unknown
+        """
+        deltas = []
+        previous_rtt = 0.0
+        for _, _, last_hop_index, _ in segments:
+            rtt = _hop_rtt(route[last_hop_index])
+            deltas.append(None if rtt is None or previous_rtt is None else round(rtt - previous_rtt, 2))
+            previous_rtt = rtt
+        return deltas
+
+    def update(self, latest_routes):
+        """
+        Aggregates the latest route of every pair, reusing the cached AS segments of pairs whose route is unchanged
+        :param latest_routes: {(source_ip, destination_ip): Traceroute.information} e.g. PsTrace.latest_routes
+        :return: data store
+        """
+        cached_pairs = self.data_store.get('pairs', {})
+        pairs, as_hops, as_pairs, as_deltas, edges = {}, {}, {}, {}, {}
+        for (source_ip, destination_ip), information in sorted(latest_routes.items()):
+            route = information['route_stats']
+            path_id = self.path_id(route)
+            cached = cached_pairs.get(source_ip, {}).get(destination_ip)
+            if cached and cached.get('path_id') == path_id:
+                segments = cached['segments']
+            else:
+                segments = self.as_segments(route)
+            deltas = self.latency_deltas(route, segments)
+            as_path = [segment[0] for segment in segments]
+            pairs.setdefault(source_ip, {})[destination_ip] = {'path_id': path_id,
+                                                               'as_path': as_path,
+                                                               'segments': segments,
+                                                               'deltas': deltas}
+
+            for (asn, first_hop_index, last_hop_index, _), delta in zip(segments, deltas):
+                segment_route = route[first_hop_index:last_hop_index + 1]
+                as_hops.setdefault(asn, set()).update(hop.get('ip') for hop in segment_route if hop.get('as') == asn)
+                as_pairs[asn] = as_pairs.get(asn, 0) + 1
+                if delta is not None:
+                    as_deltas.setdefault(asn, []).append(delta)
+            for edge in zip(as_path, as_path[1:]):
+                edges[edge] = edges.get(edge, 0) + 1
+
+        ases = {}
+        for asn in sorted(as_pairs):
+            deltas = sorted(as_deltas.get(asn, []))
+            ases[str(asn)] = {'hops': len(as_hops[asn]),
+                              'pairs': as_pairs[asn],
+                              'min_delta': deltas[0] if deltas else None,
+                              'median_delta': round(statistics.median(deltas), 2) if deltas else None,
+                              'max_delta': deltas[-1] if deltas else None}
+        self.data_store = {'pairs': pairs,
+                           'ases': ases,
+                           'edges': [[source_asn, target_asn, count]
+                                     for (source_asn, target_asn), count in sorted(edges.items())]}
+        return self.data_store
+
+    def graph(self):
+        """
+        AS level graph of the aggregated routes in the same form as the ForceGraph data
+        :return: list of {"source": "AS7610", "target": "AS7473", "pairs": 3}
+        """
+        return [{'source': "AS%d" % source_asn, 'target': "AS%d" % target_asn, 'pairs': count}
+                for source_asn, target_asn, count in self.data_store['edges']]
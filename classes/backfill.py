@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""Provides the Backfill class for importing the traceroute history of perfSONAR Measurement Archives.
+
+The date range is split into time-sliced chunks per metadata key which are retrieved in parallel.
+Chunks of a metadata key are loaded in chronological order so that the end of the last loaded chunk
+can be checkpointed, allowing an interrupted backfill to resume where it stopped. Tests already held by
+the local stores, e.g. from the regular runs, are not stored again.
+
+Besides https MAs, a local replayed archive can be given as a file:// URL of a directory containing
+    index.json - the archive listing i.e. the response of /esmond/perfsonar/archive/?event-type=packet-trace
+    <metadata key>/packet-trace/base.json - the packet-trace results of each metadata key
+"""
+
+import concurrent.futures
+import json
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+from classes.base import DataStore
+from classes.traceroute.hop import TracerouteSeries
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+def chunk_ranges(start, end, chunk_size):
+    """
+    :param start: epoch start of the date range
+    :param end: epoch end of the date range (exclusive)
+    :param chunk_size: seconds covered by each chunk
+    :return: list of (chunk start, chunk end) covering the date range
+    """
+    return [(chunk_start, min(chunk_start + chunk_size, end)) for chunk_start in range(start, end, chunk_size)]
+
+
+class Backfill(DataStore):
+    """
+    Checkpoints of the metadata keys being backfilled.
+    Data store example:
+        {
+            "https://ps.example.net/esmond/perfsonar/archive/abc/": {
+                "source": "192.168.0.1",
+                "destination": "192.168.1.1",
+                "start": 1483228800,
+                "loaded_until": 1484438400
+            }
+        }
+    """
+    def __init__(self, start, end, chunk_size=86400, workers=4, timeout=60, url_encoding='utf-8'):
+        """
+        :param start: epoch start of the date range to backfill
+        :param end: epoch end of the date range to backfill (exclusive)
+        :param chunk_size: seconds of tests retrieved per request
+        :param workers: amount of chunks retrieved in parallel
+        :param timeout: seconds to wait for the response of a chunk
+        :param url_encoding: encoding of the responses
+        """
+        DataStore.__init__(self)
+        self.start = int(start)
+        self.end = int(end)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.timeout = timeout
+        self.url_encoding = url_encoding
+        self.bytes = 0
+        ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLSv1)
+        self._opener = urllib.request.build_opener(urllib.request.HTTPSHandler(context=ssl_context))
+        self._lock = threading.Lock()
+        self._local_lock = threading.Lock()
+        # Results of each metadata key of local archives, {metadata key URL: results}
+        self._local_results = {}
+
+    def _retrieve(self, json_url):
+        with self._opener.open(json_url, timeout=self.timeout) as json_data:
+            json_bytes = json_data.read()
+        with self._lock:
+            self.bytes += len(json_bytes)
+        return json.loads(json_bytes.decode(self.url_encoding))
+
+    @staticmethod
+    def _is_local(url):
+        return urllib.parse.urlsplit(url).scheme == 'file'
+
+    def list_tests(self, ma_url):
+        """
+        :param ma_url: IP or base domain of a perfSONAR MA, or file:// URL of a local archive directory
+        :return: list of (metadata key URL, source IP, destination IP) of the MA's traceroute tests
+        """
+        if self._is_local(ma_url):
+            archive_url = ma_url.rstrip('/')
+            listing = self._retrieve("%s/index.json" % archive_url)
+        else:
+            archive_url = "https://%s" % ma_url
+            listing = self._retrieve("%s/esmond/perfsonar/archive/?event-type=packet-trace&time-start=%d&time-end=%d"
+                                     % (archive_url, self.start, self.end - 1))
+        tests = []
+        for singular_test in listing:
+            url = urllib.parse.urlsplit(singular_test['url'], scheme="https")
+            if self._is_local(ma_url):
+                metadata_url = "%s/%s/" % (archive_url, url.path.rstrip('/').rsplit('/', 1)[-1])
+            else:
+                metadata_url = "https://{}{}".format(url.netloc, url.path)
+            tests.append((metadata_url, singular_test['source'], singular_test['destination']))
+        return tests
+
+    def retrieve_chunk(self, metadata_url, chunk_start, chunk_end):
+        """
+        :param metadata_url: metadata key URL returned by list_tests
+        :param chunk_start: epoch start of the chunk
+        :param chunk_end: epoch end of the chunk (exclusive)
+        :return: packet-trace results within the chunk, oldest first
+        """
+        if not self._is_local(metadata_url):
+            results = self._retrieve("%spacket-trace/base?time-start=%d&time-end=%d"
+                                     % (metadata_url, chunk_start, chunk_end - 1))
+        else:
+            # Loaded once per metadata key; reading local files in parallel gains nothing as parsing holds the GIL
+            with self._local_lock:
+                if metadata_url not in self._local_results:
+                    self._local_results[metadata_url] = self._retrieve("%spacket-trace/base.json" % metadata_url)
+                results = self._local_results[metadata_url]
+        return sorted((result for result in results if chunk_start <= result['ts'] < chunk_end),
+                      key=lambda result: result['ts'])
+
+    def run(self, ma_urls, load, checkpoint_fp=None, report_interval=10):
+        """
+        Backfills the traceroute tests of the MAs, skipping the chunks loaded by a previous run from the same start
+        :param ma_urls: IPs or base domains of the perfSONAR MAs, or file:// URLs of local archive directories
+        :param load: function called with (source IP, destination IP, TracerouteSeries, (chunk start, chunk end))
+                     for each chunk, in order, returning the amount of tests it stored
+        :param checkpoint_fp: file path the checkpoints are saved to
+        :param report_interval: seconds between throughput reports
+        :return: True if any test was loaded, including tests the stores already held, otherwise False
+        """
+        tests = []
+        for ma_url in ma_urls:
+            try:
+                tests.extend(self.list_tests(ma_url))
+            except (OSError, ValueError) as error:
+                print("%s - Unable to retrieve the archive listing of %s. Continuing..." % (error, ma_url))
+
+        # Chunks not yet loaded, {metadata key URL: [(chunk start, chunk end), ...]}
+        remaining = {}
+        for metadata_url, source_ip, destination_ip in tests:
+            checkpoint = self.data_store.get(metadata_url, {})
+            loaded_until = self.start
+            if checkpoint.get('start') == self.start:
+                # Resumes a backfill from the same start, e.g. an interrupted run or one extended to a later end
+                loaded_until = min(max(checkpoint.get('loaded_until', self.start), self.start), self.end)
+            self.data_store[metadata_url] = {'source': source_ip,
+                                             'destination': destination_ip,
+                                             'start': self.start,
+                                             'loaded_until': loaded_until}
+            remaining[metadata_url] = chunk_ranges(loaded_until, self.end, self.chunk_size)
+
+        total_chunks = sum(len(chunks) for chunks in remaining.values())
+        print("Backfilling %d traceroute test(s): %d chunk(s) of %d seconds, %d chunk(s) already loaded"
+              % (len(tests), total_chunks, self.chunk_size,
+                 len(tests) * len(chunk_ranges(self.start, self.end, self.chunk_size)) - total_chunks))
+        chunks_done = tests_retrieved = tests_stored = 0
+        started = reported = time.time()
+        # Retrieved chunks waiting for an earlier chunk of the same metadata key, {metadata key URL: {start: results}}
+        retrieved = {metadata_url: {} for metadata_url in remaining}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.retrieve_chunk, metadata_url, chunk_start, chunk_end):
+                       (metadata_url, chunk_start)
+                       for metadata_url, chunks in remaining.items() for chunk_start, chunk_end in chunks}
+            for future in concurrent.futures.as_completed(futures):
+                metadata_url, chunk_start = futures[future]
+                chunks_done += 1
+                if metadata_url not in retrieved:
+                    # An earlier chunk of the metadata key failed; resumed by the next run
+                    continue
+                try:
+                    retrieved[metadata_url][chunk_start] = future.result()
+                except (OSError, ValueError) as error:
+                    print("%s - Unable to retrieve %s from %d. Continuing..." % (error, metadata_url, chunk_start))
+                    del retrieved[metadata_url]
+                    continue
+
+                checkpoint = self.data_store[metadata_url]
+                pending = retrieved[metadata_url]
+                while remaining[metadata_url] and remaining[metadata_url][0][0] in pending:
+                    next_start, next_end = remaining[metadata_url].pop(0)
+                    series = TracerouteSeries.from_esmond(pending.pop(next_start))
+                    tests_retrieved += len(series)
+                    tests_stored += load(checkpoint['source'], checkpoint['destination'], series,
+                                         (next_start, next_end))
+                    checkpoint['loaded_until'] = next_end
+
+                if time.time() - reported >= report_interval:
+                    self.report(chunks_done, total_chunks, tests_retrieved, tests_stored, time.time() - started)
+                    if checkpoint_fp is not None:
+                        self.save_as_json_file(checkpoint_fp)
+                    reported = time.time()
+
+        self.report(chunks_done, total_chunks, tests_retrieved, tests_stored, time.time() - started)
+        if checkpoint_fp is not None:
+            self.save_as_json_file(checkpoint_fp)
+        return tests_retrieved > 0
+
+    def report(self, chunks_done, total_chunks, tests_retrieved, tests_stored, elapsed):
+        """
+        Prints the progress and throughput of the backfill
+        :return: None
+        """
+        elapsed = max(elapsed, 0.001)
+        print("%d/%d chunks, %d tests retrieved, %d stored (others already held), %.1f tests/s, %.1f chunks/s, "
+              "%.2f MB/s" % (chunks_done, total_chunks, tests_retrieved, tests_stored, tests_retrieved / elapsed,
+                             chunks_done / elapsed, self.bytes / elapsed / 1000000))
@@ -5,7 +5,7 @@ TODO: Add Description
 
 import json
 import os.path
-import jinja2
+import time
 
 __author__ = "Simon Peter Green"
 __copyright__ = "Copyright (c) 2017 spgreen"
@@ -17,6 +17,19 @@ __email__ = "simonpetergreen@singaren.net.sg"
 __status__ = "Development"
 
 
+def format_timestamp(timestamp):
+    """
+    Jinja2 filter which changes an epoch timestamp to the locale's date and time representation.
+    Values that are not timestamps, e.g. previously saved date strings, are returned unchanged.
+    :param timestamp: epoch timestamp e.g. 1485920150
+    :return: str
+    """
+    try:
+        return time.strftime("%c", time.localtime(int(timestamp)))
+    except (TypeError, ValueError):
+        return timestamp
+
+
 class Jinja2Template:
     """
     TODO: Add Description
@@ -30,12 +43,15 @@ class Jinja2Template:
         :param template_variables: variables used within said template
         :return: rendered page or None if template could not be found
         """
+        # Imported on first render so that using the data stores does not load the templating subsystem
+        import jinja2
         path, template_file = os.path.split(self.jinja_template_fp)
         # Sets path to current directory with "." if path variable is empty
         if not path:
             path = '.'
         template_loader = jinja2.FileSystemLoader(path)
         template_env = jinja2.Environment(loader=template_loader)
+        template_env.filters['datetime'] = format_timestamp
         try:
             template = template_env.get_template(template_file)
         except jinja2.exceptions.TemplateNotFound:
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+"""Provides the PairBundles class for the bundled traceroute detail output mode.
+
+Instead of rendering a traceroute.html.j2 page per source/destination pair, the details of each
+pair (latest route statistics and historical routes) are stored within a fixed amount of sharded,
+compact JSON bundles along with an index. A single static traceroute.html page loads the bundle
+of the selected pair and renders it client side.
+"""
+
+import json
+import os.path
+import zlib
+from classes.base import DataStore
+from lib.static_output import minify_json
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+# Hop values stored within the bundles, in order
+HOP_FIELDS = ('ip', 'hostname', 'as', 'rtt', 'min', 'median', 'threshold', 'status')
+
+
+class PairBundles(DataStore):
+    """
+    Stores the traceroute details of each pair, keyed by pair key e.g. 192.168.0.1-to-192.168.1.1
+    Bundle example:
+        {
+            "192.168.0.1-to-192.168.1.1": {
+                "source_ip": "192.168.0.1",
+                "dest_ip": "192.168.1.1",
+                "start_date": 1485900150,
+                "end_date": 1485920150,
+                "traceroute": [["192.168.0.254", "gw.example.net", 7610, 0.52, 0.41, 0.5, 0.71, "okay"], ...],
+                "historical_routes": [{"date_time": 1485910150, "route_info": [[...], ...]}, ...],
+                "rtt_sparkline": "0.0,40.0 1.2,38.5 ..."
+            }
+        }
+    """
+    def __init__(self, shards=16):
+        """
+        :param shards: amount of JSON bundles the pairs are spread across
+        """
+        DataStore.__init__(self)
+        self.shards = shards
+
+    @staticmethod
+    def pair_key(source_ip, destination_ip):
+        """
+        :return: key of the pair; colons of IPv6 addresses are replaced with full-stops to match the page file names
+        """
+        return "{source}-to-{dest}".format(source=source_ip, dest=destination_ip).replace(":", ".")
+
+    def shard(self, pair_key):
+        """
+        :param pair_key: key returned by pair_key()
+        :return: shard number the pair is stored within
+        """
+        return zlib.crc32(pair_key.encode('utf-8')) % self.shards
+
+    @staticmethod
+    def _compact_route(route):
+        return [[hop.get(field, '') for field in HOP_FIELDS] for hop in route]
+
+    def add(self, source_ip, destination_ip, traceroute_details):
+        """
+        Adds the details of a pair to the bundles
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param traceroute_details: dictionary returned by TracerouteAnalysis.traceroute_details
+        :return: key of the pair
+        """
+        pair_key = self.pair_key(source_ip, destination_ip)
+        historical_routes = [{'date_time': historical_route['date_time'],
+                              'route_info': self._compact_route(historical_route['route_info'])}
+                             for historical_route in traceroute_details['historical_routes'] or []]
+        self.data_store[pair_key] = {'source_ip': traceroute_details['source_ip'],
+                                     'dest_ip': traceroute_details['dest_ip'],
+                                     'start_date': traceroute_details['start_date'],
+                                     'end_date': traceroute_details['end_date'],
+                                     'traceroute': self._compact_route(traceroute_details['traceroute']),
+                                     'historical_routes': historical_routes,
+                                     'rtt_sparkline': traceroute_details.get('rtt_sparkline', '')}
+        return pair_key
+
+    def load_bundles(self, directory):
+        """
+        Loads the pairs of previously saved bundles, e.g. to keep the details of pairs that are not analysed this run
+        :param directory: directory the bundles were saved within
+        :return: None
+        """
+        for shard in range(self.shards):
+            try:
+                with open(os.path.join(directory, "pairs-%d.json" % shard), "r") as bundle:
+                    self.data_store.update(json.load(bundle))
+            except (FileNotFoundError, ValueError):
+                continue
+
+    def retain(self, pair_keys):
+        """
+        Removes the pairs not found within pair_keys
+        :param pair_keys: keys of the pairs to keep, see pair_key()
+        :return: None
+        """
+        pair_keys = set(pair_keys)
+        self.data_store = {pair_key: details for pair_key, details in self.data_store.items() if pair_key in pair_keys}
+
+    def save_bundles(self, directory, write_static_file):
+        """
+        Saves the pairs within sharded JSON bundles (pairs-<shard>.json) and the bundle index (index.json)
+        :param directory: directory the bundles are saved within
+        :param write_static_file: function used to write the files, see lib/static_output.py
+        :return: None
+        """
+        os.makedirs(directory, exist_ok=True)
+        shards = {}
+        for pair_key, details in self.data_store.items():
+            shards.setdefault(self.shard(pair_key), {})[pair_key] = details
+        for shard, pairs in shards.items():
+            write_static_file(os.path.join(directory, "pairs-%d.json" % shard), minify_json(pairs))
+        index = {'hop_fields': HOP_FIELDS,
+                 'pairs': {pair_key: self.shard(pair_key) for pair_key in sorted(self.data_store)}}
+        write_static_file(os.path.join(directory, "index.json"), minify_json(index))
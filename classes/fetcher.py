@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+"""Provides the ArchiveFetcher class, a shared and caching HTTP client for perfSONAR Measurement Archives.
+
+When several meshes are analysed within one process they share one ArchiveFetcher so that the
+archive listing of a MA and the packet-trace results of each metadata key are only retrieved once.
+Only metadata keys listed by more than one mesh are cached, as a packed TracerouteSeries for the longest
+time range requested; requests for a shorter time range are answered from the cache by filtering out the
+older tests. A cached series is released once the last mesh listing its metadata key has been analysed.
+"""
+
+import collections
+import json
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+from classes.traceroute.hop import TracerouteSeries
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+class ArchiveFetcher:
+    """
+    Retrieves JSON from perfSONAR Measurement Archives through one SSL context and URL opener,
+    caching the archive listings for the lifetime of the object and the packet-trace results of
+    metadata keys shared between meshes until their last mesh has been analysed.
+    """
+    def __init__(self, timeout=10, url_encoding='utf-8'):
+        """
+        :param timeout: seconds to wait for a response
+        :param url_encoding: encoding of the responses
+        """
+        self.timeout = timeout
+        self.url_encoding = url_encoding
+        self.requests = 0
+        ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLSv1)
+        self._opener = urllib.request.build_opener(urllib.request.HTTPSHandler(context=ssl_context))
+        self._lock = threading.Lock()
+        self._responses = {}
+        # {metadata key URL: amount of meshes yet to be analysed listing the metadata key}
+        self._uses = collections.Counter()
+        # {metadata key URL: (time retrieved, time range, TracerouteSeries)}
+        self._packet_traces = {}
+
+    def _retrieve(self, json_url):
+        with self._opener.open(json_url, timeout=self.timeout) as json_data:
+            json_string = json_data.read().decode(self.url_encoding)
+        with self._lock:
+            self.requests += 1
+        return json.loads(json_string)
+
+    @staticmethod
+    def _split_packet_trace_url(json_url):
+        """
+        :param json_url: URL e.g. https://ps.example.net/esmond/perfsonar/archive/abc/packet-trace/base?time-range=86400
+        :return: (metadata key URL, time range) or None if the URL is not a packet-trace time range query
+        """
+        url = urllib.parse.urlsplit(json_url)
+        query = urllib.parse.parse_qs(url.query)
+        if not url.path.endswith('packet-trace/base') or list(query) != ['time-range']:
+            return
+        try:
+            return urllib.parse.urlunsplit(url._replace(query='')), int(query['time-range'][-1])
+        except ValueError:
+            return
+
+    def plan(self, json_urls):
+        """
+        Registers the packet-trace URLs a mesh will retrieve so metadata keys listed by several meshes are cached
+        :param json_urls: packet-trace URLs of the mesh's traceroute tests
+        :return: None
+        """
+        metadata_urls = {packet_trace[0] for packet_trace in map(self._split_packet_trace_url, json_urls)
+                         if packet_trace is not None}
+        with self._lock:
+            self._uses.update(metadata_urls)
+
+    def release(self, json_urls):
+        """
+        Releases the packet-trace URLs of an analysed mesh, removing cached series no other mesh will use
+        :param json_urls: packet-trace URLs passed to plan for the mesh
+        :return: None
+        """
+        metadata_urls = {packet_trace[0] for packet_trace in map(self._split_packet_trace_url, json_urls)
+                         if packet_trace is not None}
+        with self._lock:
+            for metadata_url in metadata_urls:
+                self._uses[metadata_url] -= 1
+                if self._uses[metadata_url] <= 0:
+                    del self._uses[metadata_url]
+                    self._packet_traces.pop(metadata_url, None)
+
+    def retrieve_json_from_url(self, json_url):
+        """
+        Retrieves the JSON response of a URL, caching every response except packet-trace results.
+        Drop-in replacement for lib.json_loader_saver.retrieve_json_from_url.
+        :param json_url: URL returning JSON
+        :return: decoded JSON
+        """
+        if self._split_packet_trace_url(json_url) is not None:
+            return self._retrieve(json_url)
+        with self._lock:
+            if json_url in self._responses:
+                return self._responses[json_url]
+        response = self._retrieve(json_url)
+        with self._lock:
+            return self._responses.setdefault(json_url, response)
+
+    def retrieve_series(self, json_url):
+        """
+        Retrieves the packet-trace results of a URL as a TracerouteSeries. Series of metadata keys planned by
+        more than one mesh are cached until released by the last of them; each mesh receives a view of the cached
+        series so the routes it updates with its hop statistics are not shared with the other meshes.
+        :param json_url: packet-trace URL e.g. https://ps.example.net/esmond/perfsonar/archive/abc/packet-trace/base
+        :return: TracerouteSeries
+        """
+        packet_trace = self._split_packet_trace_url(json_url)
+        if packet_trace is None:
+            return TracerouteSeries.from_esmond(self._retrieve(json_url))
+        metadata_url, time_range = packet_trace
+        with self._lock:
+            cached = self._packet_traces.get(metadata_url)
+            shared = self._uses[metadata_url] > 1
+        if cached is None or cached[1] < time_range:
+            retrieved = time.time()
+            series = TracerouteSeries.from_esmond(self._retrieve(json_url))
+            if not shared:
+                return series
+            cached = (retrieved, time_range, series)
+            with self._lock:
+                self._packet_traces[metadata_url] = cached
+        retrieved, cached_time_range, series = cached
+        if cached_time_range == time_range:
+            return series.view()
+        return series.since(retrieved - time_range)
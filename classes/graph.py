@@ -66,6 +66,8 @@ class ForceGraph(DataStore):
         """
         DataStore.__init__(self)
         self.data_store = []
+        # IP address of each force node target, used to update the node types from a HopIndex
+        self.target_ips = []
 
     def update_from_json_file(self, file_path):
         """
@@ -74,9 +76,9 @@ class ForceGraph(DataStore):
         """
         raise AttributeError("'ForceGraph' object has no attribute 'update_from_json_file'")
 
-    def create_force_nodes(self, hop_details, previous_hop, source_ip, destination_ip):
+    def create_force_nodes(self, route, source_domain, source_ip, destination_ip):
         """
-        Creates a force node dictionary entry which will be appended to the force graph list.
+        Creates a force node dictionary entry for each hop of the route which will be appended to the force graph list.
         Example dictionary:
             {
                 "target": "et-1-0-0.singaren.net.sg",
@@ -85,30 +87,38 @@ class ForceGraph(DataStore):
                 "type": "okay"
             }
 
-        :param hop_details: Nested dictionary in list or single dict of trace route hop information
-        :type hop_details: list or dict
-        :param previous_hop: Singular entry or list. If list it will be the route starting
-                             at the source ip
-        :type previous_hop: list or str
+        :param route: List of Hop objects of the analysed trace route
+        :type route: list
+        :param source_domain: Domain name of the trace route source which is used as the first node
+        :type source_domain: str
+        :param source_ip: Trace route source IP address
+        :type source_ip: str
         :param destination_ip: Trace route destination IP address
         :type destination_ip: str
         :return: None
         """
-        if len(hop_details) != len(previous_hop):
-            print("Error: Hop information and previous hop list are of different length!")
-            return
-
         unique_tag = 'null tag:{index}_%s_%s' % (source_ip, destination_ip)
-        for index, hop in enumerate(hop_details):
+        source = source_domain
+        for index, hop in enumerate(route):
             node_point = ""
-            if hop.get("ip") == destination_ip:
+            if hop.ip == destination_ip:
                 node_point = "destination"
             elif index == 0:
                 node_point = "source"
 
-            source = unique_tag.format(index=index) if '*' in previous_hop[index] else previous_hop[index]
-            target = unique_tag.format(index=index+1) if '*' in hop['hostname'] else hop['hostname']
+            target = unique_tag.format(index=index+1) if hop.is_timeout else hop.hostname
             self.data_store.append({"source": source,
                                     "target": target,
-                                    "type": hop["status"],
+                                    "type": hop.status,
                                     "node_point": node_point})
+            self.target_ips.append(hop.ip)
+            source = target
+
+    def update_types(self, hop_status):
+        """
+        Replaces the per pair type of each force node with the network wide status of its target hop
+        :param hop_status: function returning the status of a hop IP address e.g. HopIndex.status
+        :return: None
+        """
+        for force_node, target_ip in zip(self.data_store, self.target_ips):
+            force_node['type'] = hop_status(target_ip)
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+"""Provides the HopIndex class, a network wide index of traceroute hops.
+
+Collects the RTT samples of every hop of every traceroute test in a single pass per series,
+keyed by the hop IP address, along with the AS number, hostname and the pairs crossing the hop.
+Per pair hop statistics are derived from the index instead of rescanning each series per hop,
+and the index aggregates the per pair hop statuses to show hops that are slow for every pair.
+Pairs whose analysis is reused from a previous run, see PollScheduler, are added from the hop
+statistics and statuses of their stored route instead of from their samples.
+"""
+
+import math
+import statistics
+from array import array
+from classes.base import DataStore
+from classes.traceroute.hop import string_from_id, TIMEOUT
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+class HopIndexEntry:
+    """
+    Samples and statuses of a single hop IP address across every pair crossing it.
+    samples: {(source_ip, destination_ip, hop_index): (test indexes, RTTs)}
+    summaries: {(source_ip, destination_ip, hop_index): (min, median, max)} of pairs reused from a previous run
+    statuses: {(source_ip, destination_ip): status of the hop within the pair's latest route}
+    """
+    __slots__ = ('ip', 'hostname', 'asn', 'samples', 'summaries', 'statuses')
+
+    def __init__(self, ip):
+        self.ip = ip
+        self.hostname = ip
+        self.asn = TIMEOUT
+        self.samples = {}
+        self.summaries = {}
+        self.statuses = {}
+
+    @property
+    def pairs(self):
+        """
+        :return: set of (source_ip, destination_ip) pairs crossing the hop
+        """
+        return {(source_ip, destination_ip)
+                for source_ip, destination_ip, _ in self.samples.keys() | self.summaries.keys()}
+
+    def status(self, warn_ratio):
+        """
+        Aggregated status of the hop. The hop is 'warn' if more than warn_ratio of the
+        pairs crossing it have a latency warning for the hop.
+        :param warn_ratio: ratio of warning pairs from 0 to 1
+        :return: 'warn', 'okay' or 'unknown'
+        """
+        statuses = list(self.statuses.values())
+        warnings = statuses.count('warn')
+        if warnings and warnings / len(statuses) > warn_ratio:
+            return 'warn'
+        if warnings or 'okay' in statuses:
+            return 'okay'
+        return 'unknown'
+
+
+class HopIndex(DataStore):
+    """
+    Network wide hop index keyed by hop IP address. A pair added again, e.g. a pair listed by several MAs,
+    replaces the samples and statuses it added before.
+    The data store holds the aggregated hop statistics created by summarise() e.g.
+        {
+            "203.30.39.1": {
+                "hostname": "et-1-0-0.singaren.net.sg",
+                "as": 7610,
+                "pairs": ["192.168.0.1 -> 192.168.1.1", ...],
+                "samples": 480,
+                "min": 0.41, "median": 0.62, "max": 7.12,
+                "warn_pairs": 1,
+                "status": "okay"
+            }
+        }
+    """
+    def __init__(self, warn_ratio=0.5):
+        """
+        :param warn_ratio: ratio of pairs with a latency warning needed for a hop to be considered slow
+        """
+        DataStore.__init__(self)
+        self.warn_ratio = warn_ratio
+        self.hops = {}
+        # Hop IP addresses indexed for each pair, {(source_ip, destination_ip): set of hop IP addresses}
+        self._pair_hops = {}
+
+    def update_from_json_file(self, file_path):
+        """
+        :param file_path:
+        :return:
+        """
+        raise AttributeError("'HopIndex' object has no attribute 'update_from_json_file'")
+
+    def remove_pair(self, source_ip, destination_ip):
+        """
+        Removes the samples, summaries and statuses of a pair, dropping hops no other pair crosses
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :return: None
+        """
+        for hop_ip in self._pair_hops.pop((source_ip, destination_ip), ()):
+            entry = self.hops[hop_ip]
+            for hop_keys in (entry.samples, entry.summaries):
+                for key in [key for key in hop_keys if key[:2] == (source_ip, destination_ip)]:
+                    del hop_keys[key]
+            entry.statuses.pop((source_ip, destination_ip), None)
+            if not entry.samples and not entry.summaries:
+                del self.hops[hop_ip]
+
+    def add_series(self, source_ip, destination_ip, series):
+        """
+        Adds the RTT of every responding hop of every test within the series to the index, replacing
+        anything previously added for the pair
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param series: TracerouteSeries of the traceroute test
+        :return: None
+        """
+        self.remove_pair(source_ip, destination_ip)
+        offsets, ip_ids, hostname_ids, asns, rtts = (series.offsets, series.ip_ids, series.hostname_ids,
+                                                     series.asns, series.rtts)
+        hops = self.hops
+        pair_hops = self._pair_hops[source_ip, destination_ip] = set()
+        for test_index in range(len(series)):
+            start = offsets[test_index]
+            for position in range(start, offsets[test_index + 1]):
+                rtt = rtts[position]
+                if ip_ids[position] < 0 or math.isnan(rtt):
+                    continue
+                hop_ip = string_from_id(ip_ids[position])
+                try:
+                    entry = hops[hop_ip]
+                except KeyError:
+                    entry = hops[hop_ip] = HopIndexEntry(hop_ip)
+                    entry.hostname = string_from_id(hostname_ids[position], hop_ip)
+                if entry.asn == TIMEOUT and asns[position] >= 0:
+                    entry.asn = asns[position]
+                pair_hops.add(hop_ip)
+                key = (source_ip, destination_ip, position - start)
+                try:
+                    test_indexes, hop_rtts = entry.samples[key]
+                except KeyError:
+                    test_indexes, hop_rtts = entry.samples[key] = (array('l'), array('f'))
+                test_indexes.append(test_index)
+                hop_rtts.append(rtt)
+
+    def add_route(self, source_ip, destination_ip, route):
+        """
+        Adds the statistics and statuses of an analysed route, e.g. the stored route of a pair which was not
+        retrieved this run, in place of the pair's samples, replacing anything previously added for the pair
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param route: list of analysed Hop
+        :return: None
+        """
+        self.remove_pair(source_ip, destination_ip)
+        pair_hops = self._pair_hops[source_ip, destination_ip] = set()
+        for hop_index, hop in enumerate(route):
+            if hop.is_timeout or not all(isinstance(hop[key], (int, float)) for key in ('min', 'median', 'max')):
+                continue
+            try:
+                entry = self.hops[hop.ip]
+            except KeyError:
+                entry = self.hops[hop.ip] = HopIndexEntry(hop.ip)
+                entry.hostname = hop.hostname
+            if entry.asn == TIMEOUT and hop.asn != TIMEOUT:
+                entry.asn = hop.asn
+            pair_hops.add(hop.ip)
+            entry.summaries[source_ip, destination_ip, hop_index] = (hop.min, hop.median, hop.max)
+            entry.statuses[source_ip, destination_ip] = hop.status
+
+    def hop_samples(self, source_ip, destination_ip, hop_index, hop_ip):
+        """
+        :return: (test indexes, RTTs) of the hop IP address at hop_index for the pair
+        """
+        try:
+            return self.hops[hop_ip].samples[source_ip, destination_ip, hop_index]
+        except KeyError:
+            return array('l'), array('f')
+
+    def record_status(self, source_ip, destination_ip, hop):
+        """
+        Records the status of a hop within the latest route of a pair
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param hop: analysed Hop
+        :return: None
+        """
+        try:
+            self.hops[hop.ip].statuses[source_ip, destination_ip] = hop.status
+        except KeyError:
+            return
+
+    def status(self, hop_ip):
+        """
+        :param hop_ip: IP address of the hop
+        :return: aggregated status of the hop; 'unknown' if the hop is not indexed
+        """
+        try:
+            return self.hops[hop_ip].status(self.warn_ratio)
+        except KeyError:
+            return 'unknown'
+
+    def hop_statistics(self, hop_ip):
+        """
+        Aggregated statistics of a hop across every pair crossing it. The statistics of reused pairs are combined
+        with the samples; the median is that of the samples, or of the reused medians if the hop has no samples.
+        :param hop_ip: IP address of the hop
+        :return: dict
+        """
+        entry = self.hops[hop_ip]
+        rtts = sorted(rtt for _, hop_rtts in entry.samples.values() for rtt in hop_rtts)
+        summaries = list(entry.summaries.values())
+        return {'hostname': entry.hostname,
+                'as': entry.asn,
+                'pairs': sorted("%s -> %s" % pair for pair in entry.pairs),
+                'samples': len(rtts),
+                'min': round(min(rtts[:1] + [summary[0] for summary in summaries]), 2),
+                'median': round(statistics.median(rtts or [summary[1] for summary in summaries]), 2),
+                'max': round(max(rtts[-1:] + [summary[2] for summary in summaries]), 2),
+                'warn_pairs': list(entry.statuses.values()).count('warn'),
+                'status': entry.status(self.warn_ratio)}
+
+    def worst_hops(self, count=10, offset=0):
+        """
+        Returns a page of hops ordered by the ratio and number of pairs with a latency warning
+        :param count: amount of hops to return
+        :param offset: amount of hops to skip
+        :return: list of (hop IP address, hop statistics)
+        """
+        def warn_order(entry):
+            warnings = list(entry.statuses.values()).count('warn')
+            return warnings / max(len(entry.statuses), 1), warnings
+
+        ranked = sorted((entry for entry in self.hops.values() if entry.statuses), key=warn_order, reverse=True)
+        return [(entry.ip, self.hop_statistics(entry.ip)) for entry in ranked[offset:offset + count]]
+
+    def summarise(self):
+        """
+        Updates the data store with the aggregated statistics of every indexed hop
+        :return: data store
+        """
+        self.data_store = {hop_ip: self.hop_statistics(hop_ip) for hop_ip in sorted(self.hops)}
+        return self.data_store
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+"""Provides the Mesh class describing a set of perfSONAR Measurement Archives analysed together.
+
+Meshes are defined within config.ini by [MESH:<name>] sections, e.g.
+    [MESH:asia]
+    URLS = ps1.example.net, ps2.example.net
+    TIME_PERIOD = 86400
+    THRESHOLD = 0.5
+    OUTPUT_DIR = html/asia
+Each mesh has its own dashboard (OUTPUT_DIR) and route comparison / hop index state (json/<name>).
+"""
+
+import os.path
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+MESH_SECTION_PREFIX = 'MESH:'
+
+
+class Mesh:
+    """
+    A named set of perfSONAR MAs along with the analysis settings and directories of its results
+    """
+    def __init__(self, name, perfsonar_urls, time_period, threshold, html_dir, json_dir, warn_ratio=0.5):
+        """
+        :param name: name of the mesh
+        :param perfsonar_urls: IP or base domain of each PerfSONAR MA
+        :param time_period: time period in seconds of the traceroute tests to analyse
+        :param threshold: route comparison threshold, see RouteComparison
+        :param html_dir: directory the dashboard and traceroute web pages are written to
+        :param json_dir: directory the route comparison and hop index state is saved within
+        :param warn_ratio: hop index warn ratio, see HopIndex
+        """
+        self.name = name
+        self.perfsonar_urls = perfsonar_urls
+        self.time_period = time_period
+        self.threshold = threshold
+        self.html_dir = html_dir
+        self.json_dir = json_dir
+        self.warn_ratio = warn_ratio
+
+    def __repr__(self):
+        return "Mesh(%r, %r)" % (self.name, self.perfsonar_urls)
+
+
+def meshes_from_config(config, base_dir, time_period, threshold, warn_ratio):
+    """
+    Creates a Mesh for every [MESH:<name>] section of config.ini
+    :param config: ConfigParser of config.ini
+    :param base_dir: directory relative OUTPUT_DIR paths are relative to
+    :param time_period: time period used by meshes without a TIME_PERIOD
+    :param threshold: route comparison threshold used by meshes without a THRESHOLD
+    :param warn_ratio: hop index warn ratio used by meshes without a WARN_RATIO
+    :return: list of Mesh objects, empty if no meshes are defined
+    """
+    meshes = []
+    for section in config.sections():
+        if not section.startswith(MESH_SECTION_PREFIX):
+            continue
+        name = section[len(MESH_SECTION_PREFIX):].strip()
+        mesh_config = config[section]
+        output_dir = mesh_config.get('OUTPUT_DIR', fallback=os.path.join('html', name))
+        meshes.append(Mesh(name,
+                           [url.strip() for url in mesh_config['URLS'].split(',') if url.strip()],
+                           mesh_config.getint('TIME_PERIOD', fallback=time_period),
+                           mesh_config.getfloat('THRESHOLD', fallback=threshold),
+                           os.path.join(base_dir, output_dir),
+                           os.path.join(base_dir, 'json', name),
+                           mesh_config.getfloat('WARN_RATIO', fallback=warn_ratio)))
+    return meshes
@@ -7,7 +7,12 @@ import os.path
 from urllib.error import HTTPError
 from classes.traceroute.analysis import TracerouteAnalysis
 from classes.traceroute.comparison import RouteComparison
+from classes.bundle import PairBundles
 from classes.graph import ForceGraph
+from classes.as_paths import ASPaths
+from classes.hop_index import HopIndex
+from classes.traceroute.hop import Hop
+from lib import json_loader_saver, static_output
 
 __author__ = "Simon Peter Green"
 __copyright__ = "Copyright (c) 2017 spgreen"
@@ -20,15 +25,47 @@ __status__ = "Development"
 
 
 class PsTrace:
-    def __init__(self, previous_routes_fp, threshold, email_template_fp):
+    def __init__(self, previous_routes_fp, threshold, email_template_fp, hop_baselines=None, warn_ratio=0.5,
+                 write_static_file=static_output.write_static_file, pair_bundles=None, rtt_store=None,
+                 sparkline_period=2592000, sampling_policy=None,
+                 alert_queue=None, retrieve_json=json_loader_saver.retrieve_json_from_url, scheduler=None,
+                 retrieve_series=None):
         """
         TODO: Add Description
         :param previous_routes_fp:
         :param threshold:
         :param email_template_fp:
+        :param hop_baselines: optional HopBaselines store used for sketch based hop statistics
+        :param warn_ratio: ratio of pairs warning for a hop needed for the hop to be considered slow network wide
+        :param write_static_file: function used to write the traceroute web pages, see lib/static_output.py
+        :param pair_bundles: PairBundles store; if set traceroute details are added to the bundles instead of
+                             being rendered as a web page per traceroute test
+        :param rtt_store: RTTStore which the end-to-end RTT of each test is appended to
+        :param sparkline_period: period in seconds of the RTT sparkline shown on the traceroute details
+        :param sampling_policy: (full resolution period, max older tests) used to downsample each traceroute
+                                test before analysis, see TracerouteSeries.downsample
+        :param alert_queue: AlertQueue route change alerts are sent through as they are found
+        :param retrieve_json: function used to retrieve the traceroute results e.g. ArchiveFetcher.retrieve_json_from_url
+        :param scheduler: PollScheduler; if set a traceroute test is only retrieved once a new test is due, otherwise
+                          the results of its last retrieval are reused
+        :param retrieve_series: function returning the TracerouteSeries of a traceroute test's API URL
+                                e.g. ArchiveFetcher.retrieve_series; if None retrieve_json is used
         """
-        self.route_comparison = RouteComparison(threshold, email_template_fp)
+        self.write_static_file = write_static_file
+        self.pair_bundles = pair_bundles
+        self.rtt_store = rtt_store
+        self.sparkline_period = sparkline_period
+        self.sampling_policy = sampling_policy
+        self.retrieve_json = retrieve_json
+        self.retrieve_series = retrieve_series
+        self.scheduler = scheduler
+        # Traceroute.information of the latest test of each pair, keyed by (source_ip, destination_ip)
+        self.latest_routes = {}
+        self.route_comparison = RouteComparison(threshold, email_template_fp, alert_queue)
         self.force_graph = ForceGraph()
+        self.as_paths = ASPaths()
+        self.network_index = HopIndex(warn_ratio)
+        self.hop_baselines = hop_baselines
         self.route_comparison.update_from_json_file(previous_routes_fp)
 
     def analysis(self, traceroute_test, html_save_directory, web_jinja2_template_fp):
@@ -39,35 +76,91 @@ class PsTrace:
         :param web_jinja2_template_fp:
         :return:
         """
+        if self.scheduler is not None and not self.scheduler.is_due(traceroute_test):
+            return self.reuse_previous(traceroute_test)
         try:
-            traceroute = TracerouteAnalysis(traceroute_test, web_jinja2_template_fp)
-        except HTTPError as e:
+            traceroute = TracerouteAnalysis(traceroute_test, web_jinja2_template_fp, self.retrieve_json,
+                                            self.retrieve_series)
+        except (HTTPError, ValueError) as e:
             print(e, "unable to retrieve traceroute data from %s" % traceroute_test.get("api"))
             print("Retrieving next test....")
             return traceroute_test['destination'], traceroute_test['source'], {'rtt': '', 'fp_html': ''}
         source_ip = traceroute.information['source_ip']
         destination_ip = traceroute.information['destination_ip']
 
-        traceroute.perform_traceroute_analysis()
+        if self.scheduler is not None:
+            self.scheduler.learn(traceroute_test, traceroute.trace_route_results.timestamps)
+        if self.rtt_store is not None:
+            self.rtt_store.append_series(source_ip, destination_ip, traceroute.trace_route_results)
+        if self.sampling_policy is not None:
+            traceroute.downsample(*self.sampling_policy)
+
+        self.network_index.add_series(source_ip, destination_ip, traceroute.trace_route_results)
+        traceroute.perform_traceroute_analysis(self.hop_baselines, self.network_index)
+        self.latest_routes[source_ip, destination_ip] = traceroute.information
         traceroute.latest_trace_output()
         historical_routes = traceroute.historical_diff_routes()
 
-        fp_html = "{source}-to-{dest}.html".format(source=source_ip, dest=destination_ip)
-        # Replaces the colons(:) for IPv6 addresses with full-stops(.) to prevent file path issues when saving on Win32
-        fp_html = fp_html.replace(":", ".")
-        with open(os.path.join(html_save_directory, fp_html), "w") as html_file:
-            html_file.write(traceroute.create_traceroute_web_page(historical_routes))
+        rtt_sparkline = ''
+        if self.rtt_store is not None:
+            # Rollups are updated in the background so the sparkline may not yet include the latest tests
+            rtt_sparkline = self.rtt_store.sparkline(source_ip, destination_ip, 3600,
+                                                     traceroute.information['test_time'] - self.sparkline_period,
+                                                     300, 40)
+
+        if self.pair_bundles is not None:
+            traceroute_details = traceroute.traceroute_details(historical_routes)
+            traceroute_details['rtt_sparkline'] = rtt_sparkline
+            pair_key = self.pair_bundles.add(source_ip, destination_ip, traceroute_details)
+            fp_html = "traceroute.html#%s" % pair_key
+        else:
+            # Replaces the colons(:) for IPv6 addresses with full-stops(.) to prevent file path issues on Win32
+            fp_html = "%s.html" % PairBundles.pair_key(source_ip, destination_ip)
+            self.write_static_file(os.path.join(html_save_directory, fp_html),
+                                   traceroute.create_traceroute_web_page(historical_routes, rtt_sparkline))
 
         traceroute_rtt = traceroute.information['route_stats'][-1].get("rtt", 'unknown')
 
-        # Creates the hop list from the route_stats return
-        route_from_source = [traceroute.information['source_domain']] + [hop["hostname"] for hop in
-                                                                         traceroute.information['route_stats']][:-1]
         # Creates force nodes between previous and current hop
         self.force_graph.create_force_nodes(traceroute.information['route_stats'],
-                                            route_from_source,
+                                            traceroute.information['source_domain'],
                                             traceroute.information['source_ip'],
                                             traceroute.information['destination_ip'])
         # Compares current route with previous and stores current route in PREVIOUS_ROUTE_FP
         self.route_comparison.check_changes(traceroute.information)
-        return source_ip, destination_ip, {'rtt': traceroute_rtt, 'fp_html': fp_html}
+        cell = {'rtt': traceroute_rtt, 'fp_html': fp_html}
+        if self.scheduler is not None:
+            self.scheduler.record(traceroute_test, traceroute.information, cell)
+        return source_ip, destination_ip, cell
+
+    def reuse_previous(self, traceroute_test):
+        """
+        Reuses the results of the last retrieval of a traceroute test which is not yet due. The route is added to the
+        latest routes, force graph and hop index; its web page or bundle and route comparison state are left unchanged.
+        :param traceroute_test: test returned by acquire_traceroute_tests
+        :return: source IP, destination IP and matrix cell of the last retrieval
+        """
+        information, cell = self.scheduler.previous(traceroute_test)
+        route = []
+        for hop_details in information['route_stats']:
+            hop = Hop()
+            hop.update(hop_details)
+            route.append(hop)
+        information = dict(information, route_stats=route)
+        source_ip, destination_ip = information['source_ip'], information['destination_ip']
+        self.latest_routes[source_ip, destination_ip] = information
+        # The stored hop statistics and statuses stand in for the samples of the pair
+        self.network_index.add_route(source_ip, destination_ip, route)
+        self.force_graph.create_force_nodes(route, information['source_domain'], source_ip, destination_ip)
+        return source_ip, destination_ip, dict(cell)
+
+    def finalise(self):
+        """
+        Updates the force graph node types, hop index statistics and AS aggregation and scores the route changes
+        once every traceroute test has been analysed
+        :return: None
+        """
+        self.route_comparison.score_changes()
+        self.as_paths.update(self.latest_routes)
+        self.force_graph.update_types(self.network_index.status)
+        self.network_index.summarise()
@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+"""Provides the RTTStore class, a memory-mapped end-to-end RTT time series store.
+
+Each source/destination pair has its own directory holding fixed-width column files:
+    ts.bin   - int64 epoch timestamp of each test
+    rtt.bin  - float32 end-to-end RTT of each test, NaN if the destination did not respond
+    path.bin - uint32 path ID (CRC32 of the IP route) of each test
+and rollup files (rollup_300.bin, rollup_3600.bin, rollup_86400.bin) of fixed-width
+(bucket start, min, median, max, count) records. Tests are appended once per run and the
+rollups are updated incrementally by a background thread. Tests older than the latest stored
+test, e.g. imported by the backfill command, are appended to a pending.bin file of fixed-width
+(timestamp, RTT, path ID) records and merged into rewritten columns once by flush, after which the
+rollups are rebuilt. Column and rollup files are rewritten through a temporary file which replaces them
+rather than modifying them in place so files mapped by readers never change underneath them.
+A merge.journal file marks a merge whose temporary column files are complete. Columns left with
+different lengths by an interrupted append are truncated to the shortest column before the next append.
+Files are read through mmap so long periods can be read without loading or parsing the whole history.
+"""
+
+import bisect
+import math
+import mmap
+import os
+import queue
+import statistics
+import struct
+import threading
+import zlib
+from array import array
+from classes.bundle import PairBundles
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+ROLLUP_PERIODS = (300, 3600, 86400)
+ROLLUP_RECORD = struct.Struct('=qfffI')
+
+COLUMNS = (('ts.bin', 'q'), ('rtt.bin', 'f'), ('path.bin', 'I'))
+PENDING_RECORD = struct.Struct('=qfI')
+
+
+def sparkline_points(values, width=100, height=20):
+    """
+    Scales values into the coordinates of an SVG polyline
+    :param values: list of numbers
+    :param width: width of the sparkline
+    :param height: height of the sparkline
+    :return: str e.g. "0,20 50,0 100,10" or an empty string if there are less than two values
+    """
+    if len(values) < 2:
+        return ''
+    low, high = min(values), max(values)
+    spread = (high - low) or 1
+    step = width / (len(values) - 1)
+    return ' '.join("%.1f,%.1f" % (index * step, height - (value - low) / spread * height)
+                    for index, value in enumerate(values))
+
+
+def _map_column(file_path, typecode):
+    """
+    Memory maps the whole records of a column file; a partly written trailing record is left out
+    :param file_path: file path of the column
+    :param typecode: array typecode of the column values
+    :return: memoryview of the column values or an empty array if the file does not exist
+    """
+    item_size = array(typecode).itemsize
+    try:
+        with open(file_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            size -= size % item_size
+            if not size:
+                return array(typecode)
+            column = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        # ValueError if the file was replaced by an empty file between fstat and mmap
+        return array(typecode)
+    return memoryview(column).cast(typecode)
+
+
+class RTTStore:
+    """
+    Appends the end-to-end RTT and path ID of every traceroute test of a pair to its column files
+    and maintains 5 minute, 1 hour and 1 day min/median/max rollups in a background thread.
+    """
+    def __init__(self, directory):
+        """
+        :param directory: directory containing a sub directory per source/destination pair
+        """
+        self.directory = directory
+        self._rollup_queue = queue.Queue()
+        self._rollup_thread = None
+        self._rollup_lock = threading.Lock()
+        # {pair directory: rebuild} of the pairs queued for a rollup update
+        self._rollup_pending = {}
+        # {pair directory: set of timestamps} of the older tests in pending.bin awaiting a merge by flush
+        self._unmerged = {}
+
+    def _pair_directory(self, source_ip, destination_ip):
+        return os.path.join(self.directory, PairBundles.pair_key(source_ip, destination_ip))
+
+    @staticmethod
+    def path_id(ip_route):
+        """
+        :param ip_route: list of hop IP addresses
+        :return: 32 bit ID of the route
+        """
+        return zlib.crc32('|'.join(ip_route).encode('utf-8'))
+
+    def append_series(self, source_ip, destination_ip, series):
+        """
+        Stores the tests of the series which are not yet stored and queues the pair's rollups. Tests newer than
+        the last stored test are appended to the columns; older tests are appended to pending.bin and merged
+        into the columns by flush.
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param series: TracerouteSeries of the traceroute test
+        :return: amount of tests stored, including older tests awaiting a merge
+        """
+        pair_directory = self._pair_directory(source_ip, destination_ip)
+        os.makedirs(pair_directory, exist_ok=True)
+        self._recover_columns(pair_directory)
+        unmerged = self._unmerged_timestamps(pair_directory)
+        timestamps = _map_column(os.path.join(pair_directory, 'ts.bin'), 'q')
+        last_timestamp = timestamps[-1] if len(timestamps) else -1
+
+        new_tests, older_tests = [], []
+        for test_index, timestamp in enumerate(series.timestamps):
+            if timestamp <= last_timestamp:
+                if timestamp in unmerged:
+                    continue
+                stored_index = bisect.bisect_left(timestamps, timestamp)
+                if stored_index < len(timestamps) and timestamps[stored_index] == timestamp:
+                    continue
+            ip_route = series.ip_route(test_index)
+            rtt = math.nan
+            if ip_route and ip_route[-1] == destination_ip:
+                rtt = series.rtts[series.offsets[test_index + 1] - 1]
+            test = (timestamp, rtt, self.path_id(ip_route))
+            if timestamp <= last_timestamp:
+                unmerged.add(timestamp)
+                older_tests.append(test)
+            elif not new_tests or timestamp > new_tests[-1][0]:
+                new_tests.append(test)
+        del timestamps
+
+        if older_tests:
+            with open(os.path.join(pair_directory, 'pending.bin'), 'ab') as pending_file:
+                pending_file.write(b''.join(PENDING_RECORD.pack(*test) for test in older_tests))
+        if new_tests:
+            for (file_name, typecode), values in zip(COLUMNS, zip(*new_tests)):
+                with open(os.path.join(pair_directory, file_name), 'ab') as column_file:
+                    array(typecode, values).tofile(column_file)
+            self._queue_rollup(pair_directory)
+        return len(new_tests) + len(older_tests)
+
+    def _unmerged_timestamps(self, pair_directory):
+        """
+        :param pair_directory: directory of the pair
+        :return: set of the timestamps in the pair's pending.bin, read from the file on first use
+        """
+        if pair_directory not in self._unmerged:
+            pending = _map_column(os.path.join(pair_directory, 'pending.bin'), 'B')
+            self._unmerged[pair_directory] = {PENDING_RECORD.unpack_from(pending, offset)[0]
+                                              for offset in range(0, len(pending) - PENDING_RECORD.size + 1,
+                                                                  PENDING_RECORD.size)}
+            del pending
+        return self._unmerged[pair_directory]
+
+    def flush(self):
+        """
+        Merges the older tests appended to pending.bin into the columns, once per pair, and queues a rebuild
+        of the pair's rollups
+        :return: amount of tests merged
+        """
+        merged = 0
+        for pair_directory in list(self._unmerged):
+            if self._unmerged.pop(pair_directory):
+                merged += self._merge_tests(pair_directory)
+                self._queue_rollup(pair_directory, rebuild=True)
+        return merged
+
+    @staticmethod
+    def _recover_columns(pair_directory):
+        """
+        Completes a merge interrupted after merge.journal was written and truncates columns left longer than
+        the others, or with a partly written record, by an interrupted append
+        :param pair_directory: directory of the pair
+        :return: None
+        """
+        journal_fp = os.path.join(pair_directory, 'merge.journal')
+        if os.path.exists(journal_fp):
+            for file_name, _ in COLUMNS:
+                column_fp = os.path.join(pair_directory, file_name)
+                if os.path.exists("%s.tmp" % column_fp):
+                    os.replace("%s.tmp" % column_fp, column_fp)
+            try:
+                os.remove(os.path.join(pair_directory, 'pending.bin'))
+            except FileNotFoundError:
+                pass
+            os.remove(journal_fp)
+
+        sizes = []
+        for file_name, typecode in COLUMNS:
+            try:
+                sizes.append(os.path.getsize(os.path.join(pair_directory, file_name)))
+            except FileNotFoundError:
+                sizes.append(0)
+        records = min(size // array(typecode).itemsize for size, (_, typecode) in zip(sizes, COLUMNS))
+        for size, (file_name, typecode) in zip(sizes, COLUMNS):
+            if size == records * array(typecode).itemsize:
+                continue
+            column_fp = os.path.join(pair_directory, file_name)
+            with open(column_fp, 'rb') as column_file:
+                values = column_file.read(records * array(typecode).itemsize)
+            with open("%s.tmp" % column_fp, 'wb') as column_file:
+                column_file.write(values)
+            os.replace("%s.tmp" % column_fp, column_fp)
+
+    @staticmethod
+    def _merge_tests(pair_directory):
+        """
+        Rewrites the column files of a pair with the stored tests and the tests of pending.bin in timestamp order.
+        Each column is written to a temporary file; once every temporary file is written merge.journal is created,
+        the temporary files replace the column files and pending.bin is removed.
+        :param pair_directory: directory of the pair
+        :return: amount of tests added to the columns
+        """
+        pending_fp = os.path.join(pair_directory, 'pending.bin')
+        pending = _map_column(pending_fp, 'B')
+        tests = [PENDING_RECORD.unpack_from(pending, offset)
+                 for offset in range(0, len(pending) - PENDING_RECORD.size + 1, PENDING_RECORD.size)]
+        del pending
+        columns = [_map_column(os.path.join(pair_directory, file_name), typecode) for file_name, typecode in COLUMNS]
+        stored = min(len(column) for column in columns)
+        merged = {timestamp: (timestamp, rtt, path)
+                  for timestamp, rtt, path in zip(*(column[:stored].tolist() for column in columns))}
+        for test in tests:
+            merged.setdefault(test[0], test)
+        del columns
+        for (file_name, typecode), values in zip(COLUMNS, zip(*sorted(merged.values()))):
+            with open(os.path.join(pair_directory, "%s.tmp" % file_name), 'wb') as column_file:
+                array(typecode, values).tofile(column_file)
+        journal_fp = os.path.join(pair_directory, 'merge.journal')
+        open(journal_fp, 'w').close()
+        for file_name, _ in COLUMNS:
+            column_fp = os.path.join(pair_directory, file_name)
+            os.replace("%s.tmp" % column_fp, column_fp)
+        os.remove(pending_fp)
+        os.remove(journal_fp)
+        return len(merged) - stored
+
+    def _queue_rollup(self, pair_directory, rebuild=False):
+        """
+        Queues a rollup update of a pair; a pair already queued is only updated once
+        :param pair_directory: directory of the pair
+        :param rebuild: recomputes every rollup bucket rather than the buckets of newer tests only
+        :return: None
+        """
+        with self._rollup_lock:
+            if pair_directory in self._rollup_pending:
+                self._rollup_pending[pair_directory] |= rebuild
+                return
+            self._rollup_pending[pair_directory] = rebuild
+        if self._rollup_thread is None or not self._rollup_thread.is_alive():
+            self._rollup_thread = threading.Thread(target=self._rollup_worker, daemon=True)
+            self._rollup_thread.start()
+        self._rollup_queue.put(pair_directory)
+
+    def _rollup_worker(self):
+        while True:
+            pair_directory = self._rollup_queue.get()
+            with self._rollup_lock:
+                rebuild = self._rollup_pending.pop(pair_directory)
+            try:
+                for period in ROLLUP_PERIODS:
+                    self._update_rollup(pair_directory, period, rebuild)
+            except OSError as error:
+                print("Error: Unable to update RTT rollups for %s - %s" % (pair_directory, error))
+            finally:
+                self._rollup_queue.task_done()
+
+    def wait(self):
+        """
+        Merges the pending older tests and blocks until every queued rollup has been updated
+        :return: None
+        """
+        self.flush()
+        self._rollup_queue.join()
+
+    @staticmethod
+    def _update_rollup(pair_directory, period, rebuild=False):
+        """
+        Recomputes the last (possibly incomplete) rollup bucket and appends the buckets of newer tests.
+        The updated rollup is written to a temporary file which then replaces the rollup file.
+        :param pair_directory: directory of the pair
+        :param period: rollup bucket size in seconds
+        :param rebuild: recomputes every bucket e.g. after older tests have been merged into the columns
+        :return: None
+        """
+        rollup_fp = os.path.join(pair_directory, 'rollup_%d.bin' % period)
+        rollup = b''
+        try:
+            if not rebuild:
+                with open(rollup_fp, 'rb') as rollup_file:
+                    rollup = rollup_file.read()
+        except FileNotFoundError:
+            pass
+        rollup_size = len(rollup) - len(rollup) % ROLLUP_RECORD.size
+        start_bucket = -1
+        if rollup_size >= ROLLUP_RECORD.size:
+            rollup_size -= ROLLUP_RECORD.size
+            start_bucket = ROLLUP_RECORD.unpack_from(rollup, rollup_size)[0]
+
+        timestamps = _map_column(os.path.join(pair_directory, 'ts.bin'), 'q')
+        rtts = _map_column(os.path.join(pair_directory, 'rtt.bin'), 'f')
+        records = []
+        bucket, bucket_rtts = None, []
+        for index in range(bisect.bisect_left(timestamps, max(start_bucket, 0)), min(len(timestamps), len(rtts))):
+            test_bucket = timestamps[index] - timestamps[index] % period
+            if test_bucket != bucket:
+                if bucket_rtts:
+                    records.append((bucket, bucket_rtts))
+                bucket, bucket_rtts = test_bucket, []
+            if not math.isnan(rtts[index]):
+                bucket_rtts.append(rtts[index])
+        if bucket_rtts:
+            records.append((bucket, bucket_rtts))
+        del timestamps, rtts
+
+        with open("%s.tmp" % rollup_fp, 'wb') as rollup_file:
+            rollup_file.write(rollup[:rollup_size])
+            for bucket, bucket_rtts in records:
+                rollup_file.write(ROLLUP_RECORD.pack(bucket, min(bucket_rtts), statistics.median(bucket_rtts),
+                                                     max(bucket_rtts), len(bucket_rtts)))
+        os.replace("%s.tmp" % rollup_fp, rollup_fp)
+
+    def rollups(self, source_ip, destination_ip, period, start=0):
+        """
+        Reads the rollups of a pair
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param period: rollup period i.e. one of ROLLUP_PERIODS
+        :param start: epoch timestamp of the first bucket to return
+        :return: list of (bucket start, min, median, max, count)
+        """
+        rollup_fp = os.path.join(self._pair_directory(source_ip, destination_ip), 'rollup_%d.bin' % period)
+        rollup = _map_column(rollup_fp, 'B')
+        records = len(rollup) // ROLLUP_RECORD.size
+        # Binary search on the bucket start of the fixed-width records
+        low, high = 0, records
+        while low < high:
+            middle = (low + high) // 2
+            if ROLLUP_RECORD.unpack_from(rollup, middle * ROLLUP_RECORD.size)[0] < start:
+                low = middle + 1
+            else:
+                high = middle
+        return [ROLLUP_RECORD.unpack_from(rollup, index * ROLLUP_RECORD.size) for index in range(low, records)]
+
+    def sparkline(self, source_ip, destination_ip, period, start, width=100, height=20):
+        """
+        :return: SVG polyline points of the median RTT rollups since start, see sparkline_points
+        """
+        medians = [median for _, _, median, _, _ in self.rollups(source_ip, destination_ip, period, start)]
+        return sparkline_points(medians, width, height)
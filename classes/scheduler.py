@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""Provides the PollScheduler class for adaptive polling of perfSONAR traceroute tests.
+
+The interval between the tests of each metadata key is learnt from the timestamps of its results
+so that a pair is only retrieved and analysed once a new test is due. Pairs that are not due keep
+the analysis results of their last retrieval. Pairs with a recent route change are always retrieved
+and are analysed first.
+"""
+
+import statistics
+import time
+from classes.base import DataStore
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+# Amount of the most recent test intervals the interval of a metadata key is learnt from
+LEARNING_INTERVALS = 20
+
+
+class PollScheduler(DataStore):
+    """
+    Stores the learnt test interval and last analysis results of each metadata key.
+    Data store example:
+        {
+            "https://ps.example.net/esmond/perfsonar/archive/abc/packet-trace/base": {
+                "interval": 600,
+                "last_ts": 1485920150,
+                "last_fetch": 1485920400,
+                "information": {"source_ip": ..., "route_stats": [{...}, ...], ...},
+                "cell": {"rtt": 1.23, "fp_html": "192.168.0.1-to-192.168.1.1.html"}
+            }
+        }
+    """
+    def __init__(self, max_age=21600, priority_period=86400):
+        """
+        :param max_age: seconds after which a pair is retrieved again even if no new test is due
+        :param priority_period: seconds a route change keeps a pair prioritised
+        """
+        DataStore.__init__(self)
+        self.max_age = max_age
+        self.priority_period = priority_period
+        self.fetched = 0
+        self.skipped = 0
+        self._prioritised = set()
+
+    @staticmethod
+    def test_key(traceroute_test):
+        """
+        :param traceroute_test: test returned by acquire_traceroute_tests
+        :return: packet-trace URL of the test's metadata key without the time range
+        """
+        return traceroute_test['api'].split('?', 1)[0]
+
+    def learn(self, traceroute_test, timestamps, now=None):
+        """
+        Learns the test interval of a metadata key from the timestamps of its results
+        :param traceroute_test: test returned by acquire_traceroute_tests
+        :param timestamps: ordered epoch timestamps of the retrieved tests e.g. TracerouteSeries.timestamps
+        :param now: epoch time of the retrieval
+        :return: learnt interval in seconds or None if unknown
+        """
+        state = self.data_store.setdefault(self.test_key(traceroute_test), {})
+        recent = timestamps[-LEARNING_INTERVALS - 1:]
+        intervals = [later - earlier for earlier, later in zip(recent, recent[1:]) if later > earlier]
+        if intervals:
+            state['interval'] = statistics.median(intervals)
+        if len(timestamps):
+            state['last_ts'] = timestamps[-1]
+        state['last_fetch'] = time.time() if now is None else now
+        return state.get('interval')
+
+    def record(self, traceroute_test, information, cell):
+        """
+        Stores the analysis results of a retrieved test so they can be reused while the test is not due
+        :param traceroute_test: test returned by acquire_traceroute_tests
+        :param information: Traceroute.information of the analysed test
+        :param cell: matrix cell of the analysed test
+        :return: None
+        """
+        state = self.data_store.setdefault(self.test_key(traceroute_test), {})
+        state['information'] = dict(information, route_stats=[dict(hop) for hop in information['route_stats']])
+        state['cell'] = {key: value for key, value in cell.items() if key != 'sparkline'}
+
+    def previous(self, traceroute_test):
+        """
+        :param traceroute_test: test returned by acquire_traceroute_tests
+        :return: (Traceroute.information, matrix cell) stored by record or None
+        """
+        state = self.data_store.get(self.test_key(traceroute_test), {})
+        if 'information' not in state or 'cell' not in state:
+            return
+        return state['information'], state['cell']
+
+    def next_due(self, traceroute_test):
+        """
+        :param traceroute_test: test returned by acquire_traceroute_tests
+        :return: epoch time the next test of the metadata key is expected or None if unknown
+        """
+        state = self.data_store.get(self.test_key(traceroute_test), {})
+        if 'interval' not in state or 'last_ts' not in state or 'last_fetch' not in state:
+            return
+        # A test which is late to appear within the MA is retried every half interval rather than every run
+        return min(max(state['last_ts'] + state['interval'], state['last_fetch'] + state['interval'] / 2),
+                   state['last_fetch'] + self.max_age)
+
+    def is_due(self, traceroute_test, now=None):
+        """
+        :param traceroute_test: test returned by acquire_traceroute_tests
+        :param now: epoch time
+        :return: True if the test needs to be retrieved and analysed
+        """
+        key = self.test_key(traceroute_test)
+        next_due = self.next_due(traceroute_test)
+        due = (key in self._prioritised or next_due is None or self.previous(traceroute_test) is None or
+               (time.time() if now is None else now) >= next_due)
+        if due:
+            self.fetched += 1
+        else:
+            self.skipped += 1
+        return due
+
+    def schedule(self, traceroute_tests, route_comparison, now=None):
+        """
+        Orders the tests of a run, prioritising pairs with a recent route change followed by the most overdue pairs,
+        and removes the state of metadata keys no longer listed by the MAs
+        :param traceroute_tests: tests returned by acquire_traceroute_tests
+        :param route_comparison: RouteComparison holding the historical routes of each pair
+        :param now: epoch time
+        :return: ordered list of the tests
+        """
+        now = time.time() if now is None else now
+        traceroute_tests = list(traceroute_tests)
+        historical_routes = route_comparison.get_data()
+        self._prioritised = set()
+        for traceroute_test in traceroute_tests:
+            comparison = historical_routes.get(traceroute_test['source'], {}).get(traceroute_test['destination'], {})
+            changed_time = comparison.get('last_change')
+            if comparison.get('flapping') or (isinstance(changed_time, (int, float)) and
+                                              changed_time >= now - self.priority_period):
+                self._prioritised.add(self.test_key(traceroute_test))
+
+        def priority(traceroute_test):
+            next_due = self.next_due(traceroute_test)
+            return self.test_key(traceroute_test) not in self._prioritised, next_due or 0
+
+        listed_keys = {self.test_key(traceroute_test) for traceroute_test in traceroute_tests}
+        self.data_store = {key: state for key, state in self.data_store.items() if key in listed_keys}
+        return sorted(traceroute_tests, key=priority)
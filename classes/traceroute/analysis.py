@@ -5,10 +5,12 @@ Acquires, cleans and analyses PerfSONAR traceroute test data from a PerfSONAR Me
 It also provides an option to output the results via the console or as a web page.
 """
 
+import math
 import statistics
 import time
 
 from classes.base import Jinja2Template
+from classes.traceroute.hop import TracerouteSeries, intern_string
 from lib import json_loader_saver
 
 __author__ = "Simon Peter Green"
@@ -22,67 +24,43 @@ __status__ = "Development"
 
 
 class TracerouteAnalysis(Jinja2Template):
-    def __init__(self, traceroute_test_data, jinja_template_file_path):
+    def __init__(self, traceroute_test_data, jinja_template_file_path,
+                 retrieve_json=json_loader_saver.retrieve_json_from_url, retrieve_series=None):
         """
         Performs initial retrieval of traceroute data and variables needed for analysis.
         :param traceroute_test_data: traceroute information gathered from the main perfSONAR query
+        :param retrieve_json: function used to retrieve the traceroute results e.g. ArchiveFetcher.retrieve_json_from_url
+        :param retrieve_series: function returning the TracerouteSeries of the test's API URL
+                                e.g. ArchiveFetcher.retrieve_series; if None retrieve_json is used
         """
         Jinja2Template.__init__(self, jinja_template_file_path)
         self.different_route_index = set()
-        self.trace_route_results = json_loader_saver.retrieve_json_from_url(traceroute_test_data['api'])
-        latest_trace_route = self.trace_route_results[-1]
-        self.route_info = self.route_cleaner(latest_trace_route['val'])
+        # Normalises every test once; all further route access uses the series' canonical Hop routes
+        if retrieve_series is not None:
+            self.trace_route_results = retrieve_series(traceroute_test_data['api'])
+        else:
+            self.trace_route_results = TracerouteSeries.from_esmond(retrieve_json(traceroute_test_data['api']))
+        if not len(self.trace_route_results):
+            raise ValueError("No traceroute tests within the time period")
+        # Every retrieved test, kept when downsampled so the hop baselines still receive every test
+        self.retrieved_results = self.trace_route_results
+        self.route_info = self.trace_route_results.route(-1)
         self.information = {'source_ip': traceroute_test_data['source'],
                             'destination_ip': traceroute_test_data['destination'],
                             'source_domain': traceroute_test_data['source_domain'],
                             'destination_domain': traceroute_test_data['destination_domain'],
                             'route_stats': self.route_info,
-                            'test_time': self.datetime_from_timestamps(latest_trace_route['ts'])}
-
-    @staticmethod
-    def _tidy_route_slice(route):
-        """
-        Determines whether a route is able to be tidied up in the case of trailing timeouts i.e. '*'.
-        Returns the slice needed to tidy the traceroute.
-        :param route: traceroute route
-        :return: None or slice to be performed on route
-        """
-
-        if '*' not in str(route[-1]['rtt']):
-            return
-        route_reversed = reversed(route)
-        count = -1
-        for hop in route_reversed:
-            if '*' not in hop.values():
-                break
-            count += 1
-        if count > 0:
-            return slice(-count)
-        return
+                            'test_time': self.trace_route_results.timestamps[-1]}
 
-    def route_cleaner(self, route):
+    def downsample(self, full_resolution_period, max_older_tests):
         """
-
-        :param route:
-        :return:
+        Reduces the tests used for analysis, see TracerouteSeries.downsample. The hop baselines are still updated
+        from every retrieved test.
+        :param full_resolution_period: period in seconds, counting back from the latest test, kept in full
+        :param max_older_tests: maximum amount of older tests, excluding route changes, to keep
+        :return: None
         """
-        for hop in route:
-            hop['hostname'] = hop.setdefault('hostname', hop.get('ip', '*'))
-            if hop.get('hostname') == 'gateway':
-                hop['hostname'] = hop.get('ip', '*')
-            hop['ip'] = hop.setdefault('ip', '*')
-            try:
-                hop['as'] = hop.get('as', {}).get('number', '*')
-            except AttributeError:
-                hop['as'] = hop.get('as', '*')
-            try:
-                hop['rtt'] = round(hop['rtt'], 2)
-            except (TypeError, KeyError):
-                hop['rtt'] = hop.get('rtt', '*')
-        slice_amount = self._tidy_route_slice(route)
-        if slice_amount:
-            route = route[slice_amount]
-        return route
+        self.trace_route_results = self.trace_route_results.downsample(full_resolution_period, max_older_tests)
 
     @staticmethod
     def datetime_from_timestamps(*timestamps):
@@ -137,7 +115,7 @@ class TracerouteAnalysis(Jinja2Template):
             print("Error: Not enough elements within list")
         return {"min": "", "lower_quartile": "", "median": "", "upper_quartile": "", "max": "", "threshold": ""}
 
-    def retrieve_all_rtts_for_hop(self, hop_index, hop_ip):
+    def retrieve_all_rtts_for_hop(self, hop_index, hop_ip, network_index=None):
         """
         Retrieves the round trip time values from every test if they satisfy the hop ip occurring
         at the specified hop index.
@@ -145,34 +123,54 @@ class TracerouteAnalysis(Jinja2Template):
         an IndexError.
         :param hop_index:
         :param hop_ip:
+        :param network_index: HopIndex containing the series; if set the samples are retrieved from the index
         :return:
         """
-        if "*" in hop_ip:
-            return
+        if network_index is not None:
+            test_indexes, rtt = network_index.hop_samples(self.information['source_ip'],
+                                                          self.information['destination_ip'],
+                                                          hop_index, hop_ip)
+            self.different_route_index.update(set(range(len(self.trace_route_results))).difference(test_indexes))
+            return list(rtt)
         rtt = []
         rtt_append = rtt.append
         different_route_add = self.different_route_index.add
-        for (test_index, traceroute_test) in enumerate(self.trace_route_results):
-            try:
-                if traceroute_test["val"][hop_index]["ip"] == hop_ip:
-                    rtt_append(float(traceroute_test["val"][hop_index]["rtt"]))
-                else:
-                    different_route_add(test_index)
-            except (KeyError, IndexError, ValueError):
+        series = self.trace_route_results
+        hop_ip_id = intern_string(hop_ip)
+        ip_ids, rtts, offsets = series.ip_ids, series.rtts, series.offsets
+        for test_index in range(len(series)):
+            position = offsets[test_index] + hop_index
+            if position < offsets[test_index + 1] and ip_ids[position] == hop_ip_id and not math.isnan(rtts[position]):
+                rtt_append(rtts[position])
+            else:
                 different_route_add(test_index)
-                continue
         return rtt
 
-    def perform_traceroute_analysis(self):
+    def perform_traceroute_analysis(self, hop_baselines=None, network_index=None):
         """
         Performs latest_route_analysis on the most recent traceroute against previous traceroute test
         Retrieves statistical information for the specified hop and updates route_info with said statistics.
+        :param hop_baselines: HopBaselines store; if set it is updated with every retrieved test and the statistics
+                              are estimated from its quantile sketches instead of from every test within the
+                              time period
+        :param network_index: HopIndex which the series has been added to; if set the hop RTTs are retrieved
+                              from the index and the resulting hop statuses are recorded within it
         :return: route statistics for the most recent traceroute
         """
-        for (hop_index, hop_info) in enumerate(self.route_info):
-            rtt = self.retrieve_all_rtts_for_hop(hop_index=hop_index, hop_ip=hop_info.get('ip'))
+        source_ip, destination_ip = self.information['source_ip'], self.information['destination_ip']
+        if hop_baselines is not None:
+            hop_baselines.update_from_series(source_ip, destination_ip, self.retrieved_results)
 
-            hop_details = self.five_number_summary(rtt)
+        for (hop_index, hop_info) in enumerate(self.route_info):
+            rtt = None
+            if not hop_info.is_timeout:
+                rtt = self.retrieve_all_rtts_for_hop(hop_index=hop_index, hop_ip=hop_info.ip,
+                                                     network_index=network_index)
+
+            if hop_baselines is not None and rtt:
+                hop_details = hop_baselines.five_number_summary(source_ip, destination_ip, hop_index, hop_info.ip)
+            else:
+                hop_details = self.five_number_summary(rtt)
             status = "unknown"
 
             if rtt:
@@ -185,6 +183,8 @@ class TracerouteAnalysis(Jinja2Template):
             hop_details['hop_number'] = hop_index + 1
             hop_details["status"] = status
             hop_info.update(hop_details)
+            if network_index is not None:
+                network_index.record_status(source_ip, destination_ip, hop_info)
         return self.route_info
 
     def historical_diff_routes(self):
@@ -204,13 +204,13 @@ class TracerouteAnalysis(Jinja2Template):
         sorted_diff_route_index = sorted(list(self.different_route_index), reverse=True)
         # Retrieves all of the different routes that occurred during the data period and stores the routes within the
         # historical_routes list
+        series = self.trace_route_results
         for i in sorted_diff_route_index:
-            changed_traceroute = self.trace_route_results[i]
-            route = [hop.get('ip', '*') for hop in changed_traceroute['val']]
+            route = series.ip_route(i)
 
             if previous_route != route:
-                historical_routes.append({'date_time': self.datetime_from_timestamps(changed_traceroute['ts']),
-                                          'route_info': self.route_cleaner(changed_traceroute['val'])})
+                historical_routes.append({'date_time': series.timestamps[i],
+                                          'route_info': series.route(i)})
             previous_route = route
         return historical_routes
 
@@ -220,24 +220,33 @@ class TracerouteAnalysis(Jinja2Template):
         :return: None
         """
         print("\nTraceroute to {ip}\n{end_date}\n".format(ip=self.information['destination_ip'],
-                                                          end_date=self.information['test_time']))
+                                                          end_date=self.datetime_from_timestamps(
+                                                              self.information['test_time'])))
         print("Hop:\tIP:\t\t\tAS:   RTT: Min: Median: Threshold: Notice:\tDomain:\n")
         for (index, hop) in enumerate(self.information['route_stats']):
             print("{:4} {ip:24} {as:5} {rtt:6} {status:7} {hostname}".format(index + 1, **hop))
 
-    def create_traceroute_web_page(self, historical_routes):
+    def traceroute_details(self, historical_routes):
+        """
+        Returns the details of the current traceroute test used for the traceroute web page or data bundle
+        :param historical_routes: list returned by historical_diff_routes
+        :return: dict
+        """
+        return {'source_ip': self.information['source_ip'],
+                'dest_ip': self.information['destination_ip'],
+                'start_date': self.trace_route_results.timestamps[0],
+                'end_date': self.information['test_time'],
+                'traceroute': self.information['route_stats'],
+                'historical_routes': historical_routes}
+
+    def create_traceroute_web_page(self, historical_routes, rtt_sparkline=''):
         """
         Creates a detailed HTML traceroute results page for the current traceroute test
         :param historical_routes:
+        :param rtt_sparkline: SVG polyline points of the end-to-end RTT history, see RTTStore.sparkline
         :return:
         """
-        start_date = self.datetime_from_timestamps(self.trace_route_results[0]["ts"])
-        return self.render_template_output(source_ip=self.information['source_ip'],
-                                           dest_ip=self.information['destination_ip'],
-                                           start_date=start_date,
-                                           end_date=self.information['test_time'],
-                                           traceroute=self.information['route_stats'],
-                                           historical_routes=historical_routes)
+        return self.render_template_output(rtt_sparkline=rtt_sparkline, **self.traceroute_details(historical_routes))
 
     def __str__(self):
         return "Traceroute({source}, {destination})".format(source=self.information['source_domain'],
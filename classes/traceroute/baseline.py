@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+"""Provides the QuantileSketch and HopBaselines classes for long term hop latency baselines.
+
+The exact five number summary needs every RTT of a hop within the analysis period, so its cost
+grows with the time period. A HopBaselines store instead keeps a small, mergeable quantile sketch
+(a merging t-digest) per source/destination pair, hop index and hop IP address for each time bucket.
+Sketches are updated with new tests only and saved between runs, allowing the hop quartiles and
+threshold to be computed from a bounded amount of data regardless of the baseline period.
+"""
+
+import bisect
+import json
+import math
+import os.path
+from classes.bundle import PairBundles
+from lib.static_output import minify_json
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+class QuantileSketch:
+    """
+    Merging t-digest. Values are buffered and periodically merged into a bounded amount of
+    centroids (mean, weight) with smaller centroids kept near the tails of the distribution.
+    Sketches can be merged with each other and stored as a list for JSON serialisation.
+    """
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+
+    def add(self, value, weight=1):
+        """
+        Adds a value to the sketch
+        :param value: number to add
+        :param weight: amount of occurrences of value
+        :return: None
+        """
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) > 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """
+        Merges the centroids of another sketch into the current sketch
+        :param other: QuantileSketch
+        :return: self
+        """
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        """
+        Merges the buffered values and existing centroids. A centroid may only grow while the
+        quantile range it covers stays within the t-digest size bound of 4 * n * q * (1 - q) / compression.
+        :return: None
+        """
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        total = sum(weight for _, weight in points)
+        means, weights = [points[0][0]], [points[0][1]]
+        cumulative = 0
+        for mean, weight in points[1:]:
+            q = (cumulative + weights[-1] + weight / 2) / total
+            size_limit = max(1, 4 * total * q * (1 - q) / self.compression)
+            if weights[-1] + weight <= size_limit:
+                combined = weights[-1] + weight
+                means[-1] += (mean - means[-1]) * weight / combined
+                weights[-1] = combined
+            else:
+                cumulative += weights[-1]
+                means.append(mean)
+                weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def quantile(self, q):
+        """
+        Estimates the value at quantile q by interpolating between centroid centres
+        :param q: quantile between 0 and 1
+        :return: float or None if the sketch is empty
+        """
+        self._compress()
+        if not self.count:
+            return
+        if len(self.means) == 1:
+            return self.means[0]
+        target = q * self.count
+        cumulative = 0
+        previous_centre, previous_mean = 0, self.min
+        for mean, weight in zip(self.means, self.weights):
+            centre = cumulative + weight / 2
+            if target <= centre:
+                if centre == previous_centre:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (target - previous_centre) / (centre - previous_centre)
+            previous_centre, previous_mean = centre, mean
+            cumulative += weight
+        if self.count == previous_centre:
+            return self.max
+        return previous_mean + (self.max - previous_mean) * (target - previous_centre) / (self.count - previous_centre)
+
+    def to_list(self):
+        """
+        :return: list representation of the sketch used for JSON serialisation
+        """
+        self._compress()
+        return [self.count, self.min, self.max, self.means, self.weights]
+
+    @classmethod
+    def from_list(cls, sketch_list, compression=100):
+        """
+        Creates a sketch from the list returned by to_list
+        :param sketch_list: [count, min, max, means, weights]
+        :param compression: t-digest compression
+        :return: QuantileSketch
+        """
+        sketch = cls(compression)
+        sketch.count, sketch.min, sketch.max, sketch.means, sketch.weights = sketch_list
+        return sketch
+
+
+class HopBaselines:
+    """
+    Stores the hop latency sketches of each traceroute test within time buckets, one compact JSON file per pair
+    within directory e.g. json/hop_baselines/192.168.0.1-to-192.168.1.1.json. Pairs are loaded on first use and
+    only the pairs that changed are saved.
+    Pair file example:
+        {
+            "covered": [[1483228800, 1485920150]],
+            "hops": {
+                "0_192.168.0.254": {"1485907200": [count, min, max, means, weights], ...},
+                ...
+            }
+        }
+    covered lists the (inclusive) time ranges whose tests have been added, so that a test is only added once
+    whether it is newer or older than the tests added before, e.g. by the backfill command.
+    Each bucket sketch is compressed with compression * bucket_size / period so the centroids of a hop, summed
+    over every bucket of the baseline period, stay in the order of compression regardless of the period.
+    """
+    def __init__(self, directory, period=2592000, bucket_size=86400, compression=100):
+        """
+        :param directory: directory containing a JSON file per source/destination pair
+        :param period: baseline period in seconds
+        :param bucket_size: time period in seconds covered by each sketch
+        :param compression: t-digest compression of the merged sketch of a hop
+        """
+        self.directory = directory
+        self.period = period
+        self.bucket_size = bucket_size
+        self.compression = compression
+        self.bucket_compression = compression * min(bucket_size / period, 1)
+        # {(source_ip, destination_ip): {'covered': [[start, end], ...], 'hops': {hop_key: {bucket: QuantileSketch}}}}
+        self._pairs = {}
+        self._changed = set()
+
+    def _bucket(self, timestamp):
+        return str(int(timestamp) - int(timestamp) % self.bucket_size)
+
+    def _pair_file_path(self, source_ip, destination_ip):
+        return os.path.join(self.directory, "%s.json" % PairBundles.pair_key(source_ip, destination_ip))
+
+    def _pair(self, source_ip, destination_ip):
+        """
+        Returns the coverage and sketches of a pair, loading them from its pair file if needed
+        :return: {'covered': [[start, end], ...], 'hops': {hop_key: {bucket: QuantileSketch}}}
+        """
+        try:
+            return self._pairs[source_ip, destination_ip]
+        except KeyError:
+            pass
+        try:
+            with open(self._pair_file_path(source_ip, destination_ip), "r") as pair_file:
+                pair_data = json.load(pair_file)
+        except (FileNotFoundError, ValueError):
+            pair_data = {}
+        pair = {'covered': pair_data.get('covered', []),
+                'hops': {hop_key: {bucket: QuantileSketch.from_list(sketch, self.bucket_compression)
+                                   for bucket, sketch in buckets.items()}
+                         for hop_key, buckets in pair_data.get('hops', {}).items()}}
+        self._pairs[source_ip, destination_ip] = pair
+        return pair
+
+    @staticmethod
+    def _is_covered(covered, timestamp):
+        index = bisect.bisect_right(covered, [timestamp, math.inf]) - 1
+        return index >= 0 and covered[index][0] <= timestamp <= covered[index][1]
+
+    @staticmethod
+    def _add_covered(covered, start, end):
+        """
+        :param covered: ordered list of inclusive [start, end] time ranges
+        :return: ordered list of the time ranges merged with [start, end]
+        """
+        merged = []
+        for range_start, range_end in sorted(covered + [[start, end]]):
+            if merged and range_start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        return merged
+
+    def update_from_series(self, source_ip, destination_ip, series, covered_range=None):
+        """
+        Adds the hop RTTs of tests outside of the pair's covered time ranges to the pair's sketches and
+        removes buckets that have fallen outside of the baseline period.
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param series: TracerouteSeries of the traceroute test
+        :param covered_range: inclusive (start, end) time range the series holds every test of,
+                              defaults to the timestamps of its first and last test
+        :return: amount of tests added
+        """
+        pair = self._pair(source_ip, destination_ip)
+        sketches = pair['hops']
+        covered = pair['covered']
+        ip_route = series.ip_route
+        added = 0
+        for test_index, timestamp in enumerate(series.timestamps):
+            if self._is_covered(covered, timestamp):
+                continue
+            added += 1
+            bucket = self._bucket(timestamp)
+            hop_range = series.hop_range(test_index)
+            for hop_index, (hop_ip, position) in enumerate(zip(ip_route(test_index), hop_range)):
+                rtt = series.rtts[position]
+                if math.isnan(rtt):
+                    continue
+                hop_key = "%d_%s" % (hop_index, hop_ip)
+                hop_buckets = sketches.setdefault(hop_key, {})
+                try:
+                    hop_buckets[bucket].add(rtt)
+                except KeyError:
+                    hop_buckets[bucket] = QuantileSketch(self.bucket_compression)
+                    hop_buckets[bucket].add(rtt)
+        if covered_range is None and len(series):
+            covered_range = (series.timestamps[0], series.timestamps[-1])
+        if covered_range is None:
+            return added
+        covered = self._add_covered(covered, int(covered_range[0]), int(covered_range[1]))
+
+        oldest = covered[-1][1] - self.period
+        oldest_bucket = int(self._bucket(oldest))
+        for hop_key, hop_buckets in list(sketches.items()):
+            for bucket in [bucket for bucket in hop_buckets if int(bucket) < oldest_bucket]:
+                del hop_buckets[bucket]
+            if not hop_buckets:
+                del sketches[hop_key]
+        if covered[0][0] < oldest:
+            # Ranges before the baseline period are collapsed into one, as tests within them are discarded anyway
+            covered = self._add_covered([time_range for time_range in covered if time_range[1] >= oldest],
+                                        covered[0][0], oldest)
+        pair['covered'] = covered
+        self._changed.add((source_ip, destination_ip))
+        return added
+
+    def save(self):
+        """
+        Saves the pairs that changed since they were loaded, each within its own compact JSON file
+        :return: None
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for source_ip, destination_ip in sorted(self._changed):
+            pair = self._pairs[source_ip, destination_ip]
+            pair_data = {'covered': pair['covered'],
+                         'hops': {hop_key: {bucket: sketch.to_list() for bucket, sketch in hop_buckets.items()}
+                                  for hop_key, hop_buckets in pair['hops'].items()}}
+            file_path = self._pair_file_path(source_ip, destination_ip)
+            with open("%s.tmp" % file_path, "w") as pair_file:
+                pair_file.write(minify_json(pair_data))
+            os.replace("%s.tmp" % file_path, file_path)
+        self._changed.clear()
+
+    def five_number_summary(self, source_ip, destination_ip, hop_index, hop_ip):
+        """
+        Estimates the five number summary and threshold of a hop from its merged sketches.
+        Returns the same dictionary as TracerouteAnalysis.five_number_summary.
+        :param source_ip: Source IP address of the traceroute test
+        :param destination_ip: Destination IP address of the traceroute test
+        :param hop_index: index of the hop within the route
+        :param hop_ip: IP address of the hop
+        :return: dict
+        """
+        hop_buckets = self._pair(source_ip, destination_ip)['hops'].get("%d_%s" % (hop_index, hop_ip), {})
+        if not hop_buckets:
+            return {"min": "", "lower_quartile": "", "median": "", "upper_quartile": "", "max": "", "threshold": ""}
+        sketch = QuantileSketch(self.compression)
+        for bucket_sketch in hop_buckets.values():
+            sketch.merge(bucket_sketch)
+        lower_quartile, upper_quartile = sketch.quantile(0.25), sketch.quantile(0.75)
+        return {"min": sketch.min,
+                "lower_quartile": lower_quartile,
+                "median": sketch.quantile(0.5),
+                "upper_quartile": upper_quartile,
+                "max": sketch.max,
+                "threshold": upper_quartile + 1.5 * (upper_quartile - lower_quartile)}
@@ -5,9 +5,8 @@ Performs a couple of comparison tests between historical and current routes to s
 whether an email alert needs to be sent out due to a significant route change.
 """
 
-import itertools
 from classes.base import DataStore, Jinja2Template
-from lib import email
+from classes.traceroute.similarity import aligned_rows, score_routes
 
 __author__ = "Simon Peter Green"
 __copyright__ = "Copyright (c) 2017 spgreen"
@@ -28,14 +27,21 @@ class RouteComparison(DataStore, Jinja2Template):
      used for the email message and the email function to send said generated
      HTML email message.
     """
-    changed_routes = []
-
-    def __init__(self, threshold, jinja_template_file_path):
+    def __init__(self, threshold, jinja_template_file_path, alert_queue=None):
+        """
+        :param threshold: ratio of hops that need to differ for a route change to be alerted on
+        :param jinja_template_file_path: file path of the email Jinja2 template
+        :param alert_queue: optional AlertQueue each route change alert is queued on as it is found
+        """
         DataStore.__init__(self)
         Jinja2Template.__init__(self, jinja_template_file_path)
         if threshold > 1.0:
             raise ValueError('Threshold can not be greater than 1.0')
         self.threshold = threshold
+        self.alert_queue = alert_queue
+        self.changed_routes = []
+        # (traceroute, previous_route, status) of the route changes awaiting scoring by score_changes
+        self._pending_changes = []
 
     @staticmethod
     def compare_three_objects(first, second, third):
@@ -100,40 +106,51 @@ class RouteComparison(DataStore, Jinja2Template):
         """
         return [[hop.get('ip')for hop in route['route_stats']] for route in args]
 
-    def _update_email_alerts_based_on_threshold(self, traceroute, previous_route, status):
+    def score_changes(self):
         """
-        Updates the change_routes list used for email notifications with traceroute test information
-        if the current and previous routes have changed by a specified threshold set in the config.ini
-        file.
-        :param traceroute: traceroute data in Traceroute.information form
-        :param previous_route: traceroute data in Traceroute.information form
-        :param status: indicates the change that has occurred between the previous and current test
-        :return: None
+        Scores every route change found by check_changes since the last call in one batch and updates the
+        changed_routes list used for email notifications with the changes whose difference exceeds the
+        threshold set in the config.ini file. The previous and current routes of each alert are aligned
+        so that an inserted or removed hop is shown on its own row.
+        :return: list of the new changed_routes entries
         """
-        routes = itertools.zip_longest(previous_route['route_stats'], traceroute['route_stats'])
-        previous_ip_route, current_ip_route = self._retrieve_ip_route_from_route_data(previous_route, traceroute)
-        if self.difference_check_with_threshold(previous_ip_route, current_ip_route):
-            self.changed_routes.append({'source_domain': traceroute['source_domain'],
-                                        'destination_domain': traceroute['destination_domain'],
-                                        'previous_test_time': previous_route['test_time'],
-                                        'current_test_time': traceroute['test_time'],
-                                        'previous_and_current_route': routes,
-                                        'status': status})
-        return
+        pending_changes, self._pending_changes = self._pending_changes, []
+        scores = score_routes([self._retrieve_ip_route_from_route_data(previous_route, traceroute)
+                               for traceroute, previous_route, _ in pending_changes])
+        alerts = []
+        for (traceroute, previous_route, status), (difference, alignment) in zip(pending_changes, scores):
+            if difference <= self.threshold:
+                continue
+            alert = {'source_ip': traceroute['source_ip'],
+                     'destination_ip': traceroute['destination_ip'],
+                     'source_domain': traceroute['source_domain'],
+                     'destination_domain': traceroute['destination_domain'],
+                     'previous_test_time': previous_route['test_time'],
+                     'current_test_time': traceroute['test_time'],
+                     'previous_and_current_route': aligned_rows(previous_route['route_stats'],
+                                                                traceroute['route_stats'], alignment),
+                     'difference': round(difference, 2),
+                     'status': status}
+            alerts.append(alert)
+            if self.alert_queue is not None:
+                self.alert_queue.put(alert)
+        self.changed_routes.extend(alerts)
+        return alerts
 
     def check_changes(self, traceroute):
         """
         Compares the current route with the last two significant traceroute results.
-        It updates the historical traceroute test data store and preps the variables
-        needed if an email notification for a route flap/change occurs.
+        It updates the historical traceroute test data store and queues the route change
+        to be scored by score_changes in case an email notification for a route flap/change is needed.
         If no previous routes are found, the current route will be added to the
         data_store dictionary
         :param traceroute: Traceroute data in the form of Traceroute.information
         :return: None
         """
         source_ip, destination_ip = traceroute['source_ip'], traceroute['destination_ip']
+        # Hop objects are stored as dictionaries as the data store is saved in JSON format
         current_route = {'test_time': traceroute['test_time'],
-                         'route_stats': traceroute['route_stats']}
+                         'route_stats': [dict(hop) for hop in traceroute['route_stats']]}
 
         historical_routes = self._retrieve_historical_route_data(source_ip, destination_ip, current_route)
         if not historical_routes:
@@ -150,6 +167,9 @@ class RouteComparison(DataStore, Jinja2Template):
         previous_route = first_route
         self.data_store[source_ip][destination_ip].update({'first_result': second_route,
                                                            'second_result': current_route})
+        if status in ('CHANGE', 'FLAP'):
+            # Epoch time of the test the route last changed in, used to prioritise recently changed pairs
+            self.data_store[source_ip][destination_ip]['last_change'] = traceroute['test_time']
         if 'FLAP' in status:
             if flap_tag:
                 return
@@ -159,29 +179,13 @@ class RouteComparison(DataStore, Jinja2Template):
             return
         elif 'CHANGE' in status:
             self.data_store[source_ip][destination_ip]['flapping'] = 0
-        self._update_email_alerts_based_on_threshold(traceroute, previous_route, status)
+        self._pending_changes.append((traceroute, previous_route, status))
         return
 
-    def difference_check_with_threshold(self, list_a, list_b):
-        """
-        Performs a comparison check between two lists and checks whether the percentage difference
-        between the lists exceed the specified threshold in config.ini.
-        :param list_a: list to be compared
-        :param list_b: list to be compared
-        :return: True or False
-        """
-        combined_list = list(itertools.zip_longest(list_a, list_b))
-        combined_list_length = len(combined_list)
-        number_of_differences = len([i for i, j in combined_list if i != j])
-
-        percentage_difference = number_of_differences / combined_list_length
-        if percentage_difference > self.threshold:
-            return True
-        return False
-
     def send_email_alert(self, email_to, email_from, subject, smtp_server):
         """
-        Sends an email message to recipients regarding the routes that have changed
+        Sends an email message to recipients regarding the routes that have changed.
+        Blocks until sent; use an AlertQueue for non-blocking, digested alerts.
 
         Email example if using html_templates/email.html.j2:
             Dear Network Admin,
@@ -204,5 +208,6 @@ class RouteComparison(DataStore, Jinja2Template):
         :return: None
         """
         email_message = self.render_template_output(changed_routes=self.changed_routes)
+        from lib import email
         email.send_mail(email_to, email_from, subject, email_message, smtp_server)
         print("Notification email sent to %s" % ", ".join(email_to))
@@ -0,0 +1,364 @@
+#!/usr/bin/python3
+"""Provides the Hop and TracerouteSeries classes for compact traceroute storage.
+
+Raw esmond packet-trace results are lists of per-hop dictionaries which, once cleaned and
+annotated with statistics, make up the bulk of psTrace's memory usage on long time periods.
+TracerouteSeries packs every test of a single traceroute into parallel typed arrays while Hop
+is a __slots__ record used for routes that are actually analysed, rendered or compared.
+
+TracerouteSeries is also the single normalisation stage of psTrace: every test is normalised once
+when it is ingested (timeouts, gateway hostnames, AS objects and trailing timeouts) and the canonical
+Hop routes are cached so that downstream consumers never need to clean a route themselves.
+"""
+
+import bisect
+import itertools
+import math
+import random
+from array import array
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+# Value used in place of missing hop information i.e. a timeout
+TIMEOUT = '*'
+
+# Interned strings (IP addresses and hostnames) shared by every series within the process
+_STRINGS = []
+_STRING_IDS = {}
+
+
+def intern_string(value):
+    """
+    Returns the integer id of a string within the shared string table, adding it if needed
+    :param value: string to intern or None
+    :return: int; -1 if value is None
+    """
+    if value is None:
+        return -1
+    try:
+        return _STRING_IDS[value]
+    except KeyError:
+        _STRING_IDS[value] = len(_STRINGS)
+        _STRINGS.append(value)
+        return _STRING_IDS[value]
+
+
+def string_from_id(string_id, default=None):
+    """
+    Returns the string corresponding to an id retrieved from intern_string
+    :param string_id: id of the interned string
+    :param default: value returned for an id of -1
+    :return: str
+    """
+    if string_id < 0:
+        return default
+    return _STRINGS[string_id]
+
+
+class Hop:
+    """
+    Single traceroute hop along with the statistics calculated for it during analysis.
+    Supports the dictionary style access (hop['as'], hop.get('ip'), **hop) used by the
+    Jinja2 templates and the rest of psTrace so it can be used in place of the esmond hop dict.
+    """
+    __slots__ = ('ip', 'hostname', 'asn', 'rtt', 'hop_number', 'min', 'lower_quartile', 'median',
+                 'upper_quartile', 'max', 'threshold', 'status')
+
+    # Dictionary keys that differ from their slot names
+    _KEY_TO_SLOT = {'as': 'asn'}
+    _SLOT_TO_KEY = {'asn': 'as'}
+
+    def __init__(self, ip=TIMEOUT, hostname=TIMEOUT, asn=TIMEOUT, rtt=TIMEOUT):
+        self.ip = ip
+        self.hostname = hostname
+        self.asn = asn
+        self.rtt = rtt
+        self.hop_number = ''
+        self.min = ''
+        self.lower_quartile = ''
+        self.median = ''
+        self.upper_quartile = ''
+        self.max = ''
+        self.threshold = ''
+        self.status = ''
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._KEY_TO_SLOT.get(key, key))
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, self._KEY_TO_SLOT.get(key, key), value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self._KEY_TO_SLOT.get(key, key) in self.__slots__
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return "Hop({ip}, {hostname})".format(ip=self.ip, hostname=self.hostname)
+
+    @property
+    def is_timeout(self):
+        """
+        :return: True if the hop did not respond to the traceroute test
+        """
+        return self.ip == TIMEOUT
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [self._SLOT_TO_KEY.get(slot, slot) for slot in self.__slots__]
+
+    def values(self):
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def update(self, hop_details):
+        """
+        Updates the hop with the statistical information found within hop_details
+        :param hop_details: dictionary with keys matching those returned by keys()
+        :return: None
+        """
+        for key, value in hop_details.items():
+            self[key] = value
+
+    def to_dict(self):
+        """
+        :return: dictionary representation of the hop, suitable for saving as JSON
+        """
+        return dict(self.items())
+
+
+class TracerouteSeries:
+    """
+    Stores every traceroute test of a single source/destination pair within parallel typed arrays.
+    Test i consists of hops offsets[i] to offsets[i + 1] of the hop arrays:
+        ip_ids, hostname_ids - ids of the interned IP address and hostname, -1 if missing
+        asns - AS number, -1 if missing
+        rtts - round trip time as a float32, NaN if missing
+    Routes are normalised on ingest; gateway or missing hostnames are replaced by the hop IP address
+    and trailing timeouts are trimmed down to a single timeout hop.
+    """
+    def __init__(self):
+        self.timestamps = array('q')
+        self.offsets = array('l', [0])
+        self.ip_ids = array('l')
+        self.hostname_ids = array('l')
+        self.asns = array('l')
+        self.rtts = array('f')
+        self._routes = {}
+
+    @classmethod
+    def from_esmond(cls, traceroute_results):
+        """
+        Creates a series from the JSON results of an esmond packet-trace/base query
+        :param traceroute_results: list of {'ts': timestamp, 'val': [hop, ...]} dictionaries
+        :return: TracerouteSeries
+        """
+        series = cls()
+        for traceroute_test in traceroute_results:
+            series.append(traceroute_test['ts'], traceroute_test.get('val', []))
+        return series
+
+    def append(self, timestamp, route):
+        """
+        Normalises and packs an esmond route (list of hop dictionaries) into the series
+        :param timestamp: epoch timestamp of the test
+        :param route: list of esmond hop dictionaries
+        :return: None
+        """
+        for hop in route[:len(route) - self._trailing_timeouts_to_trim(route)]:
+            ip_id = intern_string(hop.get('ip'))
+            hostname = hop.get('hostname')
+            self.ip_ids.append(ip_id)
+            self.hostname_ids.append(ip_id if hostname in (None, 'gateway') else intern_string(hostname))
+            self.asns.append(self._asn_from_esmond(hop.get('as')))
+            try:
+                self.rtts.append(float(hop['rtt']))
+            except (KeyError, TypeError, ValueError):
+                self.rtts.append(math.nan)
+        self.timestamps.append(int(timestamp))
+        self.offsets.append(len(self.ip_ids))
+
+    @staticmethod
+    def _trailing_timeouts_to_trim(route):
+        """
+        Determines the amount of trailing timeouts to remove from a route, leaving a single
+        timeout at the end of the route to indicate that the destination did not respond.
+        :param route: list of esmond hop dictionaries
+        :return: int
+        """
+        count = 0
+        for hop in reversed(route):
+            if hop.get('rtt') is not None:
+                break
+            count += 1
+        return max(count - 1, 0)
+
+    @staticmethod
+    def _asn_from_esmond(as_info):
+        """
+        :param as_info: esmond AS information i.e. {'number': 7610, 'owner': '...'} or AS number
+        :return: AS number or -1 if unknown
+        """
+        try:
+            as_info = as_info.get('number')
+        except AttributeError:
+            pass
+        try:
+            return int(as_info)
+        except (TypeError, ValueError):
+            return -1
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def view(self):
+        """
+        :return: new TracerouteSeries sharing the tests of this series but with its own route cache, so the
+                 Hop objects of its routes can be updated with statistics without changing those of this series
+        """
+        series = TracerouteSeries()
+        series.timestamps, series.offsets = self.timestamps, self.offsets
+        series.ip_ids, series.hostname_ids = self.ip_ids, self.hostname_ids
+        series.asns, series.rtts = self.asns, self.rtts
+        return series
+
+    def _copy_tests(self, test_indexes):
+        """
+        :param test_indexes: ordered indexes of the tests to copy
+        :return: new TracerouteSeries containing only the specified tests
+        """
+        series = TracerouteSeries()
+        for test_index in test_indexes:
+            start, end = self.offsets[test_index], self.offsets[test_index + 1]
+            series.ip_ids.extend(self.ip_ids[start:end])
+            series.hostname_ids.extend(self.hostname_ids[start:end])
+            series.asns.extend(self.asns[start:end])
+            series.rtts.extend(self.rtts[start:end])
+            series.timestamps.append(self.timestamps[test_index])
+            series.offsets.append(len(series.ip_ids))
+        return series
+
+    def since(self, start):
+        """
+        :param start: epoch timestamp of the first test to keep
+        :return: new TracerouteSeries containing only the tests from start onwards
+        """
+        return self._copy_tests(range(bisect.bisect_left(self.timestamps, start), len(self)))
+
+    @staticmethod
+    def _same_path(previous_route, route):
+        """
+        Compares two routes on their responding hops; a timeout matches any hop and a trailing timeout
+        matches any remaining hops of the longer route
+        :param previous_route: IP ids of the earlier route, -1 for timeouts
+        :param route: IP ids of the later route, -1 for timeouts
+        :return: True if no hop that responded within both routes differs
+        """
+        for previous_id, ip_id in zip(previous_route, route):
+            if previous_id >= 0 and ip_id >= 0 and previous_id != ip_id:
+                return False
+        if len(previous_route) == len(route):
+            return True
+        shorter_route = min(previous_route, route, key=len)
+        return len(shorter_route) > 0 and shorter_route[-1] < 0
+
+    def downsample(self, full_resolution_period, max_older_tests):
+        """
+        Keeps every test within full_resolution_period seconds of the latest test. Older tests are reservoir
+        sampled down to max_older_tests, except for tests where the route changed from the previous test
+        which are always kept so the route history remains complete. Route changes are detected on the
+        responding hops only so intermittent timeouts are not mistaken for a different route.
+        :param full_resolution_period: period in seconds, counting back from the latest test, kept in full
+        :param max_older_tests: maximum amount of older tests, excluding route changes, to keep
+        :return: downsampled TracerouteSeries or the series itself if nothing needed to be removed
+        """
+        if not len(self):
+            return self
+        recent_start = self.timestamps[-1] - full_resolution_period
+        keep, reservoir = [], []
+        # Seeded with the latest timestamp so repeated analyses of the same data keep the same tests
+        generator = random.Random(self.timestamps[-1])
+        older_tests = 0
+        previous_route = None
+        for test_index, timestamp in enumerate(self.timestamps):
+            route = self.ip_ids[self.offsets[test_index]:self.offsets[test_index + 1]]
+            route_changed = previous_route is None or not self._same_path(previous_route, route)
+            if route_changed:
+                previous_route = list(route)
+            else:
+                # Hops which timed out are filled in from the earlier tests of the same path
+                previous_route = [ip_id if ip_id >= 0 else previous_id for previous_id, ip_id
+                                  in itertools.zip_longest(previous_route, route, fillvalue=-1)]
+            if timestamp >= recent_start or route_changed:
+                keep.append(test_index)
+                continue
+            older_tests += 1
+            if len(reservoir) < max_older_tests:
+                reservoir.append(test_index)
+            else:
+                replace_index = generator.randrange(older_tests)
+                if replace_index < max_older_tests:
+                    reservoir[replace_index] = test_index
+        if older_tests <= max_older_tests:
+            return self
+        return self._copy_tests(sorted(keep + reservoir))
+
+    def hop_range(self, test_index):
+        """
+        :param test_index: index of the test within the series; negative indexes are supported
+        :return: range of the test's hop positions within the hop arrays
+        """
+        if test_index < 0:
+            test_index += len(self)
+        return range(self.offsets[test_index], self.offsets[test_index + 1])
+
+    def ip_route(self, test_index):
+        """
+        :param test_index: index of the test within the series
+        :return: list of IP addresses of the test's route with TIMEOUT for missing addresses
+        """
+        return [string_from_id(self.ip_ids[i], TIMEOUT) for i in self.hop_range(test_index)]
+
+    def route(self, test_index):
+        """
+        Unpacks a test into a list of canonical Hop objects. Missing values are set to TIMEOUT and
+        RTTs are rounded to 2 decimal places. Routes are cached so each test is unpacked only once.
+        :param test_index: index of the test within the series
+        :return: list of Hop
+        """
+        if test_index < 0:
+            test_index += len(self)
+        try:
+            return self._routes[test_index]
+        except KeyError:
+            pass
+        route = []
+        for i in self.hop_range(test_index):
+            rtt = self.rtts[i]
+            route.append(Hop(ip=string_from_id(self.ip_ids[i], TIMEOUT),
+                             hostname=string_from_id(self.hostname_ids[i], TIMEOUT),
+                             asn=self.asns[i] if self.asns[i] >= 0 else TIMEOUT,
+                             rtt=TIMEOUT if math.isnan(rtt) else round(rtt, 2)))
+        self._routes[test_index] = route
+        return route
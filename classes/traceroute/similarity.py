@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""Route similarity scoring by aligning routes rather than comparing them hop position by hop position.
+
+Routes are converted to tuples of interned hop IDs and aligned with the edit distance (Levenshtein)
+so that an inserted or removed hop only counts as a single difference. Alignments are memoized so
+recurring path pairs, e.g. a route flapping between two paths, are only aligned once per process.
+"""
+
+import functools
+from classes.traceroute.hop import intern_string
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+@functools.lru_cache(maxsize=4096)
+def _align_ids(ids_a, ids_b):
+    """
+    Aligns two routes of hop IDs by edit distance
+    :param ids_a: tuple of hop IDs
+    :param ids_b: tuple of hop IDs
+    :return: (edit distance, tuple of aligned (index within ids_a or None, index within ids_b or None))
+    """
+    length_a, length_b = len(ids_a), len(ids_b)
+    # Common leading and trailing hops align with themselves; only the differing middle is aligned
+    prefix = 0
+    while prefix < min(length_a, length_b) and ids_a[prefix] == ids_b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(length_a, length_b) - prefix and ids_a[-suffix - 1] == ids_b[-suffix - 1]:
+        suffix += 1
+    middle_a, middle_b = ids_a[prefix:length_a - suffix], ids_b[prefix:length_b - suffix]
+
+    rows, columns = len(middle_a) + 1, len(middle_b) + 1
+    distances = [[0] * columns for _ in range(rows)]
+    for row in range(rows):
+        distances[row][0] = row
+    for column in range(columns):
+        distances[0][column] = column
+    for row in range(1, rows):
+        for column in range(1, columns):
+            substitution = distances[row - 1][column - 1] + (middle_a[row - 1] != middle_b[column - 1])
+            distances[row][column] = min(substitution, distances[row - 1][column] + 1, distances[row][column - 1] + 1)
+
+    middle = []
+    row, column = rows - 1, columns - 1
+    while row or column:
+        if row and column and distances[row][column] == \
+                distances[row - 1][column - 1] + (middle_a[row - 1] != middle_b[column - 1]):
+            row, column = row - 1, column - 1
+            middle.append((prefix + row, prefix + column))
+        elif row and distances[row][column] == distances[row - 1][column] + 1:
+            row -= 1
+            middle.append((prefix + row, None))
+        else:
+            column -= 1
+            middle.append((None, prefix + column))
+    middle.reverse()
+
+    alignment = [(index, index) for index in range(prefix)]
+    alignment.extend(middle)
+    alignment.extend((length_a - suffix + index, length_b - suffix + index) for index in range(suffix))
+    return distances[-1][-1], tuple(alignment)
+
+
+def align_routes(route_a, route_b):
+    """
+    Scores the difference between two routes
+    :param route_a: list of hop IP addresses (or TIMEOUT) of the first route
+    :param route_b: list of hop IP addresses (or TIMEOUT) of the second route
+    :return: (difference, alignment); difference is the edit distance divided by the length of the longest
+             route, 0.0 to 1.0, alignment is a tuple of (index within route_a or None, index within route_b or None)
+    """
+    distance, alignment = _align_ids(tuple(intern_string(hop) for hop in route_a),
+                                     tuple(intern_string(hop) for hop in route_b))
+    longest = max(len(route_a), len(route_b))
+    return (distance / longest if longest else 0.0), alignment
+
+
+def score_routes(route_pairs):
+    """
+    Scores a batch of route pairs, aligning each distinct pair once
+    :param route_pairs: list of (route_a, route_b), see align_routes
+    :return: list of (difference, alignment) in the order of route_pairs
+    """
+    scores = {}
+    results = []
+    for route_a, route_b in route_pairs:
+        key = (tuple(route_a), tuple(route_b))
+        if key not in scores:
+            scores[key] = align_routes(route_a, route_b)
+        results.append(scores[key])
+    return results
+
+
+def aligned_rows(route_a, route_b, alignment):
+    """
+    :param route_a: list of the first route's hops
+    :param route_b: list of the second route's hops
+    :param alignment: alignment returned by align_routes
+    :return: list of (hop of route_a or None, hop of route_b or None), one per aligned row
+    """
+    return [(None if index_a is None else route_a[index_a], None if index_b is None else route_b[index_b])
+            for index_a, index_b in alignment]
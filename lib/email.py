@@ -18,15 +18,14 @@ __email__ = "simonpetergreen@singaren.net.sg"
 __status__ = "Development"
 
 
-def send_mail(to, fro, subject, message, server="localhost"):
+def create_message(to, fro, subject, message):
     """
-    Sends mail to SMTP relay which in return will send out to the recipients
+    Creates an HTML email message
     :param to: Recipients email address
-    :param fro: Email address of sender 
+    :param fro: Email address of sender
     :param subject: Subject Message
     :param message: Message contents
-    :param server: IP Address or FQDN of the SMTP server
-    :return: 
+    :return: MIMEMultipart message
     """
     assert type(to) == list
 
@@ -36,8 +35,26 @@ def send_mail(to, fro, subject, message, server="localhost"):
     msg['Date'] = formatdate(localtime=True)
     msg['Subject'] = subject
     msg.attach(text.MIMEText(message, 'html'))
+    return msg
+
+
+def send_mail(to, fro, subject, message, server="localhost", smtp=None):
+    """
+    Sends mail to SMTP relay which in return will send out to the recipients
+    :param to: Recipients email address
+    :param fro: Email address of sender 
+    :param subject: Subject Message
+    :param message: Message contents
+    :param server: IP Address or FQDN of the SMTP server
+    :param smtp: connected smtplib.SMTP session to send through; left open so it can be reused.
+                 If None a new connection to server is opened and closed for the message.
+    :return: 
+    """
+    msg = create_message(to, fro, subject, message)
+    if smtp is not None:
+        smtp.sendmail(fro, to, msg.as_string())
+        return
 
     smtp = smtplib.SMTP(server)
     smtp.sendmail(fro, to, msg.as_string())
     smtp.close()
-
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""
+Writes the static web files served from the psTrace html directory. Files are only rewritten
+when their content changes and are written atomically alongside pre-compressed .gz and,
+if the brotli module is installed, .br sidecars so that the web server does not need to
+compress them on every request.
+"""
+
+import gzip
+import io
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+def minify_json(data):
+    """
+    :param data: JSON serialisable object
+    :return: JSON string without indentation or whitespace between separators
+    """
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _gzip_compress(data):
+    """
+    :param data: bytes
+    :return: gzip compressed bytes with a fixed modification time so unchanged content compresses identically
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return buffer.getvalue()
+
+
+def _atomic_write(file_path, content):
+    """
+    Writes bytes to a temporary file and renames it over file_path so readers never see a partial file
+    :param file_path: file path to write to
+    :param content: bytes
+    :return: None
+    """
+    temp_file_path = "%s.tmp" % file_path
+    with open(temp_file_path, "wb") as file:
+        file.write(content)
+    os.replace(temp_file_path, file_path)
+
+
+def write_static_file(file_path, content, gzip_compress=False, brotli_compress=False):
+    """
+    Writes content to file_path along with compressed sidecars (file_path.gz, file_path.br).
+    Nothing is written if the file already holds the same content and the requested sidecars exist.
+    Sidecars which are no longer requested are removed so the web server cannot serve outdated content.
+    :param file_path: file path of the static file
+    :param content: str or bytes to write
+    :param gzip_compress: write a gzip compressed sidecar
+    :param brotli_compress: write a brotli compressed sidecar; ignored if the brotli module is not installed
+    :return: True if the file was written, False if it was unchanged
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    sidecars = []
+    if gzip_compress:
+        sidecars.append(("%s.gz" % file_path, _gzip_compress))
+    if brotli_compress and brotli is not None:
+        sidecars.append(("%s.br" % file_path, brotli.compress))
+    for stale_sidecar_fp in {"%s.gz" % file_path, "%s.br" % file_path} - {sidecar_fp for sidecar_fp, _ in sidecars}:
+        try:
+            os.remove(stale_sidecar_fp)
+        except FileNotFoundError:
+            pass
+
+    try:
+        with open(file_path, "rb") as file:
+            unchanged = file.read() == content
+    except FileNotFoundError:
+        unchanged = False
+    if unchanged and all(os.path.exists(sidecar_fp) for sidecar_fp, _ in sidecars):
+        return False
+
+    for sidecar_fp, compress in sidecars:
+        _atomic_write(sidecar_fp, compress(content))
+    _atomic_write(file_path, content)
+    return True
+
+
+def discard_static_file(file_path, content, **kwargs):
+    """
+    Used in place of write_static_file when static output is disabled
+    :return: False
+    """
+    return False
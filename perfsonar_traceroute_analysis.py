@@ -3,17 +3,10 @@
 TODO: Add Description
 """
 
-import argparse
-import datetime
+import functools
 import os.path
-import ipaddress
-import configparser
-import urllib.parse
-from urllib.error import HTTPError
-from classes.rdns import ReverseDNS
-from classes.pstrace import PsTrace
-from classes.base import Jinja2Template
-from lib import json_loader_saver
+import sys
+import time
 
 __author__ = "Simon Peter Green"
 __copyright__ = "Copyright (c) 2017 spgreen"
@@ -26,16 +19,65 @@ __status__ = "Development"
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read(os.path.join(BASE_DIR, 'config.ini'))
+CONFIG_FP = os.path.join(BASE_DIR, 'config.ini')
+CONFIG = None
+
+
+def load_config(file_path=CONFIG_FP):
+    """
+    Parses config.ini into the module settings. Called once the command line has been parsed so that
+    --help and the subcommands that do not need the settings neither pay for nor fail on them.
+    :param file_path: file path of config.ini
+    :return: ConfigParser of config.ini
+    """
+    global CONFIG, TESTING_PERIOD, THRESHOLD, HOP_WARN_RATIO
+    global EMAIL_ALERTS, EMAIL_TO, EMAIL_FROM, EMAIL_SUBJECT, SMTP_SERVER, SMTP_TIMEOUT
+    global EMAIL_DIGEST_WINDOW, EMAIL_MAX_EMAILS, EMAIL_RATE_PERIOD, EMAIL_QUEUE_SIZE
+    global OUTPUT_MODE, OUTPUT_BUNDLE_SHARDS, OUTPUT_GZIP, OUTPUT_BROTLI, OUTPUT_PUBLISH_INTERVAL
+    global RTT_STORE_ENABLED, RTT_SPARKLINE_PERIOD
+    global SAMPLING_FULL_RESOLUTION_PERIOD, SAMPLING_MAX_OLDER_TESTS
+    global SCHEDULER_ENABLED, SCHEDULER_MAX_AGE, SCHEDULER_PRIORITY_PERIOD
+    global BASELINE_MODE, BASELINE_PERIOD, BASELINE_BUCKET_SIZE, BASELINE_COMPRESSION
+    global BACKFILL_CHUNK_SIZE, BACKFILL_WORKERS, BACKFILL_TIMEOUT
+
+    import configparser
+    CONFIG = configparser.ConfigParser()
+    CONFIG.read(file_path)
+
+    TESTING_PERIOD = int(CONFIG['PERFSONAR']['MAX_TIME_BETWEEN_TESTS'])
+    THRESHOLD = float(CONFIG['ROUTE_COMPARISON']['THRESHOLD'])
+    EMAIL_ALERTS = int(CONFIG['EMAIL']['ALERTS'])
+    EMAIL_TO = CONFIG['EMAIL']['TO'].replace(' ', '').split(',')
+    EMAIL_FROM = CONFIG['EMAIL']['FROM']
+    EMAIL_SUBJECT = CONFIG['EMAIL']['SUBJECT']
+    SMTP_SERVER = CONFIG['EMAIL']['SMTP_SERVER']
+    SMTP_TIMEOUT = int(CONFIG['EMAIL']['SMTP_TIMEOUT'])
+    EMAIL_DIGEST_WINDOW = int(CONFIG['EMAIL']['DIGEST_WINDOW'])
+    EMAIL_MAX_EMAILS = int(CONFIG['EMAIL']['MAX_EMAILS'])
+    EMAIL_RATE_PERIOD = int(CONFIG['EMAIL']['RATE_PERIOD'])
+    EMAIL_QUEUE_SIZE = int(CONFIG['EMAIL']['QUEUE_SIZE'])
+    HOP_WARN_RATIO = float(CONFIG['HOP_INDEX']['WARN_RATIO'])
+    OUTPUT_MODE = CONFIG['OUTPUT']['MODE']
+    OUTPUT_BUNDLE_SHARDS = int(CONFIG['OUTPUT']['BUNDLE_SHARDS'])
+    OUTPUT_GZIP = int(CONFIG['OUTPUT']['GZIP'])
+    OUTPUT_BROTLI = int(CONFIG['OUTPUT']['BROTLI'])
+    OUTPUT_PUBLISH_INTERVAL = int(CONFIG['OUTPUT']['PUBLISH_INTERVAL'])
+    RTT_STORE_ENABLED = int(CONFIG['RTT_STORE']['ENABLED'])
+    RTT_SPARKLINE_PERIOD = int(CONFIG['RTT_STORE']['SPARKLINE_PERIOD'])
+    SAMPLING_FULL_RESOLUTION_PERIOD = int(CONFIG['SAMPLING']['FULL_RESOLUTION_PERIOD'])
+    SAMPLING_MAX_OLDER_TESTS = int(CONFIG['SAMPLING']['MAX_OLDER_TESTS'])
+    SCHEDULER_ENABLED = int(CONFIG['SCHEDULER']['ENABLED'])
+    SCHEDULER_MAX_AGE = int(CONFIG['SCHEDULER']['MAX_AGE'])
+    SCHEDULER_PRIORITY_PERIOD = int(CONFIG['SCHEDULER']['PRIORITY_PERIOD'])
+    BASELINE_MODE = CONFIG['BASELINE']['MODE']
+    BASELINE_PERIOD = int(CONFIG['BASELINE']['PERIOD'])
+    BASELINE_BUCKET_SIZE = int(CONFIG['BASELINE']['BUCKET_SIZE'])
+    BASELINE_COMPRESSION = int(CONFIG['BASELINE']['COMPRESSION'])
+    BACKFILL_CHUNK_SIZE = int(CONFIG['BACKFILL']['CHUNK_SIZE'])
+    BACKFILL_WORKERS = int(CONFIG['BACKFILL']['WORKERS'])
+    BACKFILL_TIMEOUT = int(CONFIG['BACKFILL']['TIMEOUT'])
+    return CONFIG
 
-TESTING_PERIOD = int(CONFIG['PERFSONAR']['MAX_TIME_BETWEEN_TESTS'])
-THRESHOLD = float(CONFIG['ROUTE_COMPARISON']['THRESHOLD'])
-EMAIL_ALERTS = int(CONFIG['EMAIL']['ALERTS'])
-EMAIL_TO = CONFIG['EMAIL']['TO'].replace(' ', '').split(',')
-EMAIL_FROM = CONFIG['EMAIL']['FROM']
-EMAIL_SUBJECT = CONFIG['EMAIL']['SUBJECT']
-SMTP_SERVER = CONFIG['EMAIL']['SMTP_SERVER']
 
 # Directories
 HTML_DIR = os.path.join(BASE_DIR, "html")
@@ -44,26 +86,44 @@ TEMPLATE_DIR = os.path.join(BASE_DIR, "html_templates")
 
 # HTML Folder
 FORCE_GRAPH_DATA_FP = os.path.join(HTML_DIR, "traceroute_force_graph.json")
+AS_GRAPH_DATA_FP = os.path.join(HTML_DIR, "as_graph.json")
 DASHBOARD_WEB_PAGE_FP = os.path.join(HTML_DIR, "index.html")
+BUNDLE_WEB_PAGE_FP = os.path.join(HTML_DIR, "traceroute.html")
+BUNDLE_DATA_DIR = os.path.join(HTML_DIR, "data")
 
 # JSON Folder
 REVERSE_DNS_FP = os.path.join(JSON_DIR, "rdns.json")
 PREVIOUS_ROUTE_FP = os.path.join(JSON_DIR, "previous_routes.json")
+HOP_BASELINES_DIR = os.path.join(JSON_DIR, "hop_baselines")
+HOP_INDEX_FP = os.path.join(JSON_DIR, "hop_index.json")
+AS_PATHS_FP = os.path.join(JSON_DIR, "as_paths.json")
+MATRIX_FP = os.path.join(JSON_DIR, "matrix.json")
+SCHEDULE_FP = os.path.join(JSON_DIR, "schedule.json")
+BACKFILL_FP = os.path.join(JSON_DIR, "backfill.json")
+RTT_STORE_DIR = os.path.join(JSON_DIR, "rtt")
 
 # Jinja2 Templates
 J2_EMAIL_TEMPLATE_FP = os.path.join(TEMPLATE_DIR, "email.html.j2")
 J2_TRACEROUTE_WEB_PAGE_FP = os.path.join(TEMPLATE_DIR, "traceroute.html.j2")
 J2_MATRIX_WEB_PAGE_FP = os.path.join(TEMPLATE_DIR, "matrix.html.j2")
+BUNDLE_WEB_PAGE_TEMPLATE_FP = os.path.join(TEMPLATE_DIR, "traceroute_bundle.html")
 
 
-def acquire_traceroute_tests(ps_node_urls, rdns_query, test_time_range=2400):
+def acquire_traceroute_tests(ps_node_urls, rdns_query, test_time_range=2400, retrieve_json=None):
     """
     Acquires all recent traceroute results from a PerfSONAR Measurement Archive
     :param ps_node_urls: Base URL of PerfSONAR MA
     :param test_time_range: time range in seconds of tests to retrieve
     :param rdns_query: Reverse DNS function
+    :param retrieve_json: function used to retrieve the MA archive listing, defaults to
+                          lib.json_loader_saver.retrieve_json_from_url
     :return: 
     """
+    import urllib.parse
+    from urllib.error import HTTPError
+    if retrieve_json is None:
+        from lib.json_loader_saver import retrieve_json_from_url as retrieve_json
+
     if not isinstance(test_time_range, int):
         raise ValueError
 
@@ -71,7 +131,7 @@ def acquire_traceroute_tests(ps_node_urls, rdns_query, test_time_range=2400):
     for url in ps_node_urls:
         ps_url = "https://%s/esmond/perfsonar/archive/?event-type=packet-trace&time-range=%d" % (url, TESTING_PERIOD)
         try:
-            traceroute_tests.extend(json_loader_saver.retrieve_json_from_url(ps_url))
+            traceroute_tests.extend(retrieve_json(ps_url))
         except HTTPError as error:
             print("%s - Unable to retrieve perfSONAR traceroute data from %s. Continuing..." % (error, url))
 
@@ -92,10 +152,13 @@ def create_matrix_html(source_list, destination_list, matrix, rdns_query):
     to retrieve each item from the matrix dictionary.
     :param source_list: Traceroute test source IPs
     :param destination_list: Traceroute test destination IPs
-    :param matrix: Dictionary containing basic traceroute test information (i.e. html file path and RTT)
+    :param matrix: Dictionary containing basic traceroute test information (i.e. html file path and RTT);
+                   cells with a status (pending or stale) are tagged with it as their class
     :param rdns_query: function that performs a Reverse DNS query
     :return:
     """
+    import ipaddress
+
     def ipv6_label(ip, domain):
         """
         Returns a domain name with IPv6 tagged to the end if the IP address is IPv6 otherwise it
@@ -105,7 +168,7 @@ def create_matrix_html(source_list, destination_list, matrix, rdns_query):
         :return: str
         """
         ip_version = ipaddress.ip_address(ip).version
-        return " ".join([domain, '(IPv6)']) if ip_version is 6 else domain
+        return " ".join([domain, '(IPv6)']) if ip_version == 6 else domain
 
     html = ['<tr><td>S/D</td>']
     for destination in destination_list:
@@ -117,77 +180,602 @@ def create_matrix_html(source_list, destination_list, matrix, rdns_query):
         html.append('<tr><td>{}</td>'.format(label))
         for destination in destination_list:
             try:
-                html.append('<td><a href="{fp_html}">{rtt}</a></td>'.format(**matrix[source][destination]))
+                cell = matrix[source][destination]
             except KeyError:
                 html.append('<td></td>')
+                continue
+            if cell.get('status'):
+                html.append('<td class="{status}" title="{status}">'.format(**cell))
+            else:
+                html.append('<td>')
+            html.append('<a href="{fp_html}">{rtt}</a>'.format(**cell))
+            if cell.get('sparkline'):
+                html.append('<br><svg width="60" height="14"><polyline points="{}" fill="none" '
+                            'stroke="#000064" stroke-width="1"/></svg>'.format(cell['sparkline']))
+            html.append('</td>')
         html.append('</tr>')
     return ''.join(html)
 
 
-def main(perfsonar_ma_url, time_period):
+def create_alert_queue():
     """
-    TODO: Add Description
-    :param perfsonar_ma_url:
-    :param time_period:
-    :return:
+    :return: AlertQueue configured by the EMAIL section of config.ini
     """
-    rdns = ReverseDNS()
-    # Loads reverse DNS information from a JSON file found at REVERSE_DNS_FP
-    rdns.update_from_json_file(REVERSE_DNS_FP)
-    rdns_query = rdns.query
+    from classes.alerts import AlertQueue
+    return AlertQueue(J2_EMAIL_TEMPLATE_FP, EMAIL_TO, EMAIL_FROM, EMAIL_SUBJECT, SMTP_SERVER,
+                      EMAIL_DIGEST_WINDOW, EMAIL_MAX_EMAILS, EMAIL_RATE_PERIOD, EMAIL_QUEUE_SIZE, SMTP_TIMEOUT)
+
+
+def render_dashboard(mesh, matrix_state, rdns_query, write_static_file):
+    """
+    Renders the matrix dashboard (index.html) of a mesh and, in bundle output mode, the bundle web page
+    :param mesh: Mesh of the dashboard
+    :param matrix_state: {'end_date':, 'source': [source IPs], 'destination': [destination IPs], 'matrix': matrix}
+                         and, while the run is in progress, 'progress': e.g. "12/40 pairs analysed"
+    :param rdns_query: function that performs a Reverse DNS query
+    :param write_static_file: function used to write the html directory files, see lib/static_output.py
+    :return: None
+    """
+    from classes.base import Jinja2Template
+    matrix_page = Jinja2Template(J2_MATRIX_WEB_PAGE_FP)
+    html_matrix_table = create_matrix_html(matrix_state['source'], matrix_state['destination'],
+                                           matrix_state['matrix'], rdns_query)
+    write_static_file(os.path.join(mesh.html_dir, os.path.basename(DASHBOARD_WEB_PAGE_FP)),
+                      matrix_page.render_template_output(matrix=html_matrix_table, end_date=matrix_state['end_date'],
+                                                         progress=matrix_state.get('progress'),
+                                                         refresh=OUTPUT_PUBLISH_INTERVAL if matrix_state.get('progress')
+                                                         else None))
+    if OUTPUT_MODE == 'bundle':
+        with open(BUNDLE_WEB_PAGE_TEMPLATE_FP, "r") as bundle_web_page:
+            write_static_file(os.path.join(mesh.html_dir, os.path.basename(BUNDLE_WEB_PAGE_FP)),
+                              bundle_web_page.read())
+
+
+def publish_progress(mesh, matrix_state, force_graph_data, rdns_query, write_static_file):
+    """
+    Re-emits the dashboard and force graph of a mesh while its run is in progress. Both files are written atomically
+    so the web server never serves a partially written file.
+    :param mesh: Mesh of the dashboard
+    :param matrix_state: matrix state, see render_dashboard
+    :param force_graph_data: force graph of the pairs analysed so far
+    :param rdns_query: function that performs a Reverse DNS query
+    :param write_static_file: function used to write the html directory files, see lib/static_output.py
+    :return: None
+    """
+    from lib import static_output
+    render_dashboard(mesh, matrix_state, rdns_query, write_static_file)
+    write_static_file(os.path.join(mesh.html_dir, os.path.basename(FORCE_GRAPH_DATA_FP)),
+                      static_output.minify_json(force_graph_data))
+    print("Published %s (%s)" % (os.path.join(mesh.html_dir, os.path.basename(DASHBOARD_WEB_PAGE_FP)),
+                                 matrix_state['progress']))
 
-    print("Acquiring traceroute tests... ")
 
-    traceroute_metadata = acquire_traceroute_tests(ps_node_urls=perfsonar_ma_url,
-                                                   rdns_query=rdns_query,
-                                                   test_time_range=time_period)
+def analyse_mesh(mesh, rdns, retrieve_json, write_static_file, hop_baselines=None, rtt_store=None,
+                 alert_queue=None, query_apis=(), retrieve_series=None, traceroute_metadata=None):
+    """
+    Analyses the traceroute tests of a mesh and writes its dashboard, web pages and state
+    :param mesh: Mesh to analyse
+    :param rdns: ReverseDNS object shared between meshes
+    :param retrieve_json: function used to retrieve JSON from the MAs e.g. ArchiveFetcher.retrieve_json_from_url
+    :param write_static_file: function used to write the html directory files, see lib/static_output.py
+    :param hop_baselines: HopBaselines store shared between meshes if BASELINE_MODE is sketch
+    :param rtt_store: RTTStore shared between meshes if enabled
+    :param alert_queue: AlertQueue route change alerts are sent through
+    :param query_apis: QueryAPIs updated with the results of the mesh
+    :param retrieve_series: function returning the TracerouteSeries of a packet-trace URL
+                            e.g. ArchiveFetcher.retrieve_series; if None retrieve_json is used
+    :param traceroute_metadata: tests of the mesh returned by acquire_traceroute_tests; acquired if None
+    :return: None
+    """
+    import datetime
+    from classes.bundle import PairBundles
+    from classes.pstrace import PsTrace
+    from lib import static_output
+    rdns_query = rdns.query
+
+    if traceroute_metadata is None:
+        print("Acquiring traceroute tests... ")
+        traceroute_metadata = acquire_traceroute_tests(ps_node_urls=mesh.perfsonar_urls,
+                                                       rdns_query=rdns_query,
+                                                       test_time_range=mesh.time_period,
+                                                       retrieve_json=retrieve_json)
 
-    ps_trace = PsTrace(PREVIOUS_ROUTE_FP, THRESHOLD, J2_EMAIL_TEMPLATE_FP)
+    previous_route_fp = os.path.join(mesh.json_dir, os.path.basename(PREVIOUS_ROUTE_FP))
+    hop_index_fp = os.path.join(mesh.json_dir, os.path.basename(HOP_INDEX_FP))
+    as_paths_fp = os.path.join(mesh.json_dir, os.path.basename(AS_PATHS_FP))
+    schedule_fp = os.path.join(mesh.json_dir, os.path.basename(SCHEDULE_FP))
+    bundle_dir = os.path.join(mesh.html_dir, os.path.basename(BUNDLE_DATA_DIR))
+    pair_bundles = PairBundles(OUTPUT_BUNDLE_SHARDS) if OUTPUT_MODE == 'bundle' else None
+    sampling_policy = None
+    if SAMPLING_FULL_RESOLUTION_PERIOD:
+        sampling_policy = (SAMPLING_FULL_RESOLUTION_PERIOD, SAMPLING_MAX_OLDER_TESTS)
+    scheduler = None
+    if SCHEDULER_ENABLED:
+        from classes.scheduler import PollScheduler
+        scheduler = PollScheduler(SCHEDULER_MAX_AGE, SCHEDULER_PRIORITY_PERIOD)
+        scheduler.update_from_json_file(schedule_fp)
+        if pair_bundles is not None:
+            # Pairs that are not due keep the details of their last retrieval
+            pair_bundles.load_bundles(bundle_dir)
+    ps_trace = PsTrace(previous_route_fp, mesh.threshold, J2_EMAIL_TEMPLATE_FP, hop_baselines, mesh.warn_ratio,
+                       write_static_file, pair_bundles, rtt_store, RTT_SPARKLINE_PERIOD, sampling_policy,
+                       alert_queue, retrieve_json, scheduler, retrieve_series)
+    # AS segments of pairs with an unchanged route are reused from the previous run
+    ps_trace.as_paths.update_from_json_file(as_paths_fp)
     ps_analysis = ps_trace.analysis
+    if scheduler is not None:
+        # Pairs with a recent route change are analysed first, followed by the most overdue pairs
+        traceroute_metadata = scheduler.schedule(traceroute_metadata, ps_trace.route_comparison)
 
+    os.makedirs(mesh.html_dir, exist_ok=True)
     source = set()
     destination = set()
     matrix = {}
+    # Pairs analysed this run; the first result of a pair listed by several MAs is kept
+    analysed = set()
+    publishing = OUTPUT_PUBLISH_INTERVAL > 0
+    if publishing:
+        # Every listed pair is pending until analysed, showing the result of the previous run if there is one
+        traceroute_metadata = list(traceroute_metadata)
+        previous_matrix = _load_json(os.path.join(mesh.json_dir, os.path.basename(MATRIX_FP)), {}).get('matrix', {})
+        for traceroute_test in traceroute_metadata:
+            source.add(traceroute_test['source'])
+            destination.add(traceroute_test['destination'])
+            previous_cell = previous_matrix.get(traceroute_test['source'], {}).get(traceroute_test['destination'],
+                                                                                  {'rtt': '', 'fp_html': ''})
+            matrix.setdefault(traceroute_test['source'], {})[traceroute_test['destination']] = \
+                dict(previous_cell, status='pending')
+    published = time.time()
     for traceroute_test in traceroute_metadata:
-        results = ps_analysis(traceroute_test, HTML_DIR, J2_TRACEROUTE_WEB_PAGE_FP)
+        results = ps_analysis(traceroute_test, mesh.html_dir, J2_TRACEROUTE_WEB_PAGE_FP)
+        if publishing and not results[2]['fp_html']:
+            # Unable to retrieve the test; its pending cell is marked stale once the run is finalised
+            continue
         source.add(results[0])
         destination.add(results[1])
-        matrix.setdefault(results[0], {}).setdefault(results[1], results[2])
+        if (results[0], results[1]) not in analysed:
+            analysed.add((results[0], results[1]))
+            matrix.setdefault(results[0], {})[results[1]] = results[2]
+        if publishing and time.time() - published >= OUTPUT_PUBLISH_INTERVAL:
+            publish_progress(mesh, {'end_date': datetime.datetime.now().strftime("%c"),
+                                    'progress': "%d/%d pairs analysed" % (len(analysed), len(traceroute_metadata)),
+                                    'source': sorted(source),
+                                    'destination': sorted(destination),
+                                    'matrix': matrix},
+                             ps_trace.force_graph.get_data(), rdns_query, write_static_file)
+            published = time.time()
     destination = sorted(list(destination))
     source = sorted(list(source))
+    for destinations in matrix.values():
+        for cell in destinations.values():
+            if cell.get('status') == 'pending':
+                cell['status'] = 'stale'
 
-    if not matrix:
-        print('No valid PerfSONAR Traceroute Measurement Archive(s)! Exiting...')
-        exit()
+    if not matrix or (publishing and not analysed):
+        print('No valid PerfSONAR Traceroute Measurement Archive(s) for %s!' % mesh.name)
+        return
 
-    if EMAIL_ALERTS and ps_trace.route_comparison.changed_routes:
-        ps_trace.route_comparison.send_email_alert(EMAIL_TO, EMAIL_FROM, EMAIL_SUBJECT, SMTP_SERVER)
+    ps_trace.finalise()
+    if scheduler is not None:
+        print("\n%d traceroute test(s) retrieved, %d not yet due" % (scheduler.fetched, scheduler.skipped))
+        if pair_bundles is not None:
+            pair_bundles.retain(PairBundles.pair_key(source_ip, destination_ip)
+                                for source_ip, destinations in matrix.items() for destination_ip in destinations)
+    if rtt_store is not None:
+        # Waits for the background rollups so the matrix sparklines include the latest tests
+        rtt_store.wait()
+        sparkline_start = time.time() - RTT_SPARKLINE_PERIOD
+        for source_ip, destinations in matrix.items():
+            for destination_ip, cell in destinations.items():
+                cell['sparkline'] = rtt_store.sparkline(source_ip, destination_ip, 86400, sparkline_start, 60, 14)
+    print("\nAS latency (median delta ms):")
+    for asn, as_stats in ps_trace.as_paths.get_data()['ases'].items():
+        print("AS{asn:<10} {hops:3} hops {pairs:3} pairs {median_delta}".format(asn=asn, **as_stats))
+    print("\nWorst hops:")
+    for hop_ip, hop_stats in ps_trace.network_index.worst_hops(count=5):
+        print("{ip:24} {as:6} {warn_pairs:3}/{pairs:<3} {median:8} {hostname}".format(
+            ip=hop_ip, **dict(hop_stats, pairs=len(hop_stats['pairs']))))
 
-    with open(DASHBOARD_WEB_PAGE_FP, "w") as web_matrix_file:
-        current_time = datetime.datetime.now().strftime("%c")
-        matrix_page = Jinja2Template(J2_MATRIX_WEB_PAGE_FP)
-        html_matrix_table = create_matrix_html(source, destination, matrix, rdns_query)
-        web_matrix_file.write(matrix_page.render_template_output(matrix=html_matrix_table, end_date=current_time))
+    matrix_state = {'end_date': datetime.datetime.now().strftime("%c"),
+                    'source': source,
+                    'destination': destination,
+                    'matrix': matrix}
+    render_dashboard(mesh, matrix_state, rdns_query, write_static_file)
+    write_static_file(os.path.join(mesh.html_dir, os.path.basename(FORCE_GRAPH_DATA_FP)),
+                      static_output.minify_json(ps_trace.force_graph.get_data()))
+    write_static_file(os.path.join(mesh.html_dir, os.path.basename(AS_GRAPH_DATA_FP)),
+                      static_output.minify_json(ps_trace.as_paths.graph()))
+    if pair_bundles is not None:
+        pair_bundles.save_bundles(bundle_dir, write_static_file)
+    for query_api in query_apis:
+        query_api.update(ps_trace, matrix, rdns)
 
-    # Dictionary + file path for data_store, rdns and route_comparison
-    data_to_save = ((ps_trace.force_graph, FORCE_GRAPH_DATA_FP),
-                    (rdns, REVERSE_DNS_FP),
-                    (ps_trace.route_comparison, PREVIOUS_ROUTE_FP))
+    os.makedirs(mesh.json_dir, exist_ok=True)
+    with open(os.path.join(mesh.json_dir, os.path.basename(MATRIX_FP)), "w") as matrix_file:
+        matrix_file.write(static_output.minify_json(matrix_state))
+    ps_trace.route_comparison.save_as_json_file(previous_route_fp)
+    ps_trace.network_index.save_as_json_file(hop_index_fp)
+    ps_trace.as_paths.save_as_json_file(as_paths_fp)
+    if scheduler is not None:
+        scheduler.save_as_json_file(schedule_fp)
+
+
+def main(perfsonar_ma_url, time_period, query_api=None, static_output_enabled=True, alert_queue=None, meshes=None):
+    """
+    TODO: Add Description
+    :param perfsonar_ma_url:
+    :param time_period:
+    :param query_api: QueryAPI updated with the results of the run; if several meshes are analysed it serves the
+                      first mesh and each mesh is served under /<mesh name>/, see QueryAPI.mesh
+    :param static_output_enabled: writes the html directory web pages and data if True
+    :param alert_queue: AlertQueue shared between runs; if None and email alerts are enabled, an alert queue
+                        is created for the run and its digest sent at the end of the run
+    :param meshes: list of Mesh objects analysed within this process; if None a single mesh of perfsonar_ma_url
+                   is analysed and its results written to the html and json directories
+    :return:
+    """
+    from classes.fetcher import ArchiveFetcher
+    from classes.mesh import Mesh
+    from classes.rdns import ReverseDNS
+    from lib import static_output
+    if meshes is None:
+        meshes = [Mesh('default', perfsonar_ma_url, time_period, THRESHOLD, HTML_DIR, JSON_DIR, HOP_WARN_RATIO)]
+
+    # Shared between meshes so overlapping MAs, metadata keys and hop IPs are only retrieved and resolved once
+    rdns = ReverseDNS()
+    # Loads reverse DNS information from a JSON file found at REVERSE_DNS_FP
+    rdns.update_from_json_file(REVERSE_DNS_FP)
+    fetcher = ArchiveFetcher()
+
+    hop_baselines = None
+    if BASELINE_MODE == 'sketch':
+        from classes.traceroute.baseline import HopBaselines
+        hop_baselines = HopBaselines(HOP_BASELINES_DIR, BASELINE_PERIOD, BASELINE_BUCKET_SIZE, BASELINE_COMPRESSION)
+
+    write_static_file = functools.partial(static_output.write_static_file,
+                                          gzip_compress=OUTPUT_GZIP, brotli_compress=OUTPUT_BROTLI)
+    if not static_output_enabled:
+        write_static_file = static_output.discard_static_file
+    rtt_store = None
+    if RTT_STORE_ENABLED:
+        from classes.rtt_store import RTTStore
+        rtt_store = RTTStore(RTT_STORE_DIR)
+    close_alert_queue = False
+    if EMAIL_ALERTS and alert_queue is None:
+        alert_queue, close_alert_queue = create_alert_queue(), True
+
+    # Longest time period first so a metadata key shared between meshes is retrieved once and filtered thereafter
+    meshes_tests = []
+    print("Acquiring traceroute tests... ")
+    for mesh in sorted(meshes, key=lambda mesh: mesh.time_period, reverse=True):
+        traceroute_metadata = list(acquire_traceroute_tests(ps_node_urls=mesh.perfsonar_urls,
+                                                            rdns_query=rdns.query,
+                                                            test_time_range=mesh.time_period,
+                                                            retrieve_json=fetcher.retrieve_json_from_url))
+        # Only the results of metadata keys listed by several meshes are kept between meshes
+        fetcher.plan(traceroute_test['api'] for traceroute_test in traceroute_metadata)
+        meshes_tests.append((mesh, traceroute_metadata))
+    for mesh, traceroute_metadata in meshes_tests:
+        query_apis = []
+        if query_api is not None:
+            if len(meshes) > 1:
+                query_apis.append(query_api.mesh(mesh.name))
+            if mesh is meshes[0]:
+                query_apis.append(query_api)
+        if len(meshes) > 1:
+            print("\n=== Mesh: %s ===" % mesh.name)
+        analyse_mesh(mesh, rdns, fetcher.retrieve_json_from_url, write_static_file, hop_baselines, rtt_store,
+                     alert_queue, query_apis, fetcher.retrieve_series, traceroute_metadata)
+        fetcher.release(traceroute_test['api'] for traceroute_test in traceroute_metadata)
+    print("\n%d MA request(s) for %d mesh(es)" % (fetcher.requests, len(meshes)))
+
+    # Dictionary + file path for data_store shared between meshes
+    data_to_save = ((rdns, REVERSE_DNS_FP),)
 
     for objects, file_path in data_to_save:
         objects.save_as_json_file(file_path)
+    if hop_baselines is not None:
+        hop_baselines.save()
+    if close_alert_queue:
+        # Sends the alerts of this run as a single digest before exiting
+        alert_queue.close()
+    print("Done")
+
+
+def select_meshes(names=None):
+    """
+    :param names: names of the meshes to select; None selects every mesh
+    :return: the [MESH:<name>] meshes of config.ini or, if none are defined, the default mesh
+    """
+    from classes.mesh import Mesh, meshes_from_config
+    default_mesh = Mesh('default', [], None, THRESHOLD, HTML_DIR, JSON_DIR, HOP_WARN_RATIO)
+    meshes = meshes_from_config(CONFIG, BASE_DIR, None, THRESHOLD, HOP_WARN_RATIO)
+    if names:
+        return [mesh for mesh in meshes + [default_mesh] if mesh.name in names]
+    return meshes or [default_mesh]
+
+
+def _load_json(file_path, default=None):
+    import json
+    try:
+        with open(file_path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def run(args):
+    """
+    run subcommand: retrieves and analyses the traceroute tests, optionally serving the query API
+    :param args: argparse namespace of the run subcommand
+    :return: exit status
+    """
+    config_meshes = None
+    time_periods = [args.time_period]
+    if not args.perfsonar_urls:
+        from classes.mesh import meshes_from_config
+        config_meshes = meshes_from_config(CONFIG, BASE_DIR, args.time_period, THRESHOLD, HOP_WARN_RATIO)
+        if not config_meshes:
+            print("ERROR: No PerfSONAR MA given and no meshes defined within config.ini.\nExiting...")
+            return 1
+        time_periods = [mesh.time_period for mesh in config_meshes]
+    if any(period is None or period < TESTING_PERIOD for period in time_periods):
+        print("ERROR: Time period is missing or less than the traceroute testing period (%d seconds)."
+              "\nExiting..." % TESTING_PERIOD)
+        return 1
+
+    if not args.serve:
+        main(args.perfsonar_urls, args.time_period, static_output_enabled=not args.no_static_output,
+             meshes=config_meshes)
+        return 0
+
+    import threading
+    from classes.api import QueryAPI, serve
+    api = QueryAPI()
+    host, _, port = args.serve.rpartition(':')
+    serve(api, host or '127.0.0.1', int(port))
+    # Shared between runs so that alerts are digested and rate limited across runs
+    alerts = create_alert_queue() if EMAIL_ALERTS else None
+    while True:
+        main(args.perfsonar_urls, args.time_period, api, not args.no_static_output, alerts, config_meshes)
+        if not args.interval:
+            threading.Event().wait()
+        time.sleep(args.interval)
+
+
+def render(meshes):
+    """
+    render subcommand: re-renders the dashboard of each mesh from the matrix saved by its last run,
+    e.g. after changing the matrix.html.j2 template, without retrieving any traceroute tests
+    :param meshes: list of Mesh objects
+    :return: exit status
+    """
+    from classes.rdns import ReverseDNS
+    from lib import static_output
+    rdns = ReverseDNS()
+    rdns.update_from_json_file(REVERSE_DNS_FP)
+    write_static_file = functools.partial(static_output.write_static_file,
+                                          gzip_compress=OUTPUT_GZIP, brotli_compress=OUTPUT_BROTLI)
+    rendered = 0
+    for mesh in meshes:
+        matrix_state = _load_json(os.path.join(mesh.json_dir, os.path.basename(MATRIX_FP)))
+        if matrix_state is None:
+            print("No saved matrix for mesh %s, run the analysis first" % mesh.name)
+            continue
+        render_dashboard(mesh, matrix_state, rdns.query, write_static_file)
+        rendered += 1
+        print("Rendered %s" % os.path.join(mesh.html_dir, os.path.basename(DASHBOARD_WEB_PAGE_FP)))
+    return 0 if rendered else 1
+
+
+def mesh_statistics(mesh):
+    """
+    Summarises the saved state of the last run of a mesh without importing the analysis subsystems
+    :param mesh: Mesh
+    :return: dict
+    """
+    matrix_state = _load_json(os.path.join(mesh.json_dir, os.path.basename(MATRIX_FP)), {})
+    previous_routes = _load_json(os.path.join(mesh.json_dir, os.path.basename(PREVIOUS_ROUTE_FP)), {})
+    hops = _load_json(os.path.join(mesh.json_dir, os.path.basename(HOP_INDEX_FP)), {})
+    as_paths = _load_json(os.path.join(mesh.json_dir, os.path.basename(AS_PATHS_FP)), {})
+
+    def warn_order(hop_item):
+        hop = hop_item[1]
+        return hop['warn_pairs'] / max(len(hop['pairs']), 1), hop['warn_pairs']
+
+    worst_hops = sorted((item for item in hops.items() if item[1].get('warn_pairs')), key=warn_order, reverse=True)
+    return {'mesh': mesh.name,
+            'end_date': matrix_state.get('end_date'),
+            'pairs': sum(len(destinations) for destinations in matrix_state.get('matrix', {}).values()),
+            'flapping_routes': sum(1 for destinations in previous_routes.values()
+                                   for comparison in destinations.values() if comparison.get('flapping')),
+            'hops': len(hops),
+            'slow_hops': sum(1 for hop in hops.values() if hop.get('status') == 'warn'),
+            'worst_hops': [{'ip': hop_ip, 'hostname': hop['hostname'], 'as': hop['as'],
+                            'warn_pairs': hop['warn_pairs'], 'pairs': len(hop['pairs']), 'median': hop['median']}
+                           for hop_ip, hop in worst_hops[:5]],
+            'ases': as_paths.get('ases', {})}
+
+
+def stats(meshes, as_json=False):
+    """
+    stats subcommand: prints the statistics of the last run of each mesh, see mesh_statistics
+    :param meshes: list of Mesh objects
+    :param as_json: prints JSON instead of text
+    :return: exit status; 1 if no mesh has been analysed
+    """
+    mesh_stats = [mesh_statistics(mesh) for mesh in meshes]
+    if as_json:
+        import json
+        print(json.dumps(mesh_stats, indent=4))
+    for summary in [] if as_json else mesh_stats:
+        print("{mesh}: {pairs} pairs, {flapping_routes} flapping routes, {slow_hops}/{hops} slow hops "
+              "(last run {end_date})".format(**summary))
+        for hop in summary['worst_hops']:
+            print("    {ip:24} {as:6} {warn_pairs:3}/{pairs:<3} {median:8} {hostname}".format(**hop))
+        for asn, as_stats in summary['ases'].items():
+            print("    AS{asn:<10} {hops:3} hops {pairs:3} pairs {median_delta}".format(asn=asn, **as_stats))
+    return 0 if any(summary['end_date'] for summary in mesh_stats) else 1
+
+
+def merge(output_fp, input_fps):
+    """
+    merge subcommand: merges JSON state files of separate runs (e.g. the rdns.json of separate cron jobs)
+    into one. Nested dictionaries are merged recursively; other values are taken from the last input file.
+    :param output_fp: file path of the merged JSON file
+    :param input_fps: file paths of the JSON files to merge, in order
+    :return: exit status
+    """
+    import json
+
+    def merge_dictionaries(target, source):
+        for key, value in source.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                merge_dictionaries(target[key], value)
+            else:
+                target[key] = value
+
+    merged = {}
+    for input_fp in input_fps:
+        data = _load_json(input_fp)
+        if not isinstance(data, dict):
+            print("ERROR: %s is not a JSON object" % input_fp)
+            return 1
+        merge_dictionaries(merged, data)
+    with open(output_fp, "w") as file:
+        json.dump(obj=merged, fp=file, indent=4)
+    print("Merged %d file(s) into %s" % (len(input_fps), output_fp))
+    return 0
+
+
+def backfill(ma_urls, start, end, chunk_size, workers):
+    """
+    backfill subcommand: imports the traceroute tests of a date range into the RTT store and, if BASELINE_MODE
+    is sketch, the hop baselines. Progress is checkpointed within BACKFILL_FP so an interrupted backfill of the
+    same start resumes where it stopped.
+    :param ma_urls: IPs or base domains of the perfSONAR MAs, or file:// URLs of local archive directories
+    :param start: epoch start of the date range
+    :param end: epoch end of the date range (exclusive)
+    :param chunk_size: seconds of tests retrieved per request
+    :param workers: amount of chunks retrieved in parallel
+    :return: exit status; 1 if no test was loaded
+    """
+    from classes.backfill import Backfill
+    from classes.rtt_store import RTTStore
+    if start >= end:
+        print("ERROR: The start of the date range must be before its end.\nExiting...")
+        return 1
+
+    rtt_store = RTTStore(RTT_STORE_DIR)
+    hop_baselines = None
+    if BASELINE_MODE == 'sketch':
+        from classes.traceroute.baseline import HopBaselines
+        hop_baselines = HopBaselines(HOP_BASELINES_DIR, BASELINE_PERIOD, BASELINE_BUCKET_SIZE, BASELINE_COMPRESSION)
+
+    def load(source_ip, destination_ip, series, chunk_range):
+        stored = rtt_store.append_series(source_ip, destination_ip, series)
+        if hop_baselines is not None:
+            # Tests older than the pair's baseline are added as well; the chunk is marked as covered
+            hop_baselines.update_from_series(source_ip, destination_ip, series, (chunk_range[0], chunk_range[1] - 1))
+        return stored
+
+    history = Backfill(start, end, chunk_size, workers, BACKFILL_TIMEOUT)
+    history.update_from_json_file(BACKFILL_FP)
+    loaded = history.run(ma_urls, load, BACKFILL_FP)
+    rtt_store.wait()
+    if hop_baselines is not None:
+        hop_baselines.save()
     print("Done")
+    return 0 if loaded else 1
+
+
+def _epoch_from_date(date):
+    """
+    argparse type of the backfill date range
+    :param date: date (YYYY-MM-DD) or epoch timestamp
+    :return: epoch timestamp
+    """
+    import argparse
+    import datetime
+    if date.isdigit():
+        return int(date)
+    try:
+        return int(datetime.datetime.strptime(date, "%Y-%m-%d").timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is neither a YYYY-MM-DD date nor an epoch timestamp" % date)
+
+
+SUBCOMMANDS = ('run', 'render', 'merge', 'stats', 'backfill')
+
+
+def cli(argv=None):
+    """
+    Command line entry point. Subsystems are imported by the subcommands that need them and config.ini is
+    only parsed once the command line has been parsed. Without a subcommand the run subcommand is used.
+    :param argv: command line arguments, defaults to sys.argv[1:]
+    :return: exit status
+    """
+    import argparse
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in SUBCOMMANDS + ('-h', '--help'):
+        argv.insert(0, 'run')
+
+    parser = argparse.ArgumentParser(description='psTrace perfSONAR traceroute analysis')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='Retrieves and analyses the traceroute tests (default)')
+    run_parser.add_argument('--time_period', '-t', help='Time period (in seconds) from current point in time. '
+                                                        'e.g. 1 day == 86400', type=int)
+    run_parser.add_argument('--perfsonar_urls', '-u', nargs='+',
+                            help='IP or base domain of the PerfSONAR MA. If not given, the [MESH:<name>] meshes '
+                                 'defined within config.ini are analysed')
+    run_parser.add_argument('--serve', '-s', metavar='[HOST:]PORT',
+                            help='Serves the analysis results through a read-only HTTP/JSON query API')
+    run_parser.add_argument('--interval', '-i', type=int,
+                            help='Repeats the analysis every INTERVAL seconds while serving the query API')
+    run_parser.add_argument('--no_static_output', action='store_true',
+                            help='Does not write the web pages and data within the html directory')
+
+    render_parser = subparsers.add_parser('render', help='Re-renders the dashboards from the last run')
+    render_parser.add_argument('--mesh', '-m', nargs='+', help='Names of the meshes to render')
+
+    stats_parser = subparsers.add_parser('stats', help='Prints the statistics of the last run')
+    stats_parser.add_argument('--mesh', '-m', nargs='+', help='Names of the meshes to print')
+    stats_parser.add_argument('--json', action='store_true', help='Prints JSON')
+
+    merge_parser = subparsers.add_parser('merge', help='Merges JSON state files e.g. rdns.json of separate runs')
+    merge_parser.add_argument('--output', '-o', required=True, help='File path of the merged JSON file')
+    merge_parser.add_argument('inputs', nargs='+', help='JSON files to merge; later files take precedence')
+
+    backfill_parser = subparsers.add_parser('backfill', help='Imports the traceroute history of a date range')
+    backfill_parser.add_argument('--perfsonar_urls', '-u', nargs='+',
+                                 help='IP or base domain of the PerfSONAR MA, or file:// URL of a local archive. '
+                                      'If not given, the MAs of the meshes defined within config.ini are used')
+    backfill_parser.add_argument('--start', required=True, type=_epoch_from_date,
+                                 help='Start of the date range, YYYY-MM-DD or epoch timestamp')
+    backfill_parser.add_argument('--end', type=_epoch_from_date,
+                                 help='End of the date range, YYYY-MM-DD or epoch timestamp. Defaults to now')
+    backfill_parser.add_argument('--chunk', type=int, help='Seconds of tests retrieved per request')
+    backfill_parser.add_argument('--workers', type=int, help='Amount of chunks retrieved in parallel')
+
+    args = parser.parse_args(argv)
+    if args.command == 'merge':
+        return merge(args.output, args.inputs)
+
+    load_config()
+    if args.command == 'render':
+        return render(select_meshes(args.mesh))
+    if args.command == 'stats':
+        return stats(select_meshes(args.mesh), args.json)
+    if args.command == 'backfill':
+        ma_urls = args.perfsonar_urls or sorted({url for mesh in select_meshes() for url in mesh.perfsonar_urls})
+        if not ma_urls:
+            print("ERROR: No PerfSONAR MA given and no meshes defined within config.ini.\nExiting...")
+            return 1
+        return backfill(ma_urls, args.start, args.end or int(time.time()), args.chunk or BACKFILL_CHUNK_SIZE,
+                        args.workers or BACKFILL_WORKERS)
+    return run(args)
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--time_period', '-t', help='Time period (in seconds) from current point in time. '
-                                                    'e.g. 1 day == 86400', type=int)
-    parser.add_argument('--perfsonar_urls', '-u', nargs='+', help='IP or base domain of the PerfSONAR MA')
-
-    args = parser.parse_args()
-    if args.time_period < TESTING_PERIOD:
-        print("ERROR: Time period (%d seconds) is less than the traceroute testing period (%d seconds)."
-              "\nExiting..." % (args.time_period, TESTING_PERIOD))
-        exit()
-    main(args.perfsonar_urls, args.time_period)
+    sys.exit(cli())
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+"""Provides the DebuggingSMTPServer class, a local SMTP server which records the emails it receives.
+
+Used by the AlertQueue tests to check the email alerts without an SMTP relay. Only the
+commands needed by smtplib to send an email are implemented and every recipient is accepted.
+"""
+
+import socketserver
+import threading
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single SMTP session
+    """
+    def _reply(self, code, text):
+        self.wfile.write(("%d %s\r\n" % (code, text)).encode('ascii'))
+
+    def handle(self):
+        with self.server.lock:
+            self.server.sessions += 1
+        self._reply(220, "psTrace debugging SMTP server")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().split(' ', 1)[0].upper()
+            if command in ('HELO', 'EHLO'):
+                self._reply(250, "localhost")
+            elif command == 'DATA':
+                self._reply(354, "End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in self.rfile:
+                    if data_line.rstrip(b'\r\n') == b'.':
+                        break
+                    data.append(data_line)
+                with self.server.lock:
+                    self.server.messages.append(b''.join(data).decode('utf-8', 'replace'))
+                self._reply(250, "OK")
+            elif command == 'QUIT':
+                self._reply(221, "Bye")
+                return
+            else:
+                # MAIL, RCPT, RSET and NOOP
+                self._reply(250, "OK")
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    SMTP server listening on a local port which counts its sessions and keeps every received email
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        :param host: IP address to listen on
+        :param port: port to listen on; 0 picks a free port
+        """
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self.messages = []
+
+    @property
+    def address(self):
+        """
+        :return: host:port of the server, as used for the SMTP server of an AlertQueue
+        """
+        return "%s:%d" % self.server_address[:2]
+
+    def start(self):
+        """
+        Serves in a background thread until shutdown() is called
+        :return: None
+        """
+        threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True).start()
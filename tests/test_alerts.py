@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+"""Tests of the AlertQueue digests, rate limit and SMTP session against a local debugging SMTP server."""
+
+import contextlib
+import io
+import socket
+import time
+import unittest
+from classes.alerts import AlertQueue
+from tests.smtp_debug import DebuggingSMTPServer
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+def alert(source_ip):
+    return {'source_ip': source_ip, 'destination_ip': '198.51.100.1', 'source_domain': source_ip,
+            'destination_domain': '198.51.100.1', 'previous_test_time': 1700000000,
+            'current_test_time': 1700000600, 'previous_and_current_route': [], 'status': 'CHANGE'}
+
+
+def unused_address():
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        return "127.0.0.1:%d" % unused.getsockname()[1]
+
+
+class AlertQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.server = DebuggingSMTPServer()
+        self.server.start()
+        self.output = contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+
+    def tearDown(self):
+        self.output.__exit__(None, None, None)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def alert_queue(self, smtp_server, digest_window=60, **kwargs):
+        alert_queue = AlertQueue('email.html.j2', ['root@localhost'], 'pstrace@localhost', 'Route change',
+                                 smtp_server, digest_window, smtp_timeout=5, **kwargs)
+        self.digests = []
+
+        def render(changed_routes):
+            # Renders without jinja2 so only the queue and SMTP handling are tested
+            self.digests.append(changed_routes)
+            return "%d route(s)" % len(changed_routes)
+        alert_queue.render_template_output = render
+        return alert_queue
+
+    def wait_for_messages(self, count, timeout):
+        deadline = time.time() + timeout
+        while len(self.server.messages) < count and time.time() < deadline:
+            time.sleep(0.05)
+        return len(self.server.messages)
+
+    def test_digests_rate_limited_through_one_session(self):
+        rate_period = 2.0
+        alert_queue = self.alert_queue(self.server.address, 0.5, max_emails=2, rate_period=rate_period)
+        for index in range(6):
+            alert_queue.put(alert('192.0.2.%d' % (10 + index % 2)))
+        # 6 alerts of 2 pairs sent as one digest after the digest window
+        self.assertEqual(self.wait_for_messages(1, 5), 1)
+        self.assertEqual([changed_route['changes'] for changed_route in self.digests[0]], [3, 3])
+
+        alert_queue.put(alert('192.0.2.10'))
+        self.assertTrue(alert_queue.flush(timeout=10))
+        alert_queue.put(alert('192.0.2.11'))
+        # The third digest within the rate period is held back until the rate period has passed
+        self.assertFalse(alert_queue.flush(timeout=10))
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.wait_for_messages(3, rate_period + 5), 3)
+        self.assertEqual(self.server.sessions, 1)
+        self.assertTrue(alert_queue.close(timeout=10))
+
+    def test_unsent_alerts_kept_until_sent(self):
+        alert_queue = self.alert_queue(unused_address())
+        alert_queue.put(alert('192.0.2.1'))
+        self.assertFalse(alert_queue.flush(timeout=10))
+        alert_queue.smtp_server = self.server.address
+        alert_queue.put(alert('192.0.2.2'))
+        self.assertTrue(alert_queue.close(timeout=10))
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn("2 route(s)", self.server.messages[0])
+
+    def test_worker_survives_render_error(self):
+        alert_queue = self.alert_queue(self.server.address)
+
+        def render_error(changed_routes):
+            raise RuntimeError("template error")
+        render = alert_queue.render_template_output
+        alert_queue.render_template_output = render_error
+        alert_queue.put(alert('192.0.2.1'))
+        self.assertFalse(alert_queue.flush(timeout=10))
+        alert_queue.render_template_output = render
+        self.assertTrue(alert_queue.close(timeout=10))
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_digest_held_back_by_rate_limit_not_reported_as_sent(self):
+        alert_queue = self.alert_queue(self.server.address, max_emails=1, rate_period=3600)
+        alert_queue.put(alert('192.0.2.1'))
+        self.assertTrue(alert_queue.flush(timeout=10))
+        alert_queue.put(alert('192.0.2.2'))
+        self.assertFalse(alert_queue.close(timeout=10))
+        self.assertEqual(len(self.server.messages), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+"""Tests of TracerouteAnalysis with a sampling policy and hop baselines."""
+
+import os.path
+import tempfile
+import unittest
+from classes.traceroute.analysis import TracerouteAnalysis
+from classes.traceroute.baseline import HopBaselines
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+TEST = {'api': "https://ps.example.net/esmond/perfsonar/archive/abc/packet-trace/base?time-range=86400",
+        'source': '192.0.2.1', 'destination': '198.51.100.1',
+        'source_domain': '192.0.2.1', 'destination_domain': '198.51.100.1'}
+LATEST_TS = 1700000000
+
+
+class SampledBaselineTest(unittest.TestCase):
+    def test_baselines_receive_tests_dropped_by_downsampling(self):
+        tests = 144
+        results = [{'ts': LATEST_TS - (tests - 1 - index) * 600,
+                    'val': [{'ip': '10.0.0.1', 'rtt': 1.0 + index % 7}, {'ip': TEST['destination'], 'rtt': 5.0}]}
+                   for index in range(tests)]
+        with tempfile.TemporaryDirectory() as directory:
+            hop_baselines = HopBaselines(os.path.join(directory, 'hop_baselines'), 2592000, 86400)
+            traceroute = TracerouteAnalysis(TEST, 'traceroute.html.j2', lambda url: results)
+            # Keeps the last hour in full and at most 10 older tests
+            traceroute.downsample(3600, 10)
+            self.assertLess(len(traceroute.trace_route_results), tests)
+            traceroute.perform_traceroute_analysis(hop_baselines)
+
+            hop_buckets = hop_baselines._pair(TEST['source'], TEST['destination'])['hops']['0_10.0.0.1']
+            self.assertEqual(sum(sketch.count for sketch in hop_buckets.values()), tests)
+            self.assertEqual(hop_baselines.update_from_series(TEST['source'], TEST['destination'],
+                                                              traceroute.retrieved_results), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
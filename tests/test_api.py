@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+"""Tests of the QueryAPI serving the results of several meshes."""
+
+import json
+import types
+import unittest
+from classes.api import QueryAPI
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+
+def analysis(source_ip, destination_ip):
+    """
+    :return: stand-in PsTrace and matrix of an analysis run of a single pair
+    """
+    route_comparison = types.SimpleNamespace(changed_routes=[], get_data=dict)
+    ps_trace = types.SimpleNamespace(latest_routes={}, route_comparison=route_comparison,
+                                     force_graph=types.SimpleNamespace(get_data=list),
+                                     network_index=types.SimpleNamespace(get_data=dict))
+    return ps_trace, {source_ip: {destination_ip: {'rtt': 1.0, 'fp_html': 'pair.html'}}}
+
+
+class MeshQueryAPITest(unittest.TestCase):
+    def query(self, api, path):
+        status, body, _ = api.response(path, '')
+        self.assertEqual(status, 200)
+        return json.loads(body.decode('utf-8'))
+
+    def test_every_mesh_served(self):
+        api = QueryAPI()
+        rdns = types.SimpleNamespace(get_data=dict)
+        core, edge = analysis('192.0.2.1', '198.51.100.1'), analysis('192.0.2.2', '198.51.100.2')
+        api.update(*core, rdns)
+        api.mesh('core').update(*core, rdns)
+        self.assertEqual(self.query(api, '/')['meshes'], ['core'])
+        api.mesh('edge').update(*edge, rdns)
+
+        self.assertEqual(self.query(api, '/')['meshes'], ['core', 'edge'])
+        self.assertEqual([cell['source'] for cell in self.query(api, '/matrix')], ['192.0.2.1'])
+        self.assertEqual([cell['source'] for cell in self.query(api, '/core/matrix')], ['192.0.2.1'])
+        self.assertEqual([cell['source'] for cell in self.query(api, '/edge/matrix')], ['192.0.2.2'])
+        self.assertIn('endpoints', self.query(api, '/edge'))
+        self.assertEqual(api.response('/other/matrix', '')[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
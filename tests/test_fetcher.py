@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+"""Tests of the ArchiveFetcher packet-trace cache shared between meshes."""
+
+import unittest
+import warnings
+from classes.fetcher import ArchiveFetcher
+from classes.traceroute.analysis import TracerouteAnalysis
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+TEST = {'api': "https://ps.example.net/esmond/perfsonar/archive/abc/packet-trace/base?time-range=86400",
+        'source': '192.0.2.1', 'destination': '198.51.100.1',
+        'source_domain': '192.0.2.1', 'destination_domain': '198.51.100.1'}
+LATEST_TS = 1700000000
+
+
+class SharedSeriesTest(unittest.TestCase):
+    def setUp(self):
+        with warnings.catch_warnings():
+            # PROTOCOL_TLSv1 is deprecated
+            warnings.simplefilter('ignore', DeprecationWarning)
+            self.fetcher = ArchiveFetcher()
+        results = [{'ts': LATEST_TS - (9 - index) * 600,
+                    'val': [{'ip': '10.0.0.1', 'rtt': 1.0 + index}, {'ip': TEST['destination'], 'rtt': 5.0}]}
+                   for index in range(10)]
+        self.retrieved = []
+
+        def retrieve(json_url):
+            self.retrieved.append(json_url)
+            return results
+        self.fetcher._retrieve = retrieve
+        # Planned by two meshes so the series is cached between them
+        self.fetcher.plan([TEST['api']])
+        self.fetcher.plan([TEST['api']])
+
+    def test_meshes_do_not_share_hop_statistics(self):
+        first = TracerouteAnalysis(TEST, 'traceroute.html.j2', retrieve_series=self.fetcher.retrieve_series)
+        first.perform_traceroute_analysis()
+        median = first.route_info[0]['median']
+        second = TracerouteAnalysis(TEST, 'traceroute.html.j2', retrieve_series=self.fetcher.retrieve_series)
+        self.assertEqual(len(self.retrieved), 1)
+        self.assertEqual(second.route_info[0]['median'], '')
+        second.route_info[0].update({'median': -1.0})
+        self.assertEqual(first.route_info[0]['median'], median)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+"""Tests of the HopIndex when a pair is analysed more than once within a run."""
+
+import unittest
+from classes.hop_index import HopIndex
+from classes.traceroute.analysis import TracerouteAnalysis
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+TEST = {'api': "https://ps.example.net/esmond/perfsonar/archive/abc/packet-trace/base?time-range=3600",
+        'source': '192.0.2.1', 'destination': '198.51.100.1',
+        'source_domain': '192.0.2.1', 'destination_domain': '198.51.100.1'}
+
+
+def esmond_results(second_hops):
+    """
+    :param second_hops: IP address of the second hop of each test
+    :return: esmond packet-trace results of a pair whose second hop changes between tests
+    """
+    return [{'ts': 1700000000 + index * 600,
+             'val': [{'ip': '10.0.0.1', 'rtt': 1.0 + index}, {'ip': second_hop, 'rtt': 2.0 + index},
+                     {'ip': TEST['destination'], 'rtt': 3.0 + index}]}
+            for index, second_hop in enumerate(second_hops)]
+
+
+def analyse(results, network_index=None):
+    traceroute = TracerouteAnalysis(TEST, 'traceroute.html.j2', lambda url: results)
+    if network_index is not None:
+        network_index.add_series(TEST['source'], TEST['destination'], traceroute.trace_route_results)
+    traceroute.perform_traceroute_analysis(network_index=network_index)
+    return traceroute
+
+
+class HopIndexTest(unittest.TestCase):
+    def test_pair_analysed_twice_matches_analysis_without_index(self):
+        network_index = HopIndex()
+        analyse(esmond_results(['10.0.0.2', '10.0.0.2', '10.0.0.2', '10.0.0.2']), network_index)
+        results = esmond_results(['10.0.0.3', '10.0.0.3', '10.0.0.3', '10.0.0.2'])
+        indexed = analyse(results, network_index)
+        not_indexed = analyse(results)
+        self.assertEqual(sorted(not_indexed.different_route_index), [0, 1, 2])
+        self.assertEqual(sorted(indexed.different_route_index), sorted(not_indexed.different_route_index))
+        self.assertEqual([dict(hop) for hop in indexed.route_info], [dict(hop) for hop in not_indexed.route_info])
+
+    def test_pair_analysed_twice_not_double_counted(self):
+        network_index = HopIndex()
+        results = esmond_results(['10.0.0.2'] * 4)
+        analyse(results, network_index)
+        analyse(results, network_index)
+        self.assertEqual(network_index.summarise()['10.0.0.2']['samples'], 4)
+
+    def test_hops_of_replaced_route_removed(self):
+        network_index = HopIndex()
+        analyse(esmond_results(['10.0.0.2'] * 2), network_index)
+        analyse(esmond_results(['10.0.0.3'] * 2), network_index)
+        self.assertNotIn('10.0.0.2', network_index.summarise())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""Tests of the RTTStore column files after interrupted writes and backfilled tests."""
+
+import os.path
+import tempfile
+import unittest
+from unittest import mock
+from classes.rtt_store import COLUMNS, RTTStore, _map_column
+from classes.traceroute.hop import TracerouteSeries
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+SOURCE, DESTINATION = '192.0.2.1', '198.51.100.1'
+LATEST_TS = 1700000000
+
+
+def series_of(timestamps):
+    """
+    :param timestamps: epoch timestamps of the tests
+    :return: TracerouteSeries of a test per timestamp with an end-to-end RTT of timestamp % 100
+    """
+    return TracerouteSeries.from_esmond([{'ts': timestamp,
+                                          'val': [{'ip': '10.0.0.1', 'rtt': 1.0},
+                                                  {'ip': DESTINATION, 'rtt': float(timestamp % 100)}]}
+                                         for timestamp in timestamps])
+
+
+class RTTStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.store = RTTStore(self._directory.name)
+        self.pair_directory = self.store._pair_directory(SOURCE, DESTINATION)
+
+    def tearDown(self):
+        self.store.wait()
+        self._directory.cleanup()
+
+    def columns(self):
+        """
+        :return: list of the values of each column file of the pair
+        """
+        return [_map_column(os.path.join(self.pair_directory, file_name), typecode).tolist()
+                for file_name, typecode in COLUMNS]
+
+    def test_interrupted_append_is_truncated(self):
+        self.store.append_series(SOURCE, DESTINATION, series_of([LATEST_TS, LATEST_TS + 60]))
+        # An append interrupted after writing the timestamp and part of the RTT of a test
+        with open(os.path.join(self.pair_directory, 'ts.bin'), 'ab') as column_file:
+            column_file.write((LATEST_TS + 90).to_bytes(8, 'little'))
+        with open(os.path.join(self.pair_directory, 'rtt.bin'), 'ab') as column_file:
+            column_file.write(b'\x00\x00')
+
+        self.assertEqual(self.store.append_series(SOURCE, DESTINATION, series_of([LATEST_TS + 120])), 1)
+        timestamps, rtts, paths = self.columns()
+        self.assertEqual(timestamps, [LATEST_TS, LATEST_TS + 60, LATEST_TS + 120])
+        self.assertEqual(rtts, [float(timestamp % 100) for timestamp in timestamps])
+        self.assertEqual(len(paths), 3)
+
+    def test_backfilled_chunks_are_merged_once(self):
+        self.store.append_series(SOURCE, DESTINATION, series_of([LATEST_TS]))
+        chunks = [[LATEST_TS - 600 * (chunk * 10 + index + 1) for index in range(10)] for chunk in range(5)]
+        with mock.patch.object(RTTStore, '_merge_tests', wraps=RTTStore._merge_tests) as merge_tests:
+            for chunk in chunks:
+                self.assertEqual(self.store.append_series(SOURCE, DESTINATION, series_of(chunk)), 10)
+            # A chunk loaded twice is not stored again
+            self.assertEqual(self.store.append_series(SOURCE, DESTINATION, series_of(chunks[0])), 0)
+            self.assertEqual(self.columns()[0], [LATEST_TS])
+            self.store.wait()
+        self.assertEqual(merge_tests.call_count, 1)
+        timestamps, rtts, _ = self.columns()
+        self.assertEqual(timestamps, sorted([LATEST_TS] + sum(chunks, [])))
+        self.assertEqual(rtts, [float(timestamp % 100) for timestamp in timestamps])
+        self.assertFalse(os.path.exists(os.path.join(self.pair_directory, 'pending.bin')))
+        self.assertEqual(sum(record[4] for record in self.store.rollups(SOURCE, DESTINATION, 86400)), 51)
+
+    def test_interrupted_merge_is_completed(self):
+        self.store.append_series(SOURCE, DESTINATION, series_of([LATEST_TS]))
+        self.store.append_series(SOURCE, DESTINATION, series_of([LATEST_TS - 600, LATEST_TS - 1200]))
+        # A merge interrupted after replacing the timestamp column only
+        replace = os.replace
+        replaced = []
+
+        def interrupted_replace(source, destination):
+            if replaced:
+                raise OSError('interrupted')
+            replaced.append(destination)
+            replace(source, destination)
+
+        with mock.patch('os.replace', side_effect=interrupted_replace):
+            with self.assertRaises(OSError):
+                self.store.flush()
+        self.assertTrue(os.path.exists(os.path.join(self.pair_directory, 'merge.journal')))
+
+        store = RTTStore(self._directory.name)
+        self.assertEqual(store.append_series(SOURCE, DESTINATION, series_of([LATEST_TS - 600, LATEST_TS + 60])), 1)
+        store.wait()
+        timestamps, rtts, _ = self.columns()
+        self.assertEqual(timestamps, [LATEST_TS - 1200, LATEST_TS - 600, LATEST_TS, LATEST_TS + 60])
+        self.assertEqual(rtts, [float(timestamp % 100) for timestamp in timestamps])
+        self.assertFalse(os.path.exists(os.path.join(self.pair_directory, 'merge.journal')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+"""Tests of the PollScheduler prioritisation of recently changed pairs."""
+
+import contextlib
+import io
+import unittest
+from classes.scheduler import PollScheduler
+from classes.traceroute.comparison import RouteComparison
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+TEST = {'api': "https://ps.example.net/esmond/perfsonar/archive/abc/packet-trace/base?time-range=3600",
+        'source': '192.0.2.1', 'destination': '198.51.100.1'}
+
+
+def traceroute_information(test_time, hop_ips):
+    return {'source_ip': TEST['source'], 'destination_ip': TEST['destination'],
+            'source_domain': TEST['source'], 'destination_domain': TEST['destination'], 'test_time': test_time,
+            'route_stats': [{'ip': hop_ip, 'hostname': hop_ip, 'as': 64500, 'rtt': 1.0} for hop_ip in hop_ips]}
+
+
+class PollSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1700000000
+        self.route_comparison = RouteComparison(0.5, 'email.html.j2')
+        self.scheduler = PollScheduler(max_age=21600, priority_period=86400)
+        # The test interval is 600 seconds and the latest test was retrieved 60 seconds ago
+        self.scheduler.learn(TEST, [self.now - 1260, self.now - 660, self.now - 60], now=self.now - 60)
+        self.scheduler.record(TEST, traceroute_information(self.now - 60, ['10.0.0.1']), {'rtt': 1.0, 'fp_html': ''})
+
+    def observe(self, *routes):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for index, hop_ips in enumerate(routes):
+                self.route_comparison.check_changes(traceroute_information(self.now - 600 * len(routes) + index,
+                                                                           hop_ips))
+
+    def test_stable_pair_not_fetched_before_due(self):
+        self.observe(['10.0.0.1', '10.0.0.2'], ['10.0.0.1', '10.0.0.2'], ['10.0.0.1', '10.0.0.2'])
+        self.scheduler.schedule([TEST], self.route_comparison, now=self.now)
+        self.assertFalse(self.scheduler.is_due(TEST, now=self.now))
+        self.assertTrue(self.scheduler.is_due(TEST, now=self.now + 600))
+
+    def test_changed_pair_prioritised(self):
+        self.observe(['10.0.0.1', '10.0.0.2'], ['10.0.0.1', '10.0.0.3'], ['10.0.0.1', '10.0.0.3'])
+        self.scheduler.schedule([TEST], self.route_comparison, now=self.now)
+        self.assertTrue(self.scheduler.is_due(TEST, now=self.now))
+
+    def test_change_outside_priority_period_not_prioritised(self):
+        self.observe(['10.0.0.1', '10.0.0.2'], ['10.0.0.1', '10.0.0.3'], ['10.0.0.1', '10.0.0.3'])
+        self.scheduler.schedule([TEST], self.route_comparison, now=self.now + 86400)
+        self.assertFalse(self.scheduler.is_due(TEST, now=self.now))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+"""Tests of the import time of perfsonar_traceroute_analysis and the subsystems it loads on import."""
+
+import os.path
+import statistics
+import subprocess
+import sys
+import unittest
+
+__author__ = "Simon Peter Green"
+__copyright__ = "Copyright (c) 2017 spgreen"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "0.5"
+__maintainer__ = "Simon Peter Green"
+__email__ = "simonpetergreen@singaren.net.sg"
+__status__ = "Development"
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules of the templating, email and HTTP/TLS subsystems which must not be loaded by importing the script
+LAZY_MODULES = ('jinja2', 'smtplib', 'email.mime.multipart', 'ssl', 'urllib.request', 'http.server',
+                'classes.pstrace', 'classes.base')
+# Maximum median import time in milliseconds
+IMPORT_BUDGET = 50.0
+
+
+def import_script():
+    """
+    Imports perfsonar_traceroute_analysis within a fresh interpreter
+    :return: import time in milliseconds, list of the LAZY_MODULES loaded on import
+    """
+    code = ("import sys, time; start = time.perf_counter(); import perfsonar_traceroute_analysis; "
+            "print((time.perf_counter() - start) * 1000); print(' '.join(m for m in %r if m in sys.modules))"
+            % (LAZY_MODULES,))
+    output = subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout.splitlines()
+    return float(output[0]), output[1].split() if len(output) > 1 else []
+
+
+class StartupTest(unittest.TestCase):
+    def test_lazy_modules_not_loaded_on_import(self):
+        self.assertEqual(import_script()[1], [])
+
+    def test_import_time_within_budget(self):
+        import_time = statistics.median(import_script()[0] for _ in range(5))
+        self.assertLessEqual(import_time, IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()